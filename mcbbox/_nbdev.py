@@ -23,7 +23,6 @@ index = {"fetch_data": "10_subcoco_utils.ipynb",
          "SubCocoParser": "15_subcoco_effdet_icevision_fastai.ipynb",
          "parse_subcoco": "15_subcoco_effdet_icevision_fastai.ipynb",
          "SaveModelDupBestCallback": "15_subcoco_effdet_icevision_fastai.ipynb",
-         "FastGPUMonitorCallback": "15_subcoco_effdet_icevision_fastai.ipynb",
          "gen_transforms_and_learner": "15_subcoco_effdet_icevision_fastai.ipynb",
          "run_training": "20_subcoco_lightning_utils.ipynb",
          "save_final": "50_subcoco_retinanet_lightning.ipynb.ipynb",
@@ -35,14 +34,193 @@ index = {"fetch_data": "10_subcoco_utils.ipynb",
          "train_model": "20_subcoco_lightning_utils.ipynb",
          "FRCNN": "30_subcoco_frcnn_lightning.ipynb",
          "EffDetModule": "40_subcoco_effdet_lightning.ipynb",
-         "RetinaNetModule": "50_subcoco_retinanet_lightning.ipynb.ipynb"}
+         "RetinaNetModule": "50_subcoco_retinanet_lightning.ipynb.ipynb",
+         "autocast_ctx": "20_subcoco_lightning_utils.ipynb",
+         "to_fp32": "20_subcoco_lightning_utils.ipynb",
+         "keep_fp32": "20_subcoco_lightning_utils.ipynb",
+         "rand_batch": "20_subcoco_lightning_utils.ipynb",
+         "bench_precision_modes": "20_subcoco_lightning_utils.ipynb",
+         "PRECISIONS": "20_subcoco_lightning_utils.ipynb",
+         "num_optimizer_steps": "20_subcoco_lightning_utils.ipynb",
+         "scale_lr": "20_subcoco_lightning_utils.ipynb",
+         "make_optimizer": "20_subcoco_lightning_utils.ipynb",
+         "BatchSizeSampler": "20_subcoco_lightning_utils.ipynb",
+         "collate_tuples": "20_subcoco_lightning_utils.ipynb",
+         "time_train_step": "20_subcoco_lightning_utils.ipynb",
+         "probe_workers": "20_subcoco_lightning_utils.ipynb",
+         "AnnoArrays": "10_subcoco_utils.ipynb",
+         "stats_arrays": "10_subcoco_utils.ipynb",
+         "worker_rss_mb": "20_subcoco_lightning_utils.ipynb",
+         "WorkerMemProbe": "20_subcoco_lightning_utils.ipynb",
+         "probe_worker_memory": "20_subcoco_lightning_utils.ipynb",
+         "boxes_within_bounds": "10_subcoco_utils.ipynb",
+         "files_found": "10_subcoco_utils.ipynb",
+         "bulk_lbs": "10_subcoco_utils.ipynb",
+         "cached_pickle": "10_subcoco_utils.ipynb",
+         "subcoco_tfms": "20_subcoco_lightning_utils.ipynb",
+         "PhaseTimer": "60_subcoco_benchmark.ipynb",
+         "bench_result": "60_subcoco_benchmark.ipynb",
+         "TRAIN_PHASES": "60_subcoco_benchmark.ipynb",
+         "EVAL_PHASES": "60_subcoco_benchmark.ipynb",
+         "cycle_dl": "60_subcoco_benchmark.ipynb",
+         "bench_lightning": "60_subcoco_benchmark.ipynb",
+         "FastaiPhaseTimer": "60_subcoco_benchmark.ipynb",
+         "bench_icevision_fastai": "60_subcoco_benchmark.ipynb",
+         "bench_pipeline": "60_subcoco_benchmark.ipynb",
+         "git_commit": "60_subcoco_benchmark.ipynb",
+         "run_benchmarks": "60_subcoco_benchmark.ipynb",
+         "LIGHTNING_PIPELINES": "60_subcoco_benchmark.ipynb",
+         "PIPELINES": "60_subcoco_benchmark.ipynb",
+         "synth_img": "12_subcoco_synth.ipynb",
+         "synth_imgs": "12_subcoco_synth.ipynb",
+         "gen_synth_coco": "12_subcoco_synth.ipynb",
+         "RollingHist": "14_subcoco_profile.ipynb",
+         "StageProfiler": "14_subcoco_profile.ipynb",
+         "active_profiler": "14_subcoco_profile.ipynb",
+         "profile_stage": "14_subcoco_profile.ipynb",
+         "brief": "14_subcoco_profile.ipynb",
+         "StageProfilerCallback": "20_subcoco_lightning_utils.ipynb",
+         "read_cpu_times": "13_subcoco_monitor.ipynb",
+         "proc_rss_mb": "13_subcoco_monitor.ipynb",
+         "proc_read_bytes": "13_subcoco_monitor.ipynb",
+         "child_pids": "13_subcoco_monitor.ipynb",
+         "gpu_stats": "13_subcoco_monitor.ipynb",
+         "ResourceMonitor": "13_subcoco_monitor.ipynb",
+         "FastResourceMonitorCallback": "15_subcoco_effdet_icevision_fastai.ipynb",
+         "ResourceMonitorCallback": "20_subcoco_lightning_utils.ipynb",
+         "import_times": "14_subcoco_profile.ipynb",
+         "import_cost": "14_subcoco_profile.ipynb",
+         "snapshot": "16_subcoco_checkpoint.ipynb",
+         "atomic_save": "16_subcoco_checkpoint.ipynb",
+         "link_or_copy": "16_subcoco_checkpoint.ipynb",
+         "CheckpointWriter": "16_subcoco_checkpoint.ipynb",
+         "AsyncModelCheckpoint": "20_subcoco_lightning_utils.ipynb",
+         "WeightStore": "17_subcoco_weights.ipynb",
+         "ALIGN": "17_subcoco_weights.ipynb",
+         "build_model": "17_subcoco_weights.ipynb",
+         "build_times": "17_subcoco_weights.ipynb",
+         "module_digest": "18_subcoco_features.ipynb",
+         "stack_features": "18_subcoco_features.ipynb",
+         "FeatureCache": "18_subcoco_features.ipynb",
+         "CachedFeatureDataModule": "20_subcoco_lightning_utils.ipynb",
+         "tile_starts": "19_subcoco_tiles.ipynb",
+         "tile_grid": "19_subcoco_tiles.ipynb",
+         "cut_tile": "19_subcoco_tiles.ipynb",
+         "box_overlap": "09_subcoco_box_ops.ipynb",
+         "class_aware_nms": "09_subcoco_box_ops.ipynb",
+         "merge_detections": "19_subcoco_tiles.ipynb",
+         "as_cpu_tensor": "19_subcoco_tiles.ipynb",
+         "predict_tiled": "19_subcoco_tiles.ipynb",
+         "tiles_per_image": "19_subcoco_tiles.ipynb",
+         "subcoco_full_res_tfms": "20_subcoco_lightning_utils.ipynb",
+         "run_info": "60_subcoco_benchmark.ipynb",
+         "append_results": "60_subcoco_benchmark.ipynb",
+         "bench_tiled": "60_subcoco_benchmark.ipynb",
+         "run_tiled_benchmarks": "60_subcoco_benchmark.ipynb",
+         "numpify": "10_subcoco_utils.ipynb",
+         "match_boxes": "10_subcoco_utils.ipynb",
+         "f1_scores": "10_subcoco_utils.ipynb",
+         "weighted_f1": "10_subcoco_utils.ipynb",
+         "F1Accumulator": "10_subcoco_utils.ipynb",
+         "TP": "10_subcoco_utils.ipynb",
+         "FP": "10_subcoco_utils.ipynb",
+         "FN": "10_subcoco_utils.ipynb",
+         "greedy_matches": "10_subcoco_utils.ipynb",
+         "box_pairs": "10_subcoco_utils.ipynb",
+         "pair_iou": "10_subcoco_utils.ipynb",
+         "best_pairs": "10_subcoco_utils.ipynb",
+         "cat_numpy": "10_subcoco_utils.ipynb",
+         "greedy_by_score": "10_subcoco_utils.ipynb",
+         "match_by_score": "10_subcoco_utils.ipynb",
+         "score_cutoffs": "10_subcoco_utils.ipynb",
+         "ThresholdSweep": "10_subcoco_utils.ipynb",
+         "pick_by_score": "10_subcoco_utils.ipynb",
+         "pad_to": "11_subcoco_errors.ipynb",
+         "ErrorAnalysis": "11_subcoco_errors.ipynb",
+         "ERROR_CATEGORIES": "11_subcoco_errors.ipynb",
+         "SIZE_BUCKETS": "11_subcoco_errors.ipynb",
+         "image_stats": "10_subcoco_utils.ipynb",
+         "merge_ann": "10_subcoco_utils.ipynb",
+         "save_stats": "10_subcoco_utils.ipynb",
+         "update_stats": "10_subcoco_utils.ipynb",
+         "hist_mean_std": "10_subcoco_utils.ipynb",
+         "map_images": "10_subcoco_utils.ipynb",
+         "box_table": "21_subcoco_box_stats.ipynb",
+         "box_quantiles": "21_subcoco_box_stats.ipynb",
+         "default_bins": "21_subcoco_box_stats.ipynb",
+         "box_histograms": "21_subcoco_box_stats.ipynb",
+         "BOX_QUANTITIES": "21_subcoco_box_stats.ipynb",
+         "anchor_shapes": "21_subcoco_box_stats.ipynb",
+         "wh_iou": "21_subcoco_box_stats.ipynb",
+         "kmeans_anchors": "21_subcoco_box_stats.ipynb",
+         "kmeans_1d": "21_subcoco_box_stats.ipynb",
+         "propose_anchors": "21_subcoco_box_stats.ipynb",
+         "anchor_fit": "21_subcoco_box_stats.ipynb",
+         "tune_anchors": "21_subcoco_box_stats.ipynb",
+         "effdet_anchors": "21_subcoco_box_stats.ipynb",
+         "FRCNN_ANCHORS": "21_subcoco_box_stats.ipynb",
+         "RETINANET_ANCHORS": "21_subcoco_box_stats.ipynb",
+         "label_histograms": "10_subcoco_utils.ipynb",
+         "ClassBalancedWeights": "20_subcoco_lightning_utils.ipynb",
+         "HardExampleWeights": "20_subcoco_lightning_utils.ipynb",
+         "HardExampleCallback": "20_subcoco_lightning_utils.ipynb",
+         "SAMPLINGS": "20_subcoco_lightning_utils.ipynb",
+         "hash_uniform": "22_subcoco_splits.ipynb",
+         "rarest_labels": "22_subcoco_splits.ipynb",
+         "split_positions": "22_subcoco_splits.ipynb",
+         "cached_split": "22_subcoco_splits.ipynb",
+         "split_img_ids": "22_subcoco_splits.ipynb",
+         "pred_arrays": "10_subcoco_utils.ipynb",
+         "label_colors": "23_subcoco_render.ipynb",
+         "to_uint8": "23_subcoco_render.ipynb",
+         "pixel_boxes": "23_subcoco_render.ipynb",
+         "draw_boxes": "23_subcoco_render.ipynb",
+         "l2bs_arrays": "23_subcoco_render.ipynb",
+         "PALETTE": "23_subcoco_render.ipynb",
+         "render_item": "23_subcoco_render.ipynb",
+         "contact_sheet": "23_subcoco_render.ipynb",
+         "write_sheet": "23_subcoco_render.ipynb",
+         "write_contact_sheets": "23_subcoco_render.ipynb",
+         "xywh_to_xyxy": "09_subcoco_box_ops.ipynb",
+         "xyxy_to_xywh": "09_subcoco_box_ops.ipynb",
+         "cxcywh_to_xyxy": "09_subcoco_box_ops.ipynb",
+         "xyxy_to_cxcywh": "09_subcoco_box_ops.ipynb",
+         "box_area": "09_subcoco_box_ops.ipynb",
+         "clip_boxes": "09_subcoco_box_ops.ipynb",
+         "aligned_overlap": "09_subcoco_box_ops.ipynb",
+         "box_iou": "09_subcoco_box_ops.ipynb",
+         "box_giou": "09_subcoco_box_ops.ipynb",
+         "pad_boxes": "09_subcoco_box_ops.ipynb",
+         "batched_nms": "09_subcoco_box_ops.ipynb",
+         "batched_soft_nms": "09_subcoco_box_ops.ipynb",
+         "as_box_tensor": "09_subcoco_box_ops.ipynb",
+         "as_input_type": "09_subcoco_box_ops.ipynb",
+         "overlap_of": "09_subcoco_box_ops.ipynb",
+         "nms_suppressors": "09_subcoco_box_ops.ipynb",
+         "to_device": "20_subcoco_lightning_utils.ipynb",
+         "PeakMemMeter": "13_subcoco_monitor.ipynb",
+         "seam_pairs": "19_subcoco_tiles.ipynb",
+         "ANNO_ARRAYS": "10_subcoco_utils.ipynb"}
 
 modules = ["subcoco_utils.py",
            "subcoco_effdet_icevision_fastai.py",
            "subcoco_lightning_utils.py",
            "subcoco_frcnn_lightning.py",
            "subcoco_effdet_lightning.py",
-           "subcoco_retnet_lightning.py"]
+           "subcoco_retnet_lightning.py",
+           "subcoco_benchmark.py",
+           "subcoco_synth.py",
+           "subcoco_profile.py",
+           "subcoco_monitor.py",
+           "subcoco_checkpoint.py",
+           "subcoco_weights.py",
+           "subcoco_features.py",
+           "subcoco_tiles.py",
+           "subcoco_errors.py",
+           "subcoco_box_stats.py",
+           "subcoco_splits.py",
+           "subcoco_render.py",
+           "subcoco_box_ops.py"]
 
 doc_url = "https://bguan.github.io/mcbbox"
 
@@ -0,0 +1,249 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 60_subcoco_benchmark.ipynb (unless otherwise specified).
+
+__all__ = ['PhaseTimer', 'bench_result', 'TRAIN_PHASES', 'EVAL_PHASES', 'cycle_dl', 'bench_lightning',
+           'FastaiPhaseTimer', 'bench_icevision_fastai', 'bench_pipeline', 'git_commit', 'run_info', 'append_results',
+           'run_benchmarks', 'LIGHTNING_PIPELINES', 'PIPELINES', 'bench_tiled', 'run_tiled_benchmarks']
+
+# Cell
+import json, platform, subprocess, time
+import multiprocessing
+import torch
+
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import List, Tuple
+
+# Cell
+from fastai.callback.core import CancelFitException, CancelTrainException, CancelValidException
+from fastai.callback.training import GradientAccumulation
+from fastai.callback.tracker import Callback, EarlyStoppingCallback
+from fastai.learner import Recorder
+from .subcoco_utils import *
+from .subcoco_synth import gen_synth_coco
+from .subcoco_monitor import PeakMemMeter
+from .subcoco_lightning_utils import (AbstractDetectorLightningModule, SubCocoDataModule, SubCocoDataset, collate_tuples,
+                                            subcoco_tfms, subcoco_full_res_tfms)
+from .subcoco_tiles import tiles_per_image
+from .subcoco_weights import WeightStore
+from .subcoco_frcnn_lightning import FRCNN
+from .subcoco_retnet_lightning import RetinaNetModule
+from .subcoco_effdet_lightning import EffDetModule
+from .subcoco_effdet_icevision_fastai import (parse_subcoco, gen_transforms_and_learner,
+                                                    SaveModelDupBestCallback, FastResourceMonitorCallback)
+
+# Cell
+TRAIN_PHASES = ('data', 'forward', 'backward', 'optimizer')
+EVAL_PHASES = ('predict', 'metric')
+
+class PhaseTimer():
+    def __init__(self): self.reset()
+
+    def reset(self): self.secs = defaultdict(float)
+
+    def add(self, phase:str, secs:float): self.secs[phase] += secs
+
+    @contextmanager
+    def __call__(self, phase:str):
+        start = time.perf_counter()
+        try: yield
+        finally: self.add(phase, time.perf_counter()-start)
+
+def bench_result(pipeline:str, timer:PhaseTimer, steps:int, val_batches:int, bs:int, **kwargs)->dict:
+    res = { 'pipeline': pipeline, 'steps': steps, 'val_batches': val_batches, 'bs': bs, **kwargs }
+    for phase in TRAIN_PHASES: res[f'{phase}_ms'] = 1000*timer.secs[phase]/max(1, steps)
+    for phase in EVAL_PHASES: res[f'{phase}_ms'] = 1000*timer.secs[phase]/max(1, val_batches)
+    train_secs = sum([ timer.secs[phase] for phase in TRAIN_PHASES ])
+    res['imgs_per_sec'] = steps*bs/train_secs if train_secs > 0 else 0.
+    return res
+
+# Cell
+def cycle_dl(dl):
+    if len(dl) <= 0: return
+    while True: yield from dl
+
+def bench_lightning(moduleClass:AbstractDetectorLightningModule, backbone_name:str, stats:CocoDatasetStats, img_dir:str,
+                    steps:int=10, warmup:int=2, val_batches:int=2, bs:int=2, img_sz:int=128, workers:int=0, lr:float=1e-3)->dict:
+    with PeakMemMeter() as mem:
+        torch.manual_seed(0)
+        train_tfms, val_tfms = subcoco_tfms(stats, img_sz)
+        dm = SubCocoDataModule(img_dir, stats, bs=bs, workers=workers, split_ratio=0.8, train_transforms=train_tfms, val_transforms=val_tfms)
+        model = moduleClass(backbone_name=backbone_name, num_classes=len(stats.lbl2name), img_sz=img_sz, bs=bs, lr=lr)
+        model.set_schedule(warmup+steps)
+        opt_conf = model.configure_optimizers()
+        optimizer, scheduler = opt_conf['optimizer'], opt_conf['lr_scheduler']['scheduler']
+
+        timer = PhaseTimer()
+        train_batches = cycle_dl(dm.train_dataloader())
+        for step in range(warmup+steps):
+            if step == warmup: timer.reset()
+            with timer('data'): batch = next(train_batches)
+            with timer('forward'): loss = model.training_step(batch, step)
+            if not torch.is_tensor(loss): continue # no usable boxes in batch
+            with timer('backward'): loss.backward()
+            with timer('optimizer'):
+                optimizer.step()
+                scheduler.step()
+                optimizer.zero_grad()
+
+        model.eval()
+        for _, (xs, ys) in zip(range(val_batches), cycle_dl(dm.val_dataloader())):
+            with timer('predict'): preds = model(xs)
+            with timer('metric'): model.metrics(preds, ys)
+        model.train()
+    return bench_result(moduleClass.__name__, timer, steps, val_batches, bs, backbone=backbone_name, img_sz=img_sz, workers=workers,
+                        peak_rss_mb=mem.peak_mb)
+
+# Cell
+class FastaiPhaseTimer(Callback):
+    order = Recorder.order+1
+
+    def __init__(self, timer:PhaseTimer, steps:int=10, warmup:int=2, val_batches:int=2):
+        self.timer, self.steps, self.warmup, self.val_batches = timer, steps, warmup, val_batches
+
+    def lap(self, phase:str=None):
+        now = time.perf_counter()
+        if phase is not None: self.timer.add(phase, now-self.last)
+        self.last = now
+
+    def before_fit(self):
+        self.n_train, self.n_val = 0, 0
+        self.lap()
+
+    def before_train(self): self.lap()
+    def before_validate(self): self.lap()
+    def before_batch(self): self.lap('data' if self.training else None)
+    def after_pred(self): self.lap('forward' if self.training else 'predict')
+    def after_loss(self): self.lap('forward' if self.training else 'predict')
+    def after_backward(self): self.lap('backward')
+    def after_step(self): self.lap('optimizer')
+
+    def after_batch(self):
+        if self.training:
+            self.lap('optimizer') # zero_grad
+            self.n_train += 1
+            if self.n_train == self.warmup: self.timer.reset()
+            if self.n_train >= self.warmup+self.steps: raise CancelTrainException()
+        else:
+            self.lap('metric')
+            self.n_val += 1
+            if self.n_val >= self.val_batches: raise CancelValidException()
+
+    def after_epoch(self):
+        self.lap('metric') # Recorder computes the epoch's metric values
+        raise CancelFitException()
+
+def bench_icevision_fastai(stats:CocoDatasetStats, steps:int=10, warmup:int=2, val_batches:int=2, bs:int=2,
+                           img_sz:int=128, workers:int=0, lr:float=1e-3)->dict:
+    with PeakMemMeter() as mem:
+        torch.manual_seed(0)
+        train_records, valid_records = parse_subcoco(stats)
+        _, learn, backbone_name = gen_transforms_and_learner(stats, train_records, valid_records, img_sz=img_sz, bs=bs, acc_cycs=1, num_workers=workers)
+        for cb_class in (GradientAccumulation, SaveModelDupBestCallback, EarlyStoppingCallback, FastResourceMonitorCallback): learn.remove_cb(cb_class)
+        learn.unfreeze() # same as Lightning pipelines, train all params
+
+        timer = PhaseTimer()
+        learn.fit(1, lr, cbs=FastaiPhaseTimer(timer, steps=steps, warmup=warmup, val_batches=val_batches))
+    return bench_result('IceVisionFastAI', timer, steps, val_batches, bs, backbone=backbone_name, img_sz=img_sz, workers=workers,
+                        peak_rss_mb=mem.peak_mb)
+
+# Cell
+LIGHTNING_PIPELINES = {
+    'frcnn': (FRCNN, 'fasterrcnn_resnet50_fpn'),
+    'retnet': (RetinaNetModule, 'retinanet_resnet50_fpn'),
+    'effdet': (EffDetModule, 'tf_efficientdet_lite0'),
+}
+PIPELINES = (*LIGHTNING_PIPELINES.keys(), 'effdet_ivf')
+
+def bench_pipeline(pipeline:str, stats:CocoDatasetStats, img_dir:str, **kwargs)->dict:
+    torch.set_num_threads(kwargs.pop('threads', torch.get_num_threads()))
+    if pipeline in LIGHTNING_PIPELINES:
+        res = bench_lightning(*LIGHTNING_PIPELINES[pipeline], stats, img_dir, **kwargs)
+    else:
+        res = bench_icevision_fastai(stats, **kwargs)
+    res['pipeline'] = pipeline
+    return res
+
+def git_commit()->str:
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception: return None
+
+def run_info(n_imgs:int)->dict:
+    return { 'commit': git_commit(), 'time': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+             'torch': torch.__version__, 'threads': torch.get_num_threads(), 'n_imgs': n_imgs }
+
+def append_results(results:List[dict], out_fpath:str):
+    Path(out_fpath).parent.mkdir(parents=True, exist_ok=True)
+    with open(out_fpath, 'a') as out_f:
+        for res in results: out_f.write(json.dumps(res)+'\n')
+
+def run_benchmarks(pipelines=PIPELINES, datadir:str='workspace', n_imgs:int=32, img_sz:int=128, bs:int=2, steps:int=10, warmup:int=2,
+                   val_batches:int=2, workers:int=0, out_fpath:str='workspace/train_throughput.jsonl')->List[dict]:
+    train_json, img_dir = gen_synth_coco(datadir, froot='synth_bench', n_imgs=n_imgs, img_sizes=((160, 120),), n_cats=3,
+                                         boxs_per_img=(1, 4), box_ratio=(0.15, 0.5))
+    stats = load_stats(train_json, img_dir=img_dir, force_reload=True)
+    info = run_info(n_imgs)
+    kwargs = dict(steps=steps, warmup=warmup, val_batches=val_batches, bs=bs, img_sz=img_sz, workers=workers, threads=info['threads'])
+    results = []
+    for pipeline in pipelines:
+        try:
+            with multiprocessing.get_context('spawn').Pool(1) as pool:
+                res = pool.apply(bench_pipeline, (pipeline, stats, img_dir), kwargs)
+        except Exception as e:
+            print(f"Benchmark of {pipeline} failed: {e}")
+            res = { 'pipeline': pipeline, 'error': repr(e) }
+        res.update(info)
+        print(json.dumps(res))
+        results.append(res)
+    append_results(results, out_fpath)
+    return results
+
+# Cell
+def bench_tiled(moduleClass:AbstractDetectorLightningModule, backbone_name:str, stats:CocoDatasetStats, img_dir:str,
+                img_sz:int=128, overlaps:Tuple[int]=(0, 32), n_imgs:int=8, bs:int=4, ckpt_fpath:str=None)->List[dict]:
+    torch.manual_seed(0)
+    model = moduleClass(backbone_name=backbone_name, num_classes=len(stats.lbl2name), img_sz=img_sz, bs=bs, pretrained=ckpt_fpath is None)
+    if ckpt_fpath: model.load_state_dict(WeightStore().load_checkpoint(ckpt_fpath))
+    model.eval()
+    _, val_tfms = subcoco_tfms(stats, img_sz)
+    img_ids = list(stats.img2sz.keys())[:n_imgs]
+    results = []
+    for overlap in (None, *overlaps): # None is the whole image resized
+        ds = SubCocoDataset(img_dir, stats, img_ids=img_ids, bbox_aware_tfms=val_tfms if overlap is None else subcoco_full_res_tfms(stats))
+        timer, n_tiles, metrics = PhaseTimer(), 0, []
+        for start in range(0, len(ds), bs):
+            xs, ys = collate_tuples([ ds[i] for i in range(start, min(start+bs, len(ds))) ])
+            with timer('predict'):
+                preds = model(list(xs)) if overlap is None else model.predict_tiled(list(xs), overlap=overlap, bs=bs)
+            n_tiles += len(xs) if overlap is None else sum([ tiles_per_image(x.shape[1], x.shape[2], img_sz, overlap) for x in xs ])
+            with timer('metric'): metrics.append(model.metrics(preds, ys, full_res=overlap is not None))
+        metrics = torch.cat(metrics)
+        results.append({ 'pipeline': moduleClass.__name__, 'backbone': backbone_name, 'img_sz': img_sz,
+                         'mode': 'resized' if overlap is None else 'tiled', 'overlap': overlap, 'tiles_per_img': n_tiles/len(ds),
+                         'predict_ms_per_img': 1000*timer.secs['predict']/len(ds), 'f1': metrics[:,0].mean().item(), 'coco': metrics[:,1].mean().item() })
+    return results
+
+def run_tiled_benchmarks(pipelines=tuple(LIGHTNING_PIPELINES), datadir:str='workspace', n_imgs:int=8, img_size:Tuple[int, int]=(512, 384),
+                         img_sz:int=128, overlaps:Tuple[int]=(0, 32), bs:int=4, ckpt_fpaths:dict={},
+                         out_fpath:str='workspace/tiled_eval.jsonl')->List[dict]:
+    train_json, img_dir = gen_synth_coco(datadir, froot='synth_tiled', n_imgs=n_imgs, img_sizes=(img_size,), n_cats=3,
+                                         boxs_per_img=(2, 8), box_ratio=(0.03, 0.1))
+    stats = load_stats(train_json, img_dir=img_dir, force_reload=True)
+    info = run_info(n_imgs)
+    results = []
+    for pipeline in pipelines:
+        moduleClass, backbone_name = LIGHTNING_PIPELINES[pipeline]
+        try:
+            with multiprocessing.get_context('spawn').Pool(1) as pool:
+                pipeline_results = pool.apply(bench_tiled, (moduleClass, backbone_name, stats, img_dir),
+                                              dict(img_sz=img_sz, overlaps=overlaps, n_imgs=n_imgs, bs=bs, ckpt_fpath=ckpt_fpaths.get(pipeline)))
+        except Exception as e:
+            print(f"Tiled benchmark of {pipeline} failed: {e}")
+            pipeline_results = [{ 'error': repr(e) }]
+        for res in pipeline_results:
+            res.update(pipeline=pipeline, **info)
+            print(json.dumps(res))
+        results += pipeline_results
+    append_results(results, out_fpath)
+    return results
\ No newline at end of file
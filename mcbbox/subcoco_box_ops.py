@@ -0,0 +1,134 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 09_subcoco_box_ops.ipynb (unless otherwise specified).
+
+__all__ = ['as_box_tensor', 'as_input_type', 'xywh_to_xyxy', 'xyxy_to_xywh', 'cxcywh_to_xyxy', 'xyxy_to_cxcywh',
+           'box_area', 'clip_boxes', 'overlap_of', 'box_overlap', 'aligned_overlap', 'box_iou', 'box_giou', 'pad_boxes',
+           'nms_suppressors', 'batched_nms', 'batched_soft_nms', 'class_aware_nms']
+
+# Cell
+import numpy as np
+import torch
+
+from torch import Tensor
+from typing import List, Tuple
+
+# Cell
+def as_box_tensor(boxes)->Tuple[Tensor, bool]:
+    # shares memory w/ numpy input, which is converted back on the way out
+    return (torch.from_numpy(np.asarray(boxes)), True) if not isinstance(boxes, Tensor) else (boxes, False)
+
+def as_input_type(t:Tensor, was_numpy:bool):
+    return t.numpy() if was_numpy else t
+
+def xywh_to_xyxy(boxes):
+    b, np_in = as_box_tensor(boxes)
+    return as_input_type(torch.cat([b[..., :2], b[..., :2]+b[..., 2:]], dim=-1), np_in)
+
+def xyxy_to_xywh(boxes):
+    b, np_in = as_box_tensor(boxes)
+    return as_input_type(torch.cat([b[..., :2], b[..., 2:]-b[..., :2]], dim=-1), np_in)
+
+def cxcywh_to_xyxy(boxes):
+    b, np_in = as_box_tensor(boxes)
+    return as_input_type(torch.cat([b[..., :2]-b[..., 2:]/2, b[..., :2]+b[..., 2:]/2], dim=-1), np_in)
+
+def xyxy_to_cxcywh(boxes):
+    b, np_in = as_box_tensor(boxes)
+    return as_input_type(torch.cat([(b[..., :2]+b[..., 2:])/2, b[..., 2:]-b[..., :2]], dim=-1), np_in)
+
+def box_area(boxes):
+    b, np_in = as_box_tensor(boxes)
+    return as_input_type((b[..., 2]-b[..., 0]).clamp(min=0)*(b[..., 3]-b[..., 1]).clamp(min=0), np_in)
+
+def clip_boxes(boxes, max_x, max_y, min_size:float=0.):
+    "Boxes w/ x1 in [0, max_x-min_size], x2 in [x1+min_size, max_x], same for y, bounds per box if tensors"
+    b, np_in = as_box_tensor(boxes)
+    max_xy = torch.stack(torch.broadcast_tensors(torch.as_tensor(max_x, dtype=b.dtype), torch.as_tensor(max_y, dtype=b.dtype)), dim=-1)
+    xy1 = torch.min(b[..., :2].clamp(min=0), max_xy-min_size)
+    xy2 = torch.min(torch.max(b[..., 2:], xy1+min_size), max_xy)
+    return as_input_type(torch.cat([xy1, xy2], dim=-1), np_in)
+
+# Cell
+def overlap_of(area_a:Tensor, area_b:Tensor, lt:Tensor, rb:Tensor, hull_lt:Tensor, hull_rb:Tensor, metric:str)->Tensor:
+    inter = (rb-lt).clamp(min=0).prod(dim=-1)
+    if metric == 'ios': return inter/torch.min(area_a, area_b).clamp(min=1e-9)
+    union = area_a+area_b-inter
+    iou = inter/union.clamp(min=1e-9)
+    if metric == 'iou': return iou
+    assert metric == 'giou', f"Unknown overlap metric {metric}"
+    hull = (hull_rb-hull_lt).clamp(min=0).prod(dim=-1)
+    return iou - (hull-union)/hull.clamp(min=1e-9)
+
+def box_overlap(a, b, metric:str='iou'):
+    "Pairwise overlap of boxes `a` (..., n, 4) and `b` (..., m, 4), 'iou', 'giou' or intersection over the smaller box 'ios'"
+    (a, np_in), (b, _) = as_box_tensor(a), as_box_tensor(b)
+    a, b = a[..., :, None, :], b[..., None, :, :]
+    overlap = overlap_of(box_area(a), box_area(b), torch.max(a[..., :2], b[..., :2]), torch.min(a[..., 2:], b[..., 2:]),
+                       torch.min(a[..., :2], b[..., :2]), torch.max(a[..., 2:], b[..., 2:]), metric)
+    return as_input_type(overlap, np_in)
+
+def aligned_overlap(a, b, metric:str='iou'):
+    "Overlap of box i of `a` w/ box i of `b`, both (..., 4)"
+    (a, np_in), (b, _) = as_box_tensor(a), as_box_tensor(b)
+    overlap = overlap_of(box_area(a), box_area(b), torch.max(a[..., :2], b[..., :2]), torch.min(a[..., 2:], b[..., 2:]),
+                       torch.min(a[..., :2], b[..., :2]), torch.max(a[..., 2:], b[..., 2:]), metric)
+    return as_input_type(overlap, np_in)
+
+def box_iou(a, b): return box_overlap(a, b, 'iou')
+
+def box_giou(a, b): return box_overlap(a, b, 'giou')
+
+# Cell
+def pad_boxes(boxes:List[Tensor], scores:List[Tensor], labels:List[Tensor])->Tuple[Tensor, Tensor, Tensor, Tensor]:
+    "Boxes (images, n, 4), scores & labels (images, n) padded to the most boxes in an image, and the mask of the real ones"
+    n = max([ len(b) for b in boxes ], default=0)
+    mask = torch.arange(n)[None, :] < torch.tensor([ len(b) for b in boxes ], dtype=torch.long)[:, None]
+    pad = lambda ts, shape, dtype: torch.stack([ torch.cat([ torch.as_tensor(t, dtype=dtype).reshape(-1, *shape), torch.zeros(n-len(t), *shape, dtype=dtype) ]) for t in ts ]) \
+          if len(ts) > 0 else torch.zeros(0, n, *shape, dtype=dtype)
+    return pad(boxes, (4,), torch.float32), pad(scores, (), torch.float32), pad(labels, (), torch.long), mask
+
+def nms_suppressors(boxes:Tensor, labels:Tensor, mask:Tensor, iou_thr:float, metric:str)->Tensor:
+    # [image, i, j] box i, sorted by descending score, suppresses box j
+    same = (labels[:, :, None] == labels[:, None, :]) & mask[:, :, None] & mask[:, None, :]
+    return (box_overlap(boxes, boxes, metric) > iou_thr).triu_(diagonal=1) & same
+
+def batched_nms(boxes:Tensor, scores:Tensor, labels:Tensor, mask:Tensor=None, iou_thr:float=0.5, metric:str='iou')->Tensor:
+    "Mask of the boxes kept by class aware NMS of each image of padded (images, n, ...) boxes, scores and labels"
+    mask = torch.ones(scores.shape, dtype=torch.bool, device=scores.device) if mask is None else mask
+    order = torch.where(mask, scores, torch.full_like(scores, -float('inf'))).argsort(dim=1, descending=True, stable=True)
+    take = lambda t: t.gather(1, order[..., None].expand(-1, -1, 4) if t.dim() == 3 else order)
+    sup = nms_suppressors(take(boxes), take(labels), take(mask), iou_thr, metric)
+    kept = take(mask)
+    for _ in range(kept.shape[1]):
+        # position i is settled after i rounds, stops as soon as nothing changes
+        new_kept = take(mask) & ~(sup & kept[:, :, None]).any(dim=1)
+        if torch.equal(new_kept, kept): break
+        kept = new_kept
+    return torch.zeros_like(kept).scatter_(1, order, kept)
+
+def batched_soft_nms(boxes:Tensor, scores:Tensor, labels:Tensor, mask:Tensor=None, sigma:float=0.5, iou_thr:float=0.3,
+                     method:str='gaussian', score_thr:float=1e-3, metric:str='iou')->Tuple[Tensor, Tensor]:
+    "Decayed scores and the mask of boxes still above `score_thr`, class aware soft NMS of each image of a padded batch"
+    assert method in ['gaussian', 'linear'], f"Unknown soft NMS method {method}"
+    mask = torch.ones(scores.shape, dtype=torch.bool, device=scores.device) if mask is None else mask
+    overlap = box_overlap(boxes, boxes, metric)
+    same = (labels[:, :, None] == labels[:, None, :])
+    decayed = torch.where(mask, scores, torch.zeros_like(scores))
+    live = mask & (decayed > score_thr)
+    rows = torch.arange(len(scores), device=scores.device)
+    for _ in range(scores.shape[1]):
+        if not live.any(): break
+        # highest live score of each image, images w/ nothing left pick a dead box w/ no effect
+        pick = torch.where(live, decayed, torch.full_like(decayed, -float('inf'))).argmax(dim=1)
+        has_pick = live[rows, pick]
+        live[rows, pick] = False
+        iou = overlap[rows, pick] * (same[rows, pick] & has_pick[:, None])
+        weight = torch.exp(-iou**2/sigma) if method == 'gaussian' else torch.where(iou > iou_thr, 1-iou, torch.ones_like(iou))
+        decayed = torch.where(live, decayed*weight, decayed)
+        live &= decayed > score_thr
+    return decayed, mask & (decayed > score_thr)
+
+def class_aware_nms(boxes:Tensor, scores:Tensor, labels:Tensor, iou_thr:float=0.5, metric:str='iou')->Tensor:
+    "Indices of the boxes kept, in descending score order"
+    kept = batched_nms(boxes[None], scores[None], labels[None], iou_thr=iou_thr, metric=metric)[0]
+    idxs = kept.nonzero()[:, 0]
+    return idxs[scores[idxs].argsort(descending=True, stable=True)]
\ No newline at end of file
@@ -0,0 +1,128 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 21_subcoco_box_stats.ipynb (unless otherwise specified).
+
+__all__ = ['box_table', 'box_quantiles', 'default_bins', 'box_histograms', 'BOX_QUANTITIES', 'anchor_shapes', 'wh_iou',
+           'kmeans_anchors', 'kmeans_1d', 'propose_anchors', 'anchor_fit', 'tune_anchors', 'effdet_anchors',
+           'FRCNN_ANCHORS', 'RETINANET_ANCHORS']
+
+# Cell
+import numpy as np
+
+from typing import Dict, Tuple, Union
+from .subcoco_utils import *
+
+# Cell
+BOX_QUANTITIES = ('scale', 'aspect', 'w', 'h', 'cx', 'cy')
+
+def box_table(anno:AnnoArrays, img_sz:int=None, box_mask:np.ndarray=None)->Dict[str, np.ndarray]:
+    "Label, image position, scale, aspect, width, height and relative center of every box, in an `img_sz` x `img_sz` resized image if given"
+    img_pos = anno.box_img_pos()
+    labels, boxes = np.asarray(anno.box_labels, dtype=np.int64), np.asarray(anno.boxes, dtype=np.float64) # boxes as x,y,w,h
+    if box_mask is not None: img_pos, labels, boxes = img_pos[box_mask], labels[box_mask], boxes[box_mask]
+    img_szs = np.asarray(anno.img_sizes, dtype=np.float64)[img_pos]
+    w, h = boxes[:, 2], boxes[:, 3]
+    if img_sz: w, h = w*img_sz/img_szs[:, 0], h*img_sz/img_szs[:, 1]
+    return { 'labels': labels, 'img_pos': img_pos, 'scale': np.sqrt(w*h), 'aspect': h/np.maximum(w, 1e-9), 'w': w, 'h': h,
+             'cx': (boxes[:, 0]+boxes[:, 2]/2)/img_szs[:, 0], 'cy': (boxes[:, 1]+boxes[:, 3]/2)/img_szs[:, 1] }
+
+def box_quantiles(table:Dict[str, np.ndarray], qs:Tuple[float]=(.05, .25, .5, .75, .95), keys:Tuple[str]=BOX_QUANTITIES)->Dict[Union[int, str], dict]:
+    "Quantiles `qs` of each of `keys` per label and for 'all' boxes, interpolated like `np.quantile()`"
+    labels, qs = table['labels'], np.asarray(qs, dtype=np.float64)
+    uniq, counts = np.unique(labels, return_counts=True)
+    starts = np.cumsum(counts)-counts
+    res = { int(l): {} for l in uniq }
+    res['all'] = {}
+    for key in keys:
+        vals = table[key][np.lexsort((table[key], labels))]
+        # positions of quantiles in each label's sorted segment, all labels at once
+        pos = starts[:, None] + qs[None, :]*(counts[:, None]-1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo+1, (starts+counts-1)[:, None])
+        quants = vals[lo] + (vals[hi]-vals[lo])*(pos-lo)
+        for l, q in zip(uniq, quants): res[int(l)][key] = q
+        res['all'][key] = np.quantile(table[key], qs) if len(labels) > 0 else np.full(len(qs), np.nan)
+    return res
+
+def default_bins(key:str)->np.ndarray:
+    if key in ('cx', 'cy'): return np.linspace(0, 1, 11)
+    if key == 'aspect': return np.geomspace(1/8, 8, 13)
+    return np.geomspace(1, 1024, 21)
+
+def box_histograms(table:Dict[str, np.ndarray], key:str, bins:np.ndarray=None)->Tuple[np.ndarray, np.ndarray]:
+    "Bin edges and [label, bin] counts of `key`, values outside the edges count in the 1st or last bin"
+    bins = default_bins(key) if bins is None else np.asarray(bins)
+    idx = np.clip(np.searchsorted(bins, table[key], side='right')-1, 0, len(bins)-2)
+    n_labels = int(table['labels'].max(initial=0))+1
+    return bins, np.bincount(table['labels']*(len(bins)-1) + idx, minlength=n_labels*(len(bins)-1)).reshape(n_labels, len(bins)-1)
+
+# Cell
+FRCNN_ANCHORS = { 'sizes': ((32,), (64,), (128,), (256,), (512,)), 'aspect_ratios': ((0.5, 1.0, 2.0),)*5 }
+RETINANET_ANCHORS = { 'sizes': tuple([ (x, x*2**(1/3), x*2**(2/3)) for x in (32, 64, 128, 256, 512) ]), 'aspect_ratios': ((0.5, 1.0, 2.0),)*5 }
+
+def anchor_shapes(anchors:dict)->np.ndarray:
+    "(width, height) of every anchor shape over all levels"
+    return np.array([ (s/np.sqrt(r), s*np.sqrt(r)) for sizes, ratios in zip(anchors['sizes'], anchors['aspect_ratios'])
+                      for r in ratios for s in sizes ], dtype=np.float64)
+
+def wh_iou(wh:np.ndarray, anchors_wh:np.ndarray)->np.ndarray:
+    "[box, anchor] IoU of boxes and anchors given as (width, height), sharing a center"
+    inter = np.minimum(wh[:, None, 0], anchors_wh[None, :, 0])*np.minimum(wh[:, None, 1], anchors_wh[None, :, 1])
+    return inter/(wh.prod(1)[:, None] + anchors_wh.prod(1)[None, :] - inter)
+
+def kmeans_anchors(wh:np.ndarray, k:int, iters:int=100, seed:int=0)->np.ndarray:
+    "`k` (width, height) clusters of boxes w/ 1 - IoU as distance, by ascending area"
+    rng = np.random.default_rng(seed)
+    wh = wh[(wh > 0).all(1)]
+    assert len(wh) >= k, f"Need at least {k} boxes but got {len(wh)}"
+    # k-means++ seeding, boxes far from the clusters so far are likely next
+    centroids = wh[[rng.integers(len(wh))]]
+    for _ in range(1, k):
+        dist = 1 - wh_iou(wh, centroids).max(1)
+        p = dist/dist.sum() if dist.sum() > 0 else None
+        centroids = np.concatenate([centroids, wh[[rng.choice(len(wh), p=p)]]])
+    for _ in range(iters):
+        assign = wh_iou(wh, centroids).argmax(1)
+        new = np.array([ np.median(wh[assign == i], axis=0) if (assign == i).any() else centroids[i] for i in range(k) ])
+        if np.allclose(new, centroids): break
+        centroids = new
+    return centroids[np.argsort(centroids.prod(1))]
+
+def kmeans_1d(x:np.ndarray, k:int, iters:int=100)->np.ndarray:
+    "`k` ascending cluster means of values `x`, starting from evenly spaced quantiles"
+    centroids = np.quantile(x, (np.arange(k)+.5)/k)
+    for _ in range(iters):
+        assign = np.abs(x[:, None]-centroids[None, :]).argmin(1)
+        new = np.array([ x[assign == i].mean() if (assign == i).any() else centroids[i] for i in range(k) ])
+        if np.allclose(new, centroids): break
+        centroids = new
+    return np.sort(centroids)
+
+def propose_anchors(wh:np.ndarray, like:dict=FRCNN_ANCHORS, seed:int=0)->dict:
+    "Anchor sizes & aspect ratios fit to boxes (width, height), w/ as many levels, sizes per level and ratios as `like`"
+    n_levels, n_sizes, n_ratios = len(like['sizes']), len(like['sizes'][0]), len(like['aspect_ratios'][0])
+    wh = wh[(wh > 0).all(1)]
+    # sizes from IoU clusters, smallest to the highest resolution level, ratios shared by all levels like torchvision's
+    scales = np.sort(np.sqrt(kmeans_anchors(wh, n_levels*n_sizes, seed=seed).prod(1))).reshape(n_levels, n_sizes)
+    ratios = np.exp(kmeans_1d(np.log(wh[:, 1]/wh[:, 0]), n_ratios))
+    return { 'sizes': tuple([ tuple([ round(float(s), 1) for s in level ]) for level in scales ]),
+             'aspect_ratios': (tuple([ round(float(r), 3) for r in ratios ]),)*n_levels }
+
+def anchor_fit(wh:np.ndarray, anchors:dict, iou_thr:float=0.5)->Dict[str, float]:
+    "Mean best IoU of boxes w/ an anchor shape, fraction of boxes w/ one of at least `iou_thr`, and anchor shapes per box that reach it"
+    iou = wh_iou(wh, anchor_shapes(anchors))
+    return { 'mean_iou': float(iou.max(1).mean()), 'recall': float((iou.max(1) >= iou_thr).mean()),
+             'anchors_per_box': float((iou >= iou_thr).sum(1).mean()) }
+
+def tune_anchors(anno:AnnoArrays, img_sz:int=128, like:dict=FRCNN_ANCHORS, box_mask:np.ndarray=None, max_boxes:int=20000, seed:int=0)->dict:
+    "Anchors fit to the boxes of `anno` resized to `img_sz`, w/ the fit of them and of `like` on the same boxes"
+    table = box_table(anno, img_sz=img_sz, box_mask=box_mask)
+    wh = np.stack([table['w'], table['h']], axis=1)
+    wh = wh[(wh > 0).all(1)]
+    if len(wh) > max_boxes: wh = wh[np.random.default_rng(seed).choice(len(wh), max_boxes, replace=False)]
+    anchors = propose_anchors(wh, like=like, seed=seed)
+    return { **anchors, 'fit': anchor_fit(wh, anchors), 'like_fit': anchor_fit(wh, like) }
+
+def effdet_anchors(anchors:dict, min_level:int=3)->dict:
+    "EfficientDet `anchor_scale` & (width, height) `aspect_ratios` closest to anchors, w/ 1 size per level at stride 2**level"
+    scales = [ sizes[0]/2**(min_level+i) for i, sizes in enumerate(anchors['sizes']) ]
+    return { 'anchor_scale': float(np.exp(np.mean(np.log(scales)))),
+             'aspect_ratios': [ (float(1/np.sqrt(r)), float(np.sqrt(r))) for r in anchors['aspect_ratios'][0] ] }
\ No newline at end of file
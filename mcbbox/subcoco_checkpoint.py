@@ -0,0 +1,123 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 16_subcoco_checkpoint.ipynb (unless otherwise specified).
+
+__all__ = ['snapshot', 'atomic_save', 'link_or_copy', 'CheckpointWriter']
+
+# Cell
+import copy
+import os
+import queue
+import shutil
+import threading
+import time
+import torch
+
+from pathlib import Path
+from typing import Callable
+
+# Cell
+def snapshot(o):
+    # copy of a (nested) state w/ every tensor copied to cpu, training can go on changing the original
+    if isinstance(o, torch.Tensor): return o.detach().to('cpu', copy=True)
+    if isinstance(o, dict): return type(o)([ (k, snapshot(v)) for k, v in o.items() ])
+    if type(o) in (list, tuple): return type(o)([ snapshot(v) for v in o ])
+    return copy.deepcopy(o)
+
+def atomic_save(state, fpath):
+    fpath = Path(fpath)
+    tmp_fpath = fpath.parent/f'.{fpath.name}.{os.getpid()}.tmp'
+    with open(tmp_fpath, 'wb') as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_fpath, fpath)
+
+def link_or_copy(src, dst):
+    # dst shares src's bytes on disk where the filesystem allows, replaced atomically either way
+    dst = Path(dst)
+    tmp_dst = dst.parent/f'.{dst.name}.{os.getpid()}.lnk'
+    if os.path.lexists(tmp_dst): os.remove(tmp_dst)
+    try: os.link(src, tmp_dst)
+    except OSError: shutil.copyfile(src, tmp_dst)
+    os.replace(tmp_dst, dst)
+
+# Cell
+class CheckpointWriter():
+    def __init__(self, dirpath, keep_top:int=-1, keep_last:int=1, mode:str='min',
+                 best_alias:str=None, last_alias:str=None, max_pending:int=1):
+        assert mode in ('min', 'max'), f"mode must be min or max but got {mode}"
+        self.dirpath = Path(dirpath)
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        self.keep_top, self.keep_last, self.mode = keep_top, keep_last, mode
+        self.best_alias, self.last_alias = best_alias, last_alias
+        self.saved = [] # [(fpath, metric)] written and kept, oldest first
+        self.best_model_path, self.best_metric, self.last_model_path = None, None, None
+        self.stall_secs, self.write_secs, self.n_saves = 0., 0., 0
+        self.errors = []
+        self.pending = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self.run, daemon=True, name='CheckpointWriter')
+        self.thread.start()
+
+    def submit(self, fn:Callable, *args):
+        self.raise_errors()
+        self.pending.put((fn, args))
+
+    def save(self, state, fname:str, metric:float=None):
+        start = time.perf_counter()
+        self.submit(self.write, snapshot(state), self.dirpath/fname, metric)
+        self.stall_secs += time.perf_counter()-start
+        self.n_saves += 1
+
+    def link(self, fname:str, alias:str):
+        # after all pending saves, so fname is already written
+        self.submit(link_or_copy, self.dirpath/fname, self.dirpath/alias)
+
+    def run(self):
+        while True:
+            fn, args = self.pending.get()
+            try:
+                if fn is None: return
+                fn(*args)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.pending.task_done()
+
+    def better(self, metric:float, than:float)->bool:
+        return metric < than if self.mode == 'min' else metric > than
+
+    def write(self, state, fpath:Path, metric:float=None):
+        start = time.perf_counter()
+        atomic_save(state, fpath)
+        self.saved = [ (f, m) for f, m in self.saved if f != fpath ] + [(fpath, metric)]
+        self.last_model_path = fpath
+        if self.last_alias: link_or_copy(fpath, self.dirpath/self.last_alias)
+        if metric is not None and (self.best_metric is None or self.better(metric, self.best_metric)):
+            self.best_model_path, self.best_metric = fpath, metric
+            if self.best_alias: link_or_copy(fpath, self.dirpath/self.best_alias)
+        self.retain()
+        self.write_secs += time.perf_counter()-start
+
+    def retain(self):
+        if self.keep_top < 0: return
+        keep = { f for f, _ in self.saved[-self.keep_last:] } if self.keep_last > 0 else set()
+        ranked = sorted([ (m, f) for f, m in self.saved if m is not None ], reverse=self.mode == 'max')
+        keep |= { f for _, f in ranked[:self.keep_top] }
+        for f, _ in self.saved:
+            if f not in keep and os.path.isfile(f): os.remove(f) # aliases are hardlinks, they keep their data
+        self.saved = [ (f, m) for f, m in self.saved if f in keep ]
+
+    def wait(self):
+        self.pending.join()
+        self.raise_errors()
+
+    def close(self):
+        self.wait()
+        self.pending.put((None, ()))
+        self.thread.join()
+
+    def raise_errors(self):
+        if self.errors: raise self.errors.pop(0)
+
+    def describe(self)->str:
+        return (f"{self.n_saves} checkpoints, training stalled {self.stall_secs:.2f}s, "
+                f"written in background in {self.write_secs:.2f}s, kept {[ f.name for f, _ in self.saved ]}")
\ No newline at end of file
@@ -1,31 +1,16 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 15_subcoco_effdet_icevision_fastai.ipynb (unless otherwise specified).
 
-__all__ = ['SubCocoParser', 'parse_subcoco', 'SaveModelDupBestCallback', 'FastGPUMonitorCallback',
+__all__ = ['SubCocoParser', 'parse_subcoco', 'SaveModelDupBestCallback', 'FastResourceMonitorCallback',
            'gen_transforms_and_learner', 'run_training', 'save_final']
 
 # Cell
-import glob
-import json
-import matplotlib.pyplot as plt
-import numpy as np
 import os
-import pickle
-import PIL
-import re
-import requests
-import tarfile
 import sys
 import torch
 import torch.multiprocessing
 import torchvision
-import xml.etree.ElementTree
 
-from collections import defaultdict
-from IPython.utils import io
 from pathlib import Path
-from PIL import Image, ImageStat
-from shutil import copyfile, rmtree
-from tqdm import tqdm
 from typing import Hashable, List, Tuple, Union
 
 # Cell
@@ -37,56 +22,47 @@ import icevision.models.efficientdet as efficientdet
 import icevision.tfms as tfms
 
 from albumentations import ShiftScaleRotate
-from fastai.test_utils import synth_learner
 from fastai.learner import Learner
 from fastai.callback.training import GradientAccumulation
 from fastai.callback.tracker import Callback, EarlyStoppingCallback, SaveModelCallback
-from gpumonitor.monitor import GPUStatMonitor
+from fastai.torch_core import find_bs, get_model
 from icevision.core import BBox, ClassMap, BaseRecord
 from icevision.parsers import Parser
 from icevision.parsers.mixins import LabelsMixin, BBoxesMixin, FilepathMixin, SizeMixin
-from icevision.data import Dataset, RandomSplitter
+from icevision.data import Dataset, FixedSplitter
 from icevision.metrics.coco_metric import COCOMetricType, COCOMetric
 from icevision.utils import denormalize_imagenet
 from icevision.visualize.show_data import *
 
 from .subcoco_utils import *
-
-if torch.cuda.is_available():
-    monitor = GPUStatMonitor(delay=1)
-
-print(f"Python ver {sys.version}, torch {torch.__version__}, torchvision {torchvision.__version__}, fastai {fastai.__version__}, icevision {icevision.__version__}")
+from .subcoco_monitor import *
+from .subcoco_checkpoint import *
+from .subcoco_splits import *
 
 if is_notebook():
     from nbdev.showdoc import *
+    from fastai.test_utils import synth_learner
+    print(f"Python ver {sys.version}, torch {torch.__version__}, torchvision {torchvision.__version__}, fastai {fastai.__version__}, icevision {icevision.__version__}")
 
 # Cell
 class SubCocoParser(Parser, LabelsMixin, BBoxesMixin, FilepathMixin, SizeMixin):
     def __init__(self, stats:CocoDatasetStats, min_margin_ratio = 0, min_width_height_ratio = 0, quiet = True):
         self.stats = stats
-        self.data = [] # list of tuple of form (img_id, wth, ht, bbox, label_id, img_path)
-        skipped = 0
-        for img_id, imgfname in stats.img2fname.items():
-            imgf = stats.img_dir/imgfname
-            if not os.path.isfile(imgf):
-                skipped += 1
-                continue
-            width, height = stats.img2sz[img_id]
-            bboxs = []
-            lids = []
-            for lid, x, y, w, h in stats.img2lbs[img_id]:
-                if lid != None and box_within_bounds(x, y, w, h, width, height, min_margin_ratio, min_width_height_ratio):
-                    b = [int(x), int(y), int(w), int(h)]
-                    l = int(lid)
-                    bboxs.append(b)
-                    lids.append(l)
-                else:
-                    if not quiet: print(f"warning: skipping lxywh of {lid, x, y, w, h}")
-
-            if len(bboxs) > 0:
-                self.data.append( (img_id, width, height, bboxs, lids, imgf, ) )
-            else:
-                skipped += 1
+        anno = stats_arrays(stats)
+        box_mask = anno.safe_mask(min_margin_ratio, min_width_height_ratio) # shared w/ SubCocoDataset, stats untouched
+        poss = anno.img_pos(list(stats.img2fname.keys()))
+        poss = poss[files_found(stats.img_dir, anno.img_fnames[poss])]
+        if not quiet:
+            for lid, xywh in zip(*bulk_lbs(anno, poss, ~box_mask)[:2]): print(f"warning: skipping lxywh of {lid, *xywh}")
+
+        poss = poss[anno.safe_counts(min_margin_ratio, min_width_height_ratio)[poss] > 0]
+        lids, bboxs, offsets = bulk_lbs(anno, poss, box_mask)
+        bboxs = bboxs.astype(int)
+        # list of tuple of form (img_id, wth, ht, bbox, label_id, img_path), boxes and labels as slices of the bulk arrays
+        self.data = [ (img_id, width, height, bboxs[start:end], lids[start:end], stats.img_dir/fname.decode(), )
+                      for img_id, (width, height), fname, start, end
+                      in zip(anno.img_ids[poss].tolist(), anno.img_sizes[poss].tolist(), anno.img_fnames[poss], offsets[:-1], offsets[1:]) ]
+        skipped = stats.num_imgs - len(self.data)
 
         print(f"Skipped {skipped} out of {stats.num_imgs} images")
 
@@ -109,29 +85,53 @@ class SubCocoParser(Parser, LabelsMixin, BBoxesMixin, FilepathMixin, SizeMixin):
         return o[1]
 
     def labels(self, o) -> List[int]:
-        return o[4]
+        return o[4].tolist()
 
     def bboxes(self, o) -> List[BBox]:
-        return [BBox.from_xywh(x,y,w,h) for x,y,w,h in o[3]]
+        return [BBox.from_xywh(x,y,w,h) for x,y,w,h in o[3].tolist()]
 
     def image_width_height(self, o) -> Tuple[int, int]:
         img_id = o[0]
         return self.stats.img2sz[img_id]
 
 # Cell
-def parse_subcoco(stats:CocoDatasetStats)->List[List[BaseRecord]]:
-    parser = SubCocoParser(stats, min_width_height_ratio = 0.05) # no need min_margin_ratio = 0.05 as icevision autofix
-    train_records, valid_records = parser.parse(data_splitter=RandomSplitter([0.95, 0.05]), autofix=False)
+def parse_subcoco(stats:CocoDatasetStats, seed:int=42, valid_ratio:float=0.05, stratify:bool=True, force_reparse:bool=False)->List[List[BaseRecord]]:
+    min_margin_ratio, min_width_height_ratio = 0, 0.05 # no need min_margin_ratio = 0.05 as icevision autofix
+    def parse():
+        parser = SubCocoParser(stats, min_margin_ratio=min_margin_ratio, min_width_height_ratio=min_width_height_ratio)
+        # same split as SubCocoDataModule w/ the same seed, minus the images the parser skipped
+        parsed_ids = { o[0] for o in parser }
+        splits = [ [ img_id for img_id in img_ids if img_id in parsed_ids ] for img_ids in split_img_ids(stats, valid_ratio, seed, stratify) ]
+        return parser.parse(data_splitter=FixedSplitter(splits), autofix=False)
+
+    # records only change w/ the annotations, safe box setting and split, so reuse them across launches
+    key = f'{stats_arrays(stats).digest()[:16]}_m{min_margin_ratio:g}_s{min_width_height_ratio:g}_v{valid_ratio:g}_seed{seed}{"_strat" if stratify else ""}'
+    train_records, valid_records = cached_pickle(stats.img_dir.parent/'records'/f'{key}.pkl', parse, force_rebuild=force_reparse)
     return train_records, valid_records
 
 # Cell
 class SaveModelDupBestCallback(SaveModelCallback):
-    "Extend SaveModelCallback to save a duplicate with metric added to end of filename"
-    def __init__(self, monitor='valid_loss', comp=None, min_delta=0., fname='model', every_epoch=False, with_opt=False, reset_on_fit=True):
+    "Extend SaveModelCallback to save a duplicate with metric added to end of filename, written in background, duplicates are hardlinks"
+    def __init__(self, monitor='valid_loss', comp=None, min_delta=0., fname='model', every_epoch=False, with_opt=False, reset_on_fit=True,
+                 keep_backups:int=3):
         super().__init__(
             monitor=monitor, comp=comp, min_delta=min_delta, reset_on_fit=reset_on_fit,
             fname=fname, every_epoch=every_epoch, with_opt=with_opt,
         )
+        self.keep_backups = keep_backups
+        self.writer = None
+        self.backups = []
+
+    def before_fit(self):
+        super().before_fit()
+        if self.writer is None or self.writer.dirpath != self.path/self.model_dir: self.writer = CheckpointWriter(self.path/self.model_dir)
+
+    def _save(self, name):
+        # same file as Learner.save(), but only the snapshot blocks training
+        state = get_model(self.model).state_dict()
+        if self.with_opt and getattr(self, 'opt', None) is not None: state = {'model': state, 'opt': self.opt.state_dict()}
+        self.writer.save(state, f'{name}.pth')
+        self.last_saved_path = self.writer.dirpath/f'{name}.pth'
 
     def after_epoch(self):
         "Compare the value monitored to its best score and save if best."
@@ -143,22 +143,38 @@ class SaveModelDupBestCallback(SaveModelCallback):
             backup_file = backup_stem+(last_saved.suffix)
             backup_path = last_saved.parent / backup_file
             print(f'Backup {last_saved} as {backup_path}')
-            if last_saved != backup_path: copyfile(last_saved, backup_path)
+            if last_saved == backup_path or backup_path in self.backups: return
+            # saves replace the file atomically, so the hardlink keeps this epoch's weights
+            self.writer.link(last_saved.name, backup_file)
+            self.backups.append(backup_path)
+            if self.keep_backups >= 0 and len(self.backups) > self.keep_backups: self.writer.submit(os.remove, self.backups.pop(0))
+
+    def after_fit(self, **kwargs):
+        # wait for pending writes, the best model is loaded at the end of fit
+        self.writer.wait()
+        print(self.writer.describe())
+        super().after_fit(**kwargs)
 
 # Cell
-class FastGPUMonitorCallback(Callback):
-    def __init__(self, delay=1, display_options=None):
-        super(FastGPUMonitorCallback, self).__init__()
-        self.delay = delay
-        self.display_options = display_options if display_options else {}
+class FastResourceMonitorCallback(Callback):
+    def __init__(self, interval:float=1.0, monitor:ResourceMonitor=None):
+        super(FastResourceMonitorCallback, self).__init__()
+        self.monitor = monitor or ResourceMonitor(interval)
+
+    def before_fit(self): self.monitor.start()
 
     def before_epoch(self):
-        self.monitor = GPUStatMonitor(self.delay, self.display_options)
+        self.monitor.epoch_start()
+        self.n_items = 0
+
+    def after_batch(self):
+        if self.training: self.n_items += find_bs(self.xb)
 
     def after_epoch(self):
-        self.monitor.stop()
         print("")
-        self.monitor.display_average_stats_per_gpu()
+        self.monitor.epoch_end(self.n_items)
+
+    def after_fit(self): self.monitor.stop()
 
 def gen_transforms_and_learner(stats:CocoDatasetStats,
                                train_records:List[BaseRecord],
@@ -193,7 +209,7 @@ def gen_transforms_and_learner(stats:CocoDatasetStats,
         GradientAccumulation(bs*acc_cycs),
         SaveModelDupBestCallback(fname=save_model_fname, monitor=monitor_metric),
         EarlyStoppingCallback(monitor=monitor_metric, min_delta=0.001, patience=10),
-        FastGPUMonitorCallback(delay=1)
+        FastResourceMonitorCallback(interval=1)
     ]
 
     learn = efficientdet.fastai.learner(dls=[train_dl, valid_dl], model=model, metrics=metrics, cbs=callbacks)
@@ -210,7 +226,6 @@ def run_training(learn:Learner, resume_ckpt:Path, min_lr=0.005, head_runs=1, ful
             learn.model.load_state_dict(torch.load(resume_ckpt))
         except Exception as e:
             print(f'Error while trying to load {resume_ckpt}: {e}')
-    monitor.display_average_stats_per_gpu()
     print(f"Training for {head_runs}+{full_runs} epochs at min LR {min_lr}")
     learn.fine_tune(full_runs, min_lr, freeze_epochs=head_runs)
 
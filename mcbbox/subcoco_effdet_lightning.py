@@ -3,32 +3,14 @@
 __all__ = ['EffDetModule', 'save_final']
 
 # Cell
-import json, os, requests, sys, tarfile
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-import numpy as np
-import pickle
-import random
-
-from collections import defaultdict
-from functools import reduce
-from IPython.utils import io
-from pathlib import Path
-from PIL import Image
-from PIL import ImageStat
-
-from pycocotools.coco import COCO
-from pycocotools.cocoeval import COCOeval
-from tqdm import tqdm
-from typing import Hashable, List, Tuple, Union
-
-# Cell
+import sys
 import albumentations as A
 import cv2, torch, torchvision
 import pytorch_lightning as pl
 import torch.nn.functional as F
 import torch.multiprocessing
 from albumentations.pytorch import ToTensorV2
+from collections import OrderedDict
 from effdet.config.model_config import get_efficientdet_config
 from effdet.factory import create_model
 from effdet.bench import DetBenchPredict, DetBenchTrain, unwrap_bench
@@ -38,14 +20,17 @@ from torch.nn.modules import module
 from torch import optim
 from torch.utils.data import DataLoader, random_split
 from torchvision import transforms
+from typing import List, Union
 from .subcoco_utils import *
 from .subcoco_lightning_utils import *
+from .subcoco_profile import *
+from .subcoco_weights import *
+from .subcoco_box_stats import *
 
 torch.multiprocessing.set_sharing_strategy('file_system')
-print(f"Python ver {sys.version}, torch {torch.__version__}, torchvision {torchvision.__version__}, pytorch_lightning {pl.__version__}, Albumentation {A.__version__}")
-
 if is_notebook():
     from nbdev.showdoc import *
+    print(f"Python ver {sys.version}, torch {torch.__version__}, torchvision {torchvision.__version__}, pytorch_lightning {pl.__version__}, Albumentation {A.__version__}")
 
 # Cell
 class EffDetModule(AbstractDetectorLightningModule):
@@ -54,15 +39,22 @@ class EffDetModule(AbstractDetectorLightningModule):
         self.config = get_efficientdet_config(model_name=backbone_name)
         self.loss_fn = DetectionLoss(self.config)
 
-    def create_model(self, backbone_name, num_classes=1, **kwargs):
-        return create_model(
+    def create_model(self, backbone_name, num_classes=1, pretrained=True, anchors:dict=None, **kwargs):
+        # imagenet backbone weights are fetched once, then loaded from the local weights store
+        model = build_model(f'{backbone_name}-backbone', lambda pretrained: create_model(
             backbone_name,
             bench_task='',
-            num_classes=num_classes + 1,
             pretrained=False,
-            pretrained_backbone=True,
+            pretrained_backbone=pretrained,
             bench_labeler=True,
-        )
+        ), pretrained=pretrained)
+        model.reset_head(num_classes=num_classes + 1)
+        # anchors e.g. from tune_anchors(), the closest EfficientDet ones, benches make theirs from the model's config
+        if anchors:
+            eff_anchors = effdet_anchors(anchors, min_level=model.config.min_level)
+            assert len(eff_anchors['aspect_ratios']) == len(model.config.aspect_ratios), "Anchors per location must not change"
+            model.config.anchor_scale, model.config.aspect_ratios = eff_anchors['anchor_scale'], eff_anchors['aspect_ratios']
+        return model
 
     def get_main_model(self):
         main_mod = self.model
@@ -78,14 +70,30 @@ class EffDetModule(AbstractDetectorLightningModule):
         main_mod = self.get_main_model()
         return main_mod.backbone
 
-    def convert_raw_predictions(self, raw_preds: torch.Tensor, detection_threshold: float=0) -> List[dict]:
+    def extract_features(self, xs):
+        feats = self.get_backbone()(torch.stack(xs))
+        return OrderedDict([ (str(level), feat) for level, feat in enumerate(feats) ])
+
+    def head_loss(self, feats, ys):
+        # BiFPN isn't frozen w/ the backbone, so it trains w/ the class & box nets
+        main_mod = self.get_main_model()
+        fpn_feats = main_mod.fpn(list(feats.values()))
+        class_out, box_out = main_mod.class_net(fpn_feats), main_mod.box_net(fpn_feats)
+        bench = DetBenchTrain(main_mod)
+        bench.to(self.device)
+        keep_fp32(bench.loss_fn)
+        cls_targets, box_targets, num_positives = bench.anchor_labeler.batch_label_anchors([ y['boxes'] for y in ys ], [ y['labels'] for y in ys ])
+        loss, class_loss, box_loss = bench.loss_fn(class_out, box_out, cls_targets, box_targets, num_positives)
+        return { 'loss': loss }
+
+    def convert_raw_predictions(self, raw_preds: torch.Tensor, detection_threshold: Union[float, dict]=0) -> List[dict]:
         #print(f"raw_preds ={raw_preds}")
         dets = raw_preds.detach().cpu().numpy()
         preds = []
         for det in dets:
-            if detection_threshold > 0:
-                scores = det[:, 4]
-                keep = scores > detection_threshold
+            # 1 cutoff or per label cutoffs, e.g. from ThresholdSweep.cutoffs()
+            if isinstance(detection_threshold, dict) or detection_threshold > 0:
+                keep = det[:, 4] > score_cutoffs(det[:, 5].astype(int), detection_threshold)
                 det = det[keep]
             pred = {
                 "boxes": det[:, :4].clip(0, self.img_sz),
@@ -97,48 +105,67 @@ class EffDetModule(AbstractDetectorLightningModule):
         return preds
 
     def stack_images(self, xs):
-        xs_stack = torch.stack([xs[i] if i < len(xs) else torch.zeros((3, self.img_sz, self.img_sz)).cuda() for i in range(self.bs)])
+        xs_stack = torch.stack([xs[i] if i < len(xs) else torch.zeros((3, self.img_sz, self.img_sz), device=self.device) for i in range(self.bs)])
         return xs_stack
 
     def pack_target(self, ys):
         target = dict(
-            bbox=[ys[yi]['boxes'] if yi < len(ys) else torch.zeros((1,4)).cuda() for yi in range(self.bs)],
-            cls=[ys[yi]['labels'] if yi < len(ys) else torch.Tensor([-1]).cuda() for yi in range(self.bs)]
+            bbox=[ys[yi]['boxes'] if yi < len(ys) else torch.zeros((1,4), device=self.device) for yi in range(self.bs)],
+            cls=[ys[yi]['labels'] if yi < len(ys) else torch.tensor([-1.], device=self.device) for yi in range(self.bs)]
         )
         return target
 
+    def train_bench(self)->DetBenchTrain:
+        bench = DetBenchTrain(unwrap_bench(self.model))
+        bench.to(self.device)
+        keep_fp32(bench.loss_fn) # focal & box losses need fp32 under mixed precision
+        return bench
+
+    def image_loss(self, x, y)->torch.Tensor:
+        if self.cached_features: return AbstractDetectorLightningModule.image_loss(self, x, y)
+        # raw effdet model doesn't take targets, and unlike batches a single image isn't padded to bs, padding would add its background loss
+        return self.train_bench()(x[None], dict(bbox=[y['boxes']], cls=[y['labels']]))['loss']
+
     def training_step(self, train_batch, batch_idx):
+        if self.cached_features: return AbstractDetectorLightningModule.training_step(self, train_batch, batch_idx)
         if self.noisy: print('Entering training_step')
         self.model.train()
-        bench = DetBenchTrain(unwrap_bench(self.model))
-        bench.cuda()
-        xs, ys = self.fix_boxes_batch(*train_batch)
+        bench = self.train_bench()
+        with profile_stage('fix_boxes'):
+            xs, ys = self.fix_boxes_batch(*train_batch)
         if len(xs) <= 0: return 0
 
         target = self.pack_target(ys)
         xs_stack = self.stack_images(xs)
-        losses = bench(xs_stack, target)['loss']
-        if self.noisy: print(f'Exiting training_step, returning {losses}')
+        if self.channels_last: xs_stack = xs_stack.contiguous(memory_format=torch.channels_last)
+        with self.autocast(), profile_stage('forward'): # effdet computes the loss within forward
+            losses = bench(xs_stack, target)['loss']
+        self.update_image_losses(xs, ys)
+        if self.noisy: print(f'Exiting training_step, returning {brief(losses)}')
         return losses
 
     def validation_step(self, val_batch, batch_idx):
         if self.noisy: print('Entering validation_step')
         # turn off auto gradient for validation step
-        with torch.no_grad():
+        with torch.no_grad(), self.autocast():
             xs, ys = val_batch
             predictor = DetBenchPredict(unwrap_bench(self.model))
-            predictor.cuda()
-            raw_preds = predictor(torch.stack(xs).cuda())
-            preds = self.convert_raw_predictions(raw_preds)
-            metrics = self.metrics(preds, ys)
+            predictor.to(self.device)
+            with profile_stage('predict'):
+                raw_preds = predictor(torch.stack(xs).to(self.device))
+                preds = self.convert_raw_predictions(raw_preds.float())
+            with profile_stage('metrics'):
+                metrics = self.metrics(preds, ys)
             bench = DetBenchTrain(unwrap_bench(self.model))
-            bench.cuda()
+            bench.to(self.device)
+            keep_fp32(bench.loss_fn)
             target = self.pack_target(ys)
             xs_stack = self.stack_images(xs)
-            losses = bench(xs_stack, target)['loss']
+            with profile_stage('val_loss'):
+                losses = bench(xs_stack, target)['loss']
 
         result = { 'val_loss': losses, 'val_acc': metrics[:,0].mean(),  'val_coco': metrics[:,1].mean() }
-        if self.noisy: print(f'Exiting validation_step, returning {result}')
+        if self.noisy: print(f'Exiting validation_step, returning {brief(result)}')
         return result
 
     def forward(self, imgs):
@@ -148,7 +175,7 @@ class EffDetModule(AbstractDetectorLightningModule):
             bench = DetBenchPredict(unwrap_bench(self.model))
             raw_preds = bench(torch.stack(imgs))
             preds = self.convert_raw_predictions(raw_preds)
-        if self.noisy: print(f'Exiting forward, returning {preds}')
+        if self.noisy: print(f'Exiting forward, returning {brief(preds)}')
         return preds
 
 # Cell
@@ -0,0 +1,98 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 11_subcoco_errors.ipynb (unless otherwise specified).
+
+__all__ = ['pad_to', 'ErrorAnalysis', 'ERROR_CATEGORIES', 'SIZE_BUCKETS']
+
+# Cell
+import numpy as np
+
+from typing import Dict, List, Tuple
+from .subcoco_utils import *
+
+# Cell
+ERROR_CATEGORIES = ('tp', 'dup', 'cls', 'loc', 'both', 'bkg', 'miss')
+SIZE_BUCKETS = ('small', 'medium', 'large')
+
+def pad_to(counts:np.ndarray, n:int, axis:int)->np.ndarray:
+    if counts.shape[axis] >= n: return counts
+    pads = [(0, 0)]*counts.ndim
+    pads[axis] = (0, n-counts.shape[axis])
+    return np.pad(counts, pads)
+
+class ErrorAnalysis():
+    def __init__(self, num_labels:int=1, scut:float=0.5, fg_thr:float=0.5, bg_thr:float=0.1, size_edges:Tuple[float]=(32**2, 96**2)):
+        self.scut, self.fg_thr, self.bg_thr, self.size_edges = scut, fg_thr, bg_thr, np.array(size_edges, dtype=np.float64)
+        self.reset(num_labels)
+
+    def reset(self, num_labels:int=None):
+        n = num_labels or len(self.confusion)
+        self.confusion = np.zeros((n, n), dtype=np.int64) # [target label, prediction label], 0 is background
+        self.by_label = np.zeros((len(ERROR_CATEGORIES), n), dtype=np.int64)
+        self.by_size = np.zeros((len(ERROR_CATEGORIES), len(self.size_edges)+1), dtype=np.int64)
+
+    def grow(self, n_labels:int):
+        self.confusion = pad_to(pad_to(self.confusion, n_labels, 0), n_labels, 1)
+        self.by_label = pad_to(self.by_label, n_labels, 1)
+
+    def update(self, preds:List[dict], tgts:List[dict]):
+        n = min(len(preds), len(tgts))
+        if n == 0: return
+        preds, tgts = preds[:n], tgts[:n]
+        pscores = cat_numpy([ p['scores'] for p in preds ], np.float64)
+        keep = pscores > self.scut
+        pimgs = np.repeat(np.arange(n), [ len(p['scores']) for p in preds ])[keep]
+        pboxs, pls = cat_numpy([ p['boxes'] for p in preds ], np.float64, 4)[keep], cat_numpy([ p['labels'] for p in preds ], np.int64)[keep]
+        tboxs, tls = cat_numpy([ t['boxes'] for t in tgts ], np.float64, 4), cat_numpy([ t['labels'] for t in tgts ], np.int64)
+        n_preds, n_tgts = np.bincount(pimgs, minlength=n), np.array([ len(t['labels']) for t in tgts ], dtype=np.int64)
+        timgs = np.repeat(np.arange(n), n_tgts)
+        self.grow(max(int(pls.max(initial=0)), int(tls.max(initial=0)))+1)
+
+        pidx, tidx = box_pairs(n_preds, n_tgts)
+        iou = pair_iou(pboxs[pidx], tboxs[tidx])
+        same = pls[pidx] == tls[tidx]
+        by_score = np.argsort(-pscores[keep], kind='stable')
+        fg = iou >= self.fg_thr
+        true_fg = same & fg
+        tp_picks = pick_by_score(pidx[true_fg], tidx[true_fg], iou[true_fg], len(pls), pimgs, timgs, by_score)
+        is_tp = tp_picks >= 0
+        tp_tgts = np.zeros(len(tls), dtype=bool)
+        tp_tgts[tp_picks[is_tp]] = True
+
+        # leftovers match regardless of label for the confusion matrix
+        free = fg & ~is_tp[pidx] & ~tp_tgts[tidx]
+        picks = np.where(is_tp, tp_picks, pick_by_score(pidx[free], tidx[free], iou[free], len(pls), pimgs, timgs, by_score))
+        matched = picks >= 0
+        matched_tgts = np.zeros(len(tls), dtype=bool)
+        matched_tgts[picks[matched]] = True
+        np.add.at(self.confusion, (tls[picks[matched]], pls[matched]), 1)
+        np.add.at(self.confusion, (0, pls[~matched]), 1)
+        np.add.at(self.confusion, (tls[~matched_tgts], 0), 1)
+
+        best_true, best_other = np.zeros(len(pls)), np.zeros(len(pls))
+        np.maximum.at(best_true, pidx[same], iou[same])
+        np.maximum.at(best_other, pidx[~same], iou[~same])
+        cats = np.select([is_tp, best_true >= self.fg_thr, best_other >= self.fg_thr, best_true >= self.bg_thr, best_other >= self.bg_thr],
+                         [0, 1, 2, 3, 4], 5)
+        missed = ~tp_tgts
+        cats = np.r_[cats, np.full(missed.sum(), len(ERROR_CATEGORIES)-1)]
+        labels = np.r_[pls, tls[missed]]
+        boxs = np.concatenate([pboxs, tboxs[missed]])
+        areas = np.prod(np.clip(boxs[:, 2:]-boxs[:, :2], 0, None), axis=1)
+        np.add.at(self.by_label, (cats, labels), 1)
+        np.add.at(self.by_size, (cats, np.searchsorted(self.size_edges, areas, side='right')), 1)
+
+    def compute(self)->Dict[str, float]:
+        "Fraction of detections in each error category, and of targets missed"
+        counts = self.by_label.sum(1)
+        n_dets, n_tgts = counts[:-1].sum(), self.confusion[1:].sum()
+        res = { f'err_{cat}': float(counts[i]/max(n_dets, 1)) for i, cat in enumerate(ERROR_CATEGORIES[1:-1], 1) }
+        res['err_miss'] = float(counts[-1]/max(n_tgts, 1))
+        return res
+
+    def report(self, l2name:dict=None)->str:
+        "Counts of each error category by box size and by label, as text"
+        l2name = l2name or {}
+        header = ' '*12 + ''.join([ f'{cat:>8}' for cat in ERROR_CATEGORIES ])
+        rows = [ f'{name:>12}' + ''.join([ f'{c:>8}' for c in counts ]) for name, counts in zip(SIZE_BUCKETS, self.by_size.T) ]
+        rows += [ f'{str(l2name.get(l, l))[:12]:>12}' + ''.join([ f'{c:>8}' for c in self.by_label[:, l] ])
+                  for l in range(self.by_label.shape[1]) if self.by_label[:, l].any() ]
+        return '\n'.join([header, *rows])
\ No newline at end of file
@@ -0,0 +1,81 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 18_subcoco_features.ipynb (unless otherwise specified).
+
+__all__ = ['module_digest', 'stack_features', 'FeatureCache']
+
+# Cell
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+import torch
+
+from collections import OrderedDict
+from pathlib import Path
+from torch import Tensor
+from torch.nn import Module
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Cell
+def module_digest(mod:Module)->str:
+    h = hashlib.sha1()
+    for name, t in mod.state_dict().items():
+        h.update(name.encode())
+        h.update((t.detach().float() if t.is_floating_point() else t.detach()).cpu().numpy().tobytes())
+    return h.hexdigest()
+
+def stack_features(feats:List[Dict[str, Tensor]], device=None)->Dict[str, Tensor]:
+    return OrderedDict([ (name, torch.stack([ f[name] for f in feats ]).to(device)) for name in feats[0] ])
+
+class FeatureCache(torch.utils.data.Dataset):
+    def __init__(self, cache_dir:str, dtype=np.float16):
+        self.cache_dir = Path(cache_dir)
+        self.dtype = np.dtype(dtype)
+        self.meta, self.levels, self.targets = None, None, None
+        if (self.cache_dir/'meta.json').is_file(): self.open()
+
+    def open(self):
+        with open(self.cache_dir/'meta.json', 'r') as meta_f: self.meta = json.load(meta_f)
+        self.levels = OrderedDict([ (name, np.load(self.cache_dir/f'{name}.npy', mmap_mode='r')) for name in self.meta['levels'] ])
+        self.targets = torch.load(self.cache_dir/'targets.pt')
+        return self
+
+    def is_built(self, key:str)->bool:
+        return self.meta is not None and self.meta['key'] == key
+
+    def build(self, extract:Callable[[List[Tensor]], Dict[str, Tensor]], batches:Iterable[Tuple[List[Tensor], List[dict]]],
+              n_items:int, key:str, force:bool=False):
+        "Features of `n_items` images from `batches` of (images, targets), computed by `extract`, unless already cached w/ same `key`"
+        if self.is_built(key) and not force: return self
+        tmp_dir = self.cache_dir.parent/f'.{self.cache_dir.name}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        levels, targets, i = None, [], 0
+        with torch.no_grad():
+            for xs, ys in batches:
+                feats = extract(xs)
+                if levels is None:
+                    levels = OrderedDict([ (name, np.lib.format.open_memmap(tmp_dir/f'{name}.npy', mode='w+', dtype=self.dtype, shape=(n_items, *f.shape[1:])))
+                                           for name, f in feats.items() ])
+                for name, f in feats.items(): levels[name][i:i+len(f)] = f.float().cpu().numpy()
+                targets += [ { k: v.cpu() if isinstance(v, Tensor) else v for k, v in y.items() } for y in ys ]
+                i += len(xs)
+        assert i == n_items, f"Expected {n_items} images but got {i}"
+        for level in levels.values(): level.flush()
+        del levels
+        torch.save(targets, tmp_dir/'targets.pt')
+        with open(tmp_dir/'meta.json', 'w') as meta_f:
+            json.dump({ 'key': key, 'n_items': n_items, 'levels': list(feats.keys()), 'dtype': self.dtype.name }, meta_f)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, self.cache_dir)
+        return self.open()
+
+    def nbytes(self)->int:
+        return sum([ level.nbytes for level in self.levels.values() ])
+
+    def __len__(self): return 0 if self.meta is None else self.meta['n_items']
+
+    def __getitem__(self, index):
+        feats = OrderedDict([ (name, torch.from_numpy(np.array(level[index], dtype=np.float32))) for name, level in self.levels.items() ])
+        # fresh target tensors, callers clamp boxes in place
+        return feats, { k: v.clone() if isinstance(v, Tensor) else v for k, v in self.targets[index].items() }
\ No newline at end of file
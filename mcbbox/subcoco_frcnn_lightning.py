@@ -3,26 +3,7 @@
 __all__ = ['FRCNN', 'save_final']
 
 # Cell
-import json, os, requests, sys, tarfile
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-import numpy as np
-import pickle
-import random
-
-from collections import defaultdict
-from functools import reduce
-from IPython.utils import io
-from pathlib import Path
-from PIL import Image
-from PIL import ImageStat
-
-from pycocotools.coco import COCO
-from pycocotools.cocoeval import COCOeval
-from tqdm import tqdm
-from typing import Hashable, List, Tuple, Union
-
-# Cell
+import sys
 import albumentations as A
 import pytorch_lightning as pl
 import torch, torchvision
@@ -38,20 +19,22 @@ from torchvision.models.detection.rpn import AnchorGenerator
 from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
 from .subcoco_utils import *
 from .subcoco_lightning_utils import *
+from .subcoco_weights import *
 
 torch.multiprocessing.set_sharing_strategy('file_system')
-print(f"Python ver {sys.version}, torch {torch.__version__}, torchvision {torchvision.__version__}, pytorch_lightning {pl.__version__}")
-
 if is_notebook():
     from nbdev.showdoc import *
+    print(f"Python ver {sys.version}, torch {torch.__version__}, torchvision {torchvision.__version__}, pytorch_lightning {pl.__version__}")
 
 # Cell
 class FRCNN(AbstractDetectorLightningModule):
     def __init__(self, **kwargs):
         AbstractDetectorLightningModule.__init__(self, **kwargs)
 
-    def create_model(self, backbone_name, num_classes=1, **kwargs):
-        model = torchvision.models.detection.fasterrcnn_resnet50_fpn(pretrained=True)
+    def create_model(self, backbone_name, num_classes=1, pretrained=True, anchors:dict=None, **kwargs):
+        # COCO weights are fetched once, then loaded from the local weights store
+        model = build_model('fasterrcnn_resnet50_fpn', lambda pretrained: torchvision.models.detection.fasterrcnn_resnet50_fpn(
+            pretrained=pretrained, pretrained_backbone=False), pretrained=pretrained)
         self.in_features = model.roi_heads.box_predictor.cls_score.in_features
         # replace the pre-trained head with a new one, which is trainable
         model.roi_heads.box_predictor = FastRCNNPredictor(self.in_features, self.num_classes+1)
@@ -66,6 +49,15 @@ class FRCNN(AbstractDetectorLightningModule):
         model.transform.normalize = noop_normalize
         model.transform.resize = noop_resize
 
+        # anchors e.g. from tune_anchors(like=FRCNN_ANCHORS), as many per location as the rpn head predicts
+        if anchors:
+            anchor_generator = AnchorGenerator(sizes=anchors['sizes'], aspect_ratios=anchors['aspect_ratios'])
+            assert anchor_generator.num_anchors_per_location() == model.rpn.anchor_generator.num_anchors_per_location(), "Anchors per location must not change"
+            model.rpn.anchor_generator = anchor_generator
+
+        # anchors are made in dtype of feature maps, keep them fp32 under mixed precision
+        keep_fp32(model.rpn.anchor_generator)
+
         return model
 
     def get_main_model(self): return self.model
@@ -74,6 +66,17 @@ class FRCNN(AbstractDetectorLightningModule):
 
     def get_backbone(self): return self.model.backbone
 
+    def extract_features(self, xs):
+        images, _ = self.model.transform(xs)
+        return self.model.backbone(images.tensors)
+
+    def head_loss(self, feats, ys):
+        # rpn isn't frozen w/ the backbone, so it trains w/ the roi heads
+        images = self.blank_image_list(len(ys))
+        proposals, rpn_losses = self.model.rpn(images, feats, ys)
+        _, det_losses = self.model.roi_heads(feats, proposals, images.image_sizes, ys)
+        return { **rpn_losses, **det_losses }
+
 # Cell
 def save_final(frcnn_model, model_save_path):
     torch.save(frcnn_model.model.state_dict(), model_save_path)
\ No newline at end of file
@@ -1,52 +1,45 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 20_subcoco_lightning_utils.ipynb (unless otherwise specified).
 
-__all__ = ['SubCocoDataset', 'NormClamp', 'ClampPixel', 'SubCocoDataModule', 'AbstractDetectorLightningModule',
-           'train_model', 'run_training']
+__all__ = ['SubCocoDataset', 'NormClamp', 'ClampPixel', 'BatchSizeSampler', 'collate_tuples', 'ClassBalancedWeights',
+           'HardExampleWeights', 'HardExampleCallback', 'SubCocoDataModule', 'SAMPLINGS', 'worker_rss_mb',
+           'WorkerMemProbe', 'probe_worker_memory', 'to_device', 'time_train_step', 'probe_workers', 'autocast_ctx',
+           'to_fp32', 'keep_fp32', 'PRECISIONS', 'num_optimizer_steps', 'scale_lr', 'make_optimizer',
+           'AbstractDetectorLightningModule', 'CachedFeatureDataModule', 'StageProfilerCallback',
+           'AsyncModelCheckpoint', 'ResourceMonitorCallback', 'subcoco_tfms', 'subcoco_full_res_tfms', 'train_model',
+           'run_training', 'rand_batch', 'bench_precision_modes']
 
 # Cell
-import cv2, json, os, requests, sys, tarfile
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
+import cv2, hashlib, os, re, time
 import numpy as np
-import pickle
-import random
 
 import albumentations as A
 import pytorch_lightning as pl
 import torch, torchvision
-import torch.nn.functional as F
 import torch.multiprocessing
 
 from collections import defaultdict
-from functools import reduce
-from gpumonitor.monitor import GPUStatMonitor
-from gpumonitor.callbacks.lightning import PyTorchGpuMonitorCallback
-from IPython.utils import io
+from contextlib import nullcontext
 from pathlib import Path
-from PIL import Image
-from PIL import ImageStat
-
-from pycocotools.coco import COCO
-from pycocotools.cocoeval import COCOeval
-from pytorch_lightning.callbacks import ModelCheckpoint, EarlyStopping
+from pytorch_lightning.callbacks import Callback, EarlyStopping
 from pytorch_lightning import LightningDataModule, LightningModule, Trainer
-from pytorch_lightning.core.step_result import TrainResult
-
-from tqdm import tqdm
-from typing import Hashable, List, Tuple, Union, Iterable
+from typing import Dict, List, Tuple, Union, Iterable
 
-from torch import nn
+from torch import nn, Tensor
 from torch.nn import Module
 from torch import optim
-from torch.utils.data import DataLoader, random_split
-
-from torchvision import transforms
+from torch.utils.data import DataLoader, Sampler
+from torchvision.models.detection.image_list import ImageList
 
-from albumentations.pytorch import ToTensorV2
-from pytorch_lightning import LightningDataModule, LightningModule
+from .subcoco_box_ops import *
 from .subcoco_utils import *
-
-print(f"Python ver {sys.version}, torch {torch.__version__}, torchvision {torchvision.__version__}, pytorch_lightning {pl.__version__}, Albumentation {A.__version__}")
+from .subcoco_profile import *
+from .subcoco_monitor import *
+from .subcoco_checkpoint import *
+from .subcoco_weights import *
+from .subcoco_features import *
+from .subcoco_tiles import *
+from .subcoco_errors import *
+from .subcoco_splits import *
 
 # Cell
 class SubCocoDataset(torchvision.datasets.VisionDataset):
@@ -54,40 +47,23 @@ class SubCocoDataset(torchvision.datasets.VisionDataset):
     Simulate what torchvision.CocoDetect() returns for target given fastai's coco subsets
     Args:
         root (string): Root directory where images are downloaded to.
-        stats (CocoDatasetStats):
+        stats (CocoDatasetStats): only used in init, items are read from its memory mapped `AnnoArrays`
     """
 
     def __init__(self, root:str, stats:CocoDatasetStats, img_ids:list=[],
                  bbox_aware_tfms:callable=None, safe_box_margin:float=0.0, safe_box_size:float=0.0):
         super(SubCocoDataset, self).__init__(root)
-        self.stats = stats
-        self.img_ids = []
-        n_missing = 0
-        for img_id in img_ids:
-            img_fname = stats.img2fname[img_id]
-            if not os.path.isfile(stats.img_dir/img_fname):
-                n_missing += 1
-            elif stats.img2sz.get(img_id, None) is None:
-                n_missing += 1
-            elif safe_box_size <= 0.0 and safe_box_margin <= 0.0:
-                self.img_ids.append(img_id)
-            else:
-                img_w, img_h = stats.img2sz[img_id]
-                l2bs = stats.img2l2bs[img_id]
-                safe_l2bs = {}
-                for l, bs in l2bs.items():
-                    safe_bs = []
-                    for bx, by, bw, bh in bs:
-                        if box_within_bounds(bx, by, bw, bh, img_w, img_h, safe_box_margin, safe_box_size):
-                            safe_bs.append((bx, by, bw, bh))
-                    if len(safe_bs) > 0:
-                        safe_l2bs[l] = safe_bs
-                if len(safe_l2bs) <= 0:
-                    n_missing += 1
-                else:
-                    stats.img2l2bs[img_id] = safe_l2bs
-                    self.img_ids.append(img_id)
-
+        self.anno = stats_arrays(stats) # don't hold on to stats, else it gets pickled into every worker
+        self.safe_box_margin = safe_box_margin
+        self.safe_box_size = safe_box_size
+        self.filter_boxes = safe_box_size > 0.0 or safe_box_margin > 0.0
+        found_img_ids = [ img_id for img_id in img_ids
+                          if os.path.isfile(stats.img_dir/stats.img2fname[img_id]) and stats.img2sz.get(img_id, None) is not None ]
+        self.img_pos = self.anno.img_pos(found_img_ids) if len(found_img_ids) > 0 else np.zeros((0,), dtype=np.int64)
+        if self.filter_boxes:
+            self.img_pos = self.img_pos[self.anno.safe_counts(safe_box_margin, safe_box_size)[self.img_pos] > 0]
+        self.img_ids = self.anno.img_ids[self.img_pos].tolist()
+        n_missing = len(img_ids) - len(self.img_ids)
         if n_missing > 0 : print(f'Warning: {n_missing} out of {len(img_ids)} image files are missing or have unsafe boxes!!!')
         self.bbox_aware_tfms = bbox_aware_tfms
 
@@ -98,22 +74,25 @@ class SubCocoDataset(torchvision.datasets.VisionDataset):
         Returns:
             tuple: Tuple (image, target). target is the object returned by ``coco.loadAnns``.
         """
-        img_id = self.img_ids[index] if index < len(self.img_ids) else 0
-        img_fname = self.stats.img2fname.get(img_id, None)
-        if img_id is None or img_fname ==None:
+        if index >= len(self.img_pos):
             return (None, None)
-        img_fpath = os.path.join(self.root, img_fname)
-        img_w, img_h = self.stats.img2sz.get(img_id, (1,1))
-        target = { 'boxes': [], 'labels': [], 'image_id': img_id, 'width': img_h, 'height': img_h, 'areas': [], 'iscrowds': 0, 'ids': [] }
-        count = 0
-        lbs = self.stats.img2lbs.get(img_id,[])
-        for l, x, y, w, h in lbs:
-            count += 1
-            target['boxes'].append([x, y, x+w, y+h]) # FRCNN and RetNet wants x1,y1,x2,y2 format!
-            target['labels'].append(l)
-            target['areas'].append(w*h)
-            anno_id = img_id*1000 + count
-            target['ids'].append(anno_id)
+        pos = self.img_pos[index]
+        img_id = int(self.anno.img_ids[pos])
+        img_fpath = os.path.join(self.root, self.anno.fname(pos))
+        img_w, img_h = self.anno.img_sizes[pos].tolist()
+        box_mask = self.anno.safe_mask(self.safe_box_margin, self.safe_box_size) if self.filter_boxes else None
+        lbls, xywhs = self.anno.lbs(pos, box_mask)
+        whs = xywhs[:, 2:]
+        target = {
+            'boxes': xywh_to_xyxy(xywhs).tolist(), # FRCNN and RetNet wants x1,y1,x2,y2 format!
+            'labels': lbls.tolist(),
+            'image_id': img_id,
+            'width': img_w,
+            'height': img_h,
+            'areas': (whs[:, 0]*whs[:, 1]).tolist(),
+            'iscrowds': 0,
+            'ids': (img_id*1000 + np.arange(1, len(lbls)+1)).tolist(),
+        }
 
         img = cv2.imread(img_fpath)
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
@@ -133,6 +112,11 @@ class SubCocoDataset(torchvision.datasets.VisionDataset):
     def __len__(self):
         return len(self.img_ids)
 
+    def label_histograms(self, n_labels:int=None)->np.ndarray:
+        # [item, label] num of boxes the item's target will have, w/o reading any image
+        box_mask = self.anno.safe_mask(self.safe_box_margin, self.safe_box_size) if self.filter_boxes else None
+        return label_histograms(self.anno, self.img_pos, box_mask, n_labels)
+
 # Cell
 class NormClamp(A.ImageOnlyTransform):
     def __init__(self, mean=(.5, .5, .5), std=(.25, .25, .25), always_apply=True, p=1.0):
@@ -160,10 +144,97 @@ class ClampPixel(A.ImageOnlyTransform):
     def get_transform_init_args_names(self): return ()
 
 # Cell
+class BatchSizeSampler(Sampler):
+    def __init__(self, n:int, bs:int, shuffle:bool=True, drop_last:bool=False, weights:callable=None):
+        self.n = n
+        self.bs = bs
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.weights = weights
+
+    def __iter__(self):
+        if self.weights is not None: idxs = torch.multinomial(self.weights().double(), self.n, replacement=True).tolist()
+        else: idxs = torch.randperm(self.n).tolist() if self.shuffle else list(range(self.n))
+        for i in range(0, self.n, self.bs):
+            batch = idxs[i:i+self.bs]
+            if self.drop_last and len(batch) < self.bs: break
+            yield batch
+
+    def __len__(self):
+        return self.n//self.bs if self.drop_last else -(-self.n//self.bs)
+
+def collate_tuples(batch):
+    return tuple(zip(*batch))
+
+class ClassBalancedWeights():
+    def __init__(self, label_hists:np.ndarray, power:float=0.5):
+        has_lbl = label_hists > 0
+        has_lbl[:, 0] = False # background
+        lbl_weights = (len(label_hists)/np.maximum(has_lbl.sum(axis=0), 1))**power
+        lbl_weights[~has_lbl.any(axis=0)] = 0.0
+        # items w/o boxes count as the most common label
+        no_box = lbl_weights[lbl_weights > 0].min() if (lbl_weights > 0).any() else 1.0
+        self.item_weights = torch.from_numpy(np.where(has_lbl.any(axis=1), (has_lbl*lbl_weights).max(axis=1, initial=0.0), no_box))
+        self.lbl_weights = lbl_weights
+
+    def __call__(self)->Tensor: return self.item_weights
+
+class HardExampleWeights():
+    def __init__(self, img_ids:List[int], power:float=1.0, floor:float=0.1):
+        self.power = power
+        self.floor = floor
+        self.img_ids = torch.as_tensor(img_ids, dtype=torch.long)
+        self.order = torch.argsort(self.img_ids)
+        self.sorted_ids = self.img_ids[self.order]
+        # hardness per item, shared so worker or spawned processes can record w/o copies
+        self.hardness = torch.ones(len(img_ids), dtype=torch.float64).share_memory_()
+        self.recorded = torch.zeros(len(img_ids), dtype=torch.bool).share_memory_()
+
+    def positions(self, img_ids)->Tuple[Tensor, Tensor]:
+        # item positions of the known `img_ids` and which ones are known
+        img_ids = torch.as_tensor(img_ids, dtype=torch.long).view(-1)
+        idx = torch.searchsorted(self.sorted_ids, img_ids).clamp(max=len(self.sorted_ids)-1)
+        found = self.sorted_ids[idx] == img_ids
+        return self.order[idx[found]], found
+
+    def record(self, img_ids, values):
+        pos, found = self.positions(img_ids)
+        values = torch.as_tensor(values, dtype=torch.float64).view(-1).expand(len(found))[found]
+        self.hardness[pos] = values
+        self.recorded[pos] = True
+
+    def __call__(self)->Tensor:
+        hardness = self.hardness.clamp(min=0.0)
+        if self.recorded.any(): hardness = torch.where(self.recorded, hardness, hardness[self.recorded].max())
+        weights = hardness**self.power
+        return weights + self.floor*weights.mean() + 1e-12
+
+class HardExampleCallback(Callback):
+    def __init__(self, weights:HardExampleWeights, every:int=4):
+        self.weights = weights
+        self.every = every
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx, *args):
+        # per image losses cost another forward pass, so only ask for them every few steps
+        pl_module.track_image_losses = batch_idx % self.every == 0
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, *args):
+        if pl_module.last_image_losses is None: return
+        self.weights.record(*pl_module.last_image_losses)
+        pl_module.last_image_losses = None
+
+    def on_train_end(self, trainer, pl_module): pl_module.track_image_losses = False
+
+# Cell
+SAMPLINGS = ['uniform', 'balanced', 'hard']
+
 class SubCocoDataModule(LightningDataModule):
 
     def __init__(self, root, stats, bs=32, workers=4, split_ratio=0.9, shuffle=True,
-                 train_transforms=None, val_transforms=None):
+                 train_transforms=None, val_transforms=None, pin_memory:bool=None, prefetch_factor:int=2,
+                 persistent_workers:bool=True, sampling:str='uniform', balance_power:float=0.5,
+                 seed:int=42, stratify:bool=True):
+        assert sampling in SAMPLINGS, f"sampling must be one of {SAMPLINGS} but got {sampling}"
         super().__init__(train_transforms=train_transforms, val_transforms=val_transforms)
         self.dir = root
         self.bs = bs
@@ -171,53 +242,204 @@ class SubCocoDataModule(LightningDataModule):
         self.stats = stats
         self.split_ratio = split_ratio
         self.shuffle = shuffle
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self.prefetch_factor = prefetch_factor
+        self.persistent_workers = persistent_workers
 
-        num_items = stats.num_imgs
-        num_train = int(self.split_ratio*num_items)
-        img_ids = list(stats.img2sz.keys())
-        if shuffle: random.shuffle(img_ids)
-
-        train_img_ids = img_ids[:num_train]
-        val_img_ids = img_ids[num_train:]
+        # same seed, same split, in every run and pipeline, shuffle only changes the order of training batches
+        train_img_ids, val_img_ids = split_img_ids(stats, valid_ratio=1-split_ratio, seed=seed, stratify=stratify)
 
         self.train = SubCocoDataset(self.dir, self.stats, img_ids=train_img_ids, bbox_aware_tfms=train_transforms)
         self.val = SubCocoDataset(self.dir, self.stats, img_ids=val_img_ids, bbox_aware_tfms=val_transforms)
+        self.sampling = sampling
+        self.train_weights = None
+        if sampling == 'balanced':
+            self.train_weights = ClassBalancedWeights(self.train.label_histograms(len(stats.lbl2name)+1), power=balance_power)
+        elif sampling == 'hard':
+            self.train_weights = HardExampleWeights(self.train.img_ids)
+        self.train_sampler = BatchSizeSampler(len(self.train), bs, shuffle=shuffle, weights=self.train_weights)
+        self.val_sampler = BatchSizeSampler(len(self.val), bs, shuffle=False)
+        self.train_dl, self.val_dl = None, None
 
     def collate_fn(self, batch):
-        return tuple(zip(*batch))
+        return collate_tuples(batch)
+
+    def set_bs(self, bs:int):
+        # existing loaders and their workers are kept, new batch size is used from next epoch on
+        self.bs = bs
+        self.train_sampler.bs = bs
+        self.val_sampler.bs = bs
+
+    def set_workers(self, workers:int):
+        if workers == self.workers: return
+        self.workers = workers
+        self.train_dl, self.val_dl = None, None # rebuild w/ new workers on next request
+
+    def loader_kwargs(self)->dict:
+        kwargs = dict(num_workers=self.workers, collate_fn=collate_tuples, pin_memory=self.pin_memory)
+        if self.workers > 0: # only valid w/ worker processes
+            kwargs.update(prefetch_factor=self.prefetch_factor, persistent_workers=self.persistent_workers)
+        return kwargs
 
     def train_dataloader(self):
-        return DataLoader(self.train, batch_size=self.bs, num_workers=self.workers, collate_fn=self.collate_fn, shuffle=self.shuffle)
+        if self.train_dl is None:
+            self.train_dl = DataLoader(self.train, batch_sampler=self.train_sampler, **self.loader_kwargs())
+        return self.train_dl
 
     def val_dataloader(self):
-        return DataLoader(self.val, batch_size=self.bs, num_workers=self.workers, collate_fn=self.collate_fn, shuffle=False)
+        if self.val_dl is None:
+            self.val_dl = DataLoader(self.val, batch_sampler=self.val_sampler, **self.loader_kwargs())
+        return self.val_dl
+
+# Cell
+def worker_rss_mb()->float: return proc_rss_mb()
+
+class WorkerMemProbe(torch.utils.data.Dataset):
+    def __init__(self, dataset, n:int):
+        self.dataset = dataset # only here to be pickled into workers like a real dataset would
+        self.n = n
+
+    def __len__(self): return self.n
+
+    def __getitem__(self, index):
+        info = torch.utils.data.get_worker_info()
+        anno = getattr(self.dataset, 'anno', self.dataset)
+        if info is not None and isinstance(anno, AnnoArrays): anno.load() # what a real worker pays on 1st item
+        return (info.id if info else -1, worker_rss_mb())
+
+def probe_worker_memory(dataset, workers:int=2, mp_context:str='spawn')->Tuple[float, dict]:
+    dl = DataLoader(WorkerMemProbe(dataset, workers), batch_size=1, num_workers=workers,
+                    collate_fn=collate_tuples, multiprocessing_context=mp_context)
+    start = time.perf_counter()
+    worker2rss = { wid: rss for (wid,), (rss,) in dl }
+    return time.perf_counter()-start, worker2rss
+
+# Cell
+def to_device(o, device):
+    if isinstance(o, torch.Tensor): return o.to(device)
+    if isinstance(o, (list, tuple)): return type(o)(to_device(e, device) for e in o)
+    if isinstance(o, dict): return { k: to_device(v, device) for k, v in o.items() }
+    return o
+
+def time_train_step(model:LightningModule, batch, steps:int=3)->float:
+    batch = to_device(batch, model.device) # batch is collated on CPU, Lightning moves it only inside the Trainer
+    model.train()
+    start = time.perf_counter()
+    for i in range(steps):
+        loss = model.training_step(batch, i)
+        if isinstance(loss, torch.Tensor) and loss.requires_grad: loss.backward()
+    if torch.cuda.is_available(): torch.cuda.synchronize()
+    model.zero_grad()
+    return (time.perf_counter()-start)/steps
+
+def probe_workers(dataset, bs:int, candidates:List[int]=None, n_batches:int=8, step_time:float=0.,
+                  prefetch_factor:int=2, pin_memory:bool=False)->Tuple[int, dict]:
+    max_workers = os.cpu_count() or 1
+    candidates = candidates or sorted({ w for w in (0, 1, 2, 4, 8, 16) if w <= max_workers })
+    secs_per_batch = {}
+    for w in candidates:
+        kwargs = dict(prefetch_factor=prefetch_factor) if w > 0 else {}
+        dl = DataLoader(dataset, batch_size=bs, num_workers=w, collate_fn=collate_tuples, shuffle=True, pin_memory=pin_memory, **kwargs)
+        it = iter(dl)
+        next(it) # don't count worker start up
+        n, start = 0, time.perf_counter()
+        for _ in range(n_batches):
+            if next(it, None) is None: break
+            n += 1
+        secs_per_batch[w] = (time.perf_counter()-start)/max(1, n)
+        del it, dl
+        if secs_per_batch[w] <= step_time: break # already keeping up w/ model, more workers won't help
+
+    fastest = min(secs_per_batch.values())
+    good_enough = [ w for w, t in secs_per_batch.items() if t <= max(step_time, 1.1*fastest) ]
+    best = min(good_enough)
+    print(f"Seconds per batch by num workers: { {w: round(t, 4) for w, t in secs_per_batch.items()} }, step time {step_time:.4f}, picked {best}")
+    return best, secs_per_batch
+
+# Cell
+PRECISIONS = ('32', '16', 'bf16')
+
+def autocast_ctx(precision:str='32', device_type:str='cpu'):
+    if precision == '16' and device_type == 'cuda':
+        return torch.autocast(device_type='cuda', dtype=torch.float16)
+    elif precision == 'bf16':
+        return torch.autocast(device_type=device_type, dtype=torch.bfloat16)
+    return nullcontext() # fp32, or fp16 requested on CPU which autocast doesn't support
+
+def to_fp32(o):
+    if isinstance(o, torch.Tensor): return o.float() if o.is_floating_point() else o
+    if isinstance(o, (list, tuple)): return type(o)(to_fp32(e) for e in o)
+    if isinstance(o, dict): return { k: to_fp32(v) for k, v in o.items() }
+    return o
+
+def keep_fp32(mod:Module)->Module:
+    fwd = mod.forward
+    # HACK!! same monkey patching trick as noop_normalize()
+    def fp32_forward(*args, **kwargs):
+        with torch.autocast(device_type='cuda' if torch.cuda.is_available() else 'cpu', enabled=False):
+            return fwd(*to_fp32(args), **to_fp32(kwargs))
+    mod.forward = fp32_forward
+    return mod
+
+# Cell
+def num_optimizer_steps(num_imgs:int, bs:int=1, acc:int=1, epochs:int=1, world_size:int=1, drop_last:bool=False)->int:
+    imgs_per_batch = bs*max(1, world_size)
+    batches_per_epoch = num_imgs//imgs_per_batch if drop_last else -(-num_imgs//imgs_per_batch)
+    steps_per_epoch = -(-batches_per_epoch//max(1, acc))
+    return steps_per_epoch*max(0, epochs)
+
+def scale_lr(lr:float, eff_bs:int, base_bs:int=1, lr_scaling:str=None)->float:
+    if lr_scaling == 'linear': return lr*eff_bs/base_bs
+    if lr_scaling == 'sqrt': return lr*(eff_bs/base_bs)**0.5
+    return lr
+
+def make_optimizer(params, lr:float, total_steps:int=0, pct_start:float=0.25, weight_decay:float=0.):
+    optimizer = torch.optim.Adam(params, lr=lr, weight_decay=weight_decay)
+    if total_steps <= 0: return optimizer
+    # step interval, Lightning default is to call scheduler.step() once per epoch
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, lr, total_steps=total_steps, pct_start=pct_start)
+    return { 'optimizer': optimizer, 'lr_scheduler': { 'scheduler': scheduler, 'interval': 'step', 'frequency': 1 } }
 
 # Cell
 class AbstractDetectorLightningModule(LightningModule):
 
     def __init__(self, num_classes=1, img_sz=128, model_train_loss=True, bs:int=1,
-                 steps_per_epoch:int=0, lr:float=1e-2, noisy=False, calc_metrics=False, **kwargs):
+                 steps_per_epoch:int=0, lr:float=1e-2, noisy=False, calc_metrics=False,
+                 precision:str='32', channels_last:bool=False, **kwargs):
         LightningModule.__init__(self)
+        assert precision in PRECISIONS, f"precision must be one of {PRECISIONS} but got {precision}"
         self.num_classes = num_classes
         self.model_train_loss = model_train_loss
         self.img_sz = img_sz
         self.lr = lr
         self.bs = bs
         self.steps_per_epoch = steps_per_epoch
+        self.epochs = 1
         self.noisy = noisy
         self.calc_metrics = calc_metrics
+        self.amp_precision = precision # LightningModule.precision is owned by Trainer
+        self.channels_last = channels_last
+        self.cached_features = False # train head on FeatureCache items instead of images
+        self.track_image_losses = False # set by HardExampleCallback
+        self.last_image_losses = None # image ids & losses of the last train batch
+        self.f1 = F1Accumulator(num_classes+1) # TP, FP & FN per label over a validation epoch
+        self.errors = ErrorAnalysis(num_classes+1) # confusion matrix & error breakdown over a validation epoch
         self.model = self.create_model(num_classes=num_classes, img_sz=img_sz, lr=lr, bs=bs, steps_per_epoch=steps_per_epoch, **kwargs)
+        if channels_last: self.get_backbone().to(memory_format=torch.channels_last)
 
     def create_model(self, **kwargs): raise NotImplementedError()
 
+    def autocast(self):
+        return autocast_ctx(self.amp_precision, self.device.type)
+
+    def set_schedule(self, steps_per_epoch:int, epochs:int=1, lr:float=None):
+        # called before each training phase as Trainer.fit() calls configure_optimizers() anew
+        self.steps_per_epoch = steps_per_epoch
+        self.epochs = epochs
+        if lr is not None: self.lr = lr
+
     def configure_optimizers(self):
-        optimizer = torch.optim.Adam(self.parameters(), lr=self.lr)
-        if self.steps_per_epoch <= 0: return optimizer
-        return {
-           'optimizer': optimizer,
-           'lr_scheduler': torch.optim.lr_scheduler.OneCycleLR(
-               optimizer, self.lr, steps_per_epoch=self.steps_per_epoch, epochs=1,)
-        }
+        return make_optimizer(self.parameters(), self.lr, total_steps=self.steps_per_epoch*self.epochs)
 
     def set_grad(self, mod:Module, requires_grad:bool=True):
         for param in mod.parameters():
@@ -229,6 +451,28 @@ class AbstractDetectorLightningModule(LightningModule):
 
     def get_backbone(self): raise NotImplementedError()
 
+    def extract_features(self, xs:List[Tensor])->Dict[str, Tensor]: raise NotImplementedError() # output of get_backbone() for images
+
+    def head_loss(self, feats:Dict[str, Tensor], ys:List[dict])->Dict[str, Tensor]: raise NotImplementedError() # losses from backbone output
+
+    def blank_image_list(self, n:int)->ImageList:
+        # all rpn, roi and retinanet heads need of the images is batch shape and image sizes, not pixels
+        return ImageList(torch.zeros(1, 3, self.img_sz, self.img_sz, device=self.device).expand(n, -1, -1, -1), [(self.img_sz, self.img_sz)]*n)
+
+    def build_feature_cache(self, dataset:SubCocoDataset, cache_dir:str, bs:int=8, workers:int=0, force:bool=False)->FeatureCache:
+        key = f'{type(self).__name__}-{self.img_sz}-{module_digest(self.get_backbone())[:16]}-{hashlib.sha1(str(dataset.img_ids).encode()).hexdigest()[:16]}'
+        cache = FeatureCache(cache_dir)
+        if cache.is_built(key) and not force: return cache
+        dl = DataLoader(dataset, batch_size=bs, num_workers=workers, collate_fn=collate_tuples)
+        was_training = self.training
+        self.eval()
+        start = time.perf_counter()
+        with self.autocast():
+            cache.build(lambda xs: self.extract_features([ x.to(self.device) for x in xs ]), dl, len(dataset), key, force=force)
+        self.train(was_training)
+        print(f"Cached backbone features of {len(cache)} images in {time.perf_counter()-start:.1f}s, {cache.nbytes()/2**20:.0f}MB")
+        return cache
+
     def freeze_head(self):
         head = self.get_head()
         if isinstance(head, Iterable):
@@ -272,55 +516,91 @@ class AbstractDetectorLightningModule(LightningModule):
                 print(f"Warning: Removing X,Y as Y n_nboxs {n_boxs} != n_cls {n_cls}")
             else:
                 bs = y['boxes'] # should be Tensor of shape bs x 4
-                # clamping min max value of x1,x2,y1,y2
-                for bi in range(len(bs)):
-                    bs[bi, 0] = clamp_fn(0, self.img_sz-2)(bs[bi, 0].item())
-                    bs[bi, 1] = clamp_fn(0, self.img_sz-2)(bs[bi, 1].item())
-                    bs[bi, 2] = clamp_fn(bs[bi, 0].item()+1, self.img_sz-1)(bs[bi, 2].item())
-                    bs[bi, 3] = clamp_fn(bs[bi, 1].item()+1, self.img_sz-1)(bs[bi, 3].item())
+                # in place, x1,y1 within [0, img_sz-2], x2,y2 at least 1 pixel further within [x1+1, img_sz-1]
+                bs[:] = clip_boxes(bs, self.img_sz-1, self.img_sz-1, min_size=1)
                 safe_xs.append(x)
                 safe_ys.append(y)
         return safe_xs, safe_ys
 
-    def metrics(self, preds, targets):
+    def metrics(self, preds, targets, full_res:bool=False):
         metrics = torch.zeros((min(len(preds), len(targets)), 2))
+        metrics[:,0] = torch.from_numpy(self.f1.update(preds, targets, .5, .5))
+        self.errors.update(preds, targets)
         for i, (p,t) in enumerate(zip(preds, targets)):
-            metrics[i,0] = calc_wavg_F1(p, t, .5, .5)
-            metrics[i,1] = SubCocoWrapper(p, t, self.img_sz, self.img_sz).metrics()[0]
+            # full resolution images, e.g. from predict_tiled(), keep their own size
+            width, height = (int(t['width']), int(t['height'])) if full_res else (self.img_sz, self.img_sz)
+            metrics[i,1] = SubCocoWrapper(p, t, width, height).metrics()[0]
         return metrics
 
+    def train_losses(self, xs, ys)->Dict[str, Tensor]:
+        if self.cached_features: return self.head_loss(stack_features(xs, self.device), ys)
+        return self.model.forward(xs, ys) if self.model_train_loss else self.forward(xs, ys)
+
+    def image_loss(self, x, y)->Tensor:
+        return sum(self.train_losses([x], [y]).values())
+
+    def image_losses(self, xs, ys)->Tensor:
+        # loss of each image on its own, detectors only return batch losses, batch norm running stats are left alone
+        bns = [ m for m in self.model.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training ]
+        for m in bns: m.eval()
+        try:
+            with torch.no_grad(), self.autocast():
+                return torch.stack([ self.image_loss(x, y).float() for x, y in zip(xs, ys) ]).cpu()
+        finally:
+            for m in bns: m.train()
+
+    def update_image_losses(self, xs, ys):
+        # for HardExampleCallback, on the steps it asks for them
+        if not self.track_image_losses: return
+        with profile_stage('image_losses'):
+            self.last_image_losses = ([ int(y['image_id']) for y in ys ], self.image_losses(xs, ys))
+
     def training_step(self, train_batch, batch_idx):
         if self.noisy: print('Entering training_step')
         self.model.train()
-        self.model.cuda()
-        xs, ys = self.fix_boxes_batch(*train_batch)
+        with profile_stage('fix_boxes'):
+            xs, ys = self.fix_boxes_batch(*train_batch)
         if len(xs) <= 0: return 0
-        with torch.set_grad_enabled(True):
-            losses = self.model.forward(xs, ys) if self.model_train_loss else self.forward(xs, ys)
-            losses = sum(losses.values())
-        if self.noisy: print(f'Exiting training_step, returning {losses}')
+        with torch.set_grad_enabled(True), self.autocast():
+            with profile_stage('forward'):
+                losses = self.train_losses(xs, ys)
+            with profile_stage('loss'):
+                losses = sum(losses.values())
+        self.update_image_losses(xs, ys)
+        if self.noisy: print(f'Exiting training_step, returning {brief(losses)}')
         return losses
 
+    def backward(self, loss, *args, **kwargs):
+        with profile_stage('backward'):
+            return LightningModule.backward(self, loss, *args, **kwargs)
+
+    def optimizer_step(self, *args, **kwargs):
+        # the closure w/ training_step & backward runs inside, their stages are excluded from this one
+        with profile_stage('optimizer'):
+            return LightningModule.optimizer_step(self, *args, **kwargs)
+
     def validation_step(self, val_batch, batch_idx):
         if self.noisy: print('Entering validation_step')
-        self.model.cuda()
         # turn off auto gradient for validation step
-        with torch.no_grad():
+        with torch.no_grad(), self.autocast():
             xs, ys = val_batch
             self.model.train()
-            losses = self.model.forward(xs, ys) if self.model_train_loss else self.forward(xs, ys)
-            losses = sum(losses.values())
+            with profile_stage('val_loss'):
+                losses = self.model.forward(xs, ys) if self.model_train_loss else self.forward(xs, ys)
+                losses = sum(losses.values())
             if self.calc_metrics:
                 self.model.eval()
-                preds = self.forward(xs)
-                metrics = self.metrics(preds, ys)
+                with profile_stage('predict'):
+                    preds = self.forward(xs)
+                with profile_stage('metrics'):
+                    metrics = self.metrics(preds, ys)
 
         result = {'val_loss': losses}
         if self.calc_metrics:
             result['val_acc'] = metrics[:,0].mean()
             result['val_coco'] = metrics[:,1].mean()
 
-        if self.noisy: print(f'Exiting validation_step, returning {result}')
+        if self.noisy: print(f'Exiting validation_step, returning {brief(result)}')
         return result
 
     def validation_epoch_end(self, outputs):
@@ -330,8 +610,12 @@ class AbstractDetectorLightningModule(LightningModule):
         if self.calc_metrics:
             result['val_acc'] = sum([ o['val_acc'] for o in outputs ])/len(outputs)
             result['val_coco'] = sum([ o['val_coco'] for o in outputs ])/len(outputs)
+            result.update({ f'val_{k}': v for k, v in self.f1.compute().items() }) # micro, macro & weighted over the epoch's boxes
+            result.update({ f'val_{k}': v for k, v in self.errors.compute().items() })
+        self.f1.reset()
+        self.errors.reset()
 
-        if self.noisy: print(f'Exiting validation_epoch_end, returning {result}')
+        if self.noisy: print(f'Exiting validation_epoch_end, returning {brief(result)}')
         self.log_dict(result)
 
     def forward(self, imgs, *args):
@@ -343,18 +627,127 @@ class AbstractDetectorLightningModule(LightningModule):
             # turn off auto gradient for validation step
             with torch.no_grad():
                 preds = self.model(imgs)
-        if self.noisy: print(f'Exiting forward, returning {preds}')
+        if self.noisy: print(f'Exiting forward, returning {brief(preds)}')
+        return preds
+
+    def sweep_thresholds(self, dl:DataLoader, iou_thrs:Tuple[float]=(0.5, 0.75))->ThresholdSweep:
+        # PR curves and best score cutoff per label from 1 pass over dl, e.g. for digest_pred()
+        sweep = ThresholdSweep(iou_thrs)
+        was_training = self.training
+        self.eval()
+        with torch.no_grad(), self.autocast():
+            for xs, ys in dl: sweep.update(self.forward([ x.to(self.device) for x in xs ]), ys)
+        self.train(was_training)
+        return sweep
+
+    def predict_tiled(self, imgs:List[Tensor], overlap:int=32, bs:int=None, iou_thr:float=0.5, score_thr:float=0.)->List[dict]:
+        # full resolution images in img_sz tiles, the size the model was trained at, predictions in image coordinates
+        was_training = self.training
+        self.eval()
+        with torch.no_grad(), self.autocast():
+            preds = predict_tiled(lambda tiles: self.forward([ t.to(self.device) for t in tiles ]), imgs, self.img_sz,
+                                  overlap=overlap, bs=bs or max(1, self.bs), iou_thr=iou_thr, score_thr=score_thr)
+        self.train(was_training)
         return preds
 
 # Cell
-def train_model(model, model_name:str, stats:CocoDatasetStats, img_dir:str,
-        modeldir:str='models', lr=0.01, auto_lr_find=False, split_ratio=0.95,
-        img_sz=128, bs=1, acc=1, workers=1, head_runs=1, full_runs=1,
-        monitor='val_loss', mode='min', save_top=-1, patience=5):
+class CachedFeatureDataModule(LightningDataModule):
+    "Training batches are cached backbone features, validation batches are images from `dm`"
+    def __init__(self, cache:FeatureCache, dm:SubCocoDataModule):
+        super().__init__()
+        self.cache = cache
+        self.dm = dm
+        # cache items are in the order of dm.train, so its sampling weights apply as is
+        self.train_sampler = BatchSizeSampler(len(cache), dm.bs, shuffle=True, weights=getattr(dm, 'train_weights', None))
+
+    def train_dataloader(self):
+        # items are slices of memory mapped arrays, cheap enough to load w/o workers
+        self.train_sampler.bs = self.dm.bs
+        return DataLoader(self.cache, batch_sampler=self.train_sampler, collate_fn=collate_tuples)
+
+    def val_dataloader(self): return self.dm.val_dataloader()
+
+class StageProfilerCallback(Callback):
+    def __init__(self, profiler:StageProfiler=None, out_dir:str=None, report:bool=True):
+        self.profiler = profiler or StageProfiler()
+        self.out_dir = out_dir
+        self.report = report
+        self.last_batch_end = None
+
+    def on_train_start(self, trainer, pl_module): self.profiler.activate()
+
+    def on_train_epoch_start(self, trainer, pl_module, *args): self.last_batch_end = time.perf_counter()
+
+    def on_train_batch_start(self, trainer, pl_module, *args):
+        if self.last_batch_end is not None: self.profiler.record('data', time.perf_counter()-self.last_batch_end)
+
+    def on_train_batch_end(self, trainer, pl_module, *args):
+        self.profiler.step()
+        self.last_batch_end = time.perf_counter()
+
+    def on_train_end(self, trainer, pl_module):
+        self.profiler.deactivate()
+        if self.report: self.profiler.report()
+        if self.out_dir is not None:
+            Path(self.out_dir).mkdir(parents=True, exist_ok=True)
+            self.profiler.to_csv(str(Path(self.out_dir)/'stage_profile.csv'))
+            self.profiler.to_json(str(Path(self.out_dir)/'stage_profile.json'))
+
+class AsyncModelCheckpoint(Callback):
+    def __init__(self, dirpath:str, filename:str='{epoch:03d}', monitor:str=None, mode:str='min', save_top_k:int=-1, keep_last:int=1,
+                 best_alias:str=None, last_alias:str=None, verbose:bool=False):
+        self.writer = CheckpointWriter(dirpath, keep_top=save_top_k, keep_last=keep_last, mode=mode, best_alias=best_alias, last_alias=last_alias)
+        self.filename = filename
+        self.monitor = monitor
+        self.verbose = verbose
+
+    def format_fname(self, epoch:int, metrics:dict)->str:
+        # same naming as ModelCheckpoint, i.e. '{epoch:03d}' becomes 'epoch=007', so resuming by filename still works
+        fname = self.filename
+        for group in re.findall(r'(\{.*?)[:\}]', self.filename): fname = fname.replace(group, group[1:]+'={'+group[1:])
+        return fname.format_map(defaultdict(lambda: float('nan'), metrics, epoch=epoch))+'.ckpt'
 
-    print(f"Training with image size {img_sz}, learning rate {lr}, for {head_runs}+{full_runs} epochs.")
+    def on_validation_end(self, trainer, pl_module):
+        if trainer.running_sanity_check: return
+        metrics = { k: float(v) for k, v in trainer.callback_metrics.items() if not isinstance(v, torch.Tensor) or v.numel() == 1 }
+        fname = self.format_fname(trainer.current_epoch, metrics)
+        # only the snapshot to cpu blocks training, serializing and writing to disk happen in the background
+        with profile_stage('checkpoint'):
+            self.writer.save(trainer.checkpoint_connector.dump_checkpoint(), fname, metrics.get(self.monitor))
+        if self.verbose: print(f"Epoch {trainer.current_epoch}: saving {fname}")
 
-    # transforms for images
+    def on_train_end(self, trainer, pl_module):
+        self.writer.wait()
+        print(self.writer.describe())
+
+    @property
+    def best_model_path(self)->Path: return self.writer.best_model_path
+
+    @property
+    def last_model_path(self)->Path: return self.writer.last_model_path
+
+    def close(self): self.writer.close()
+
+class ResourceMonitorCallback(Callback):
+    def __init__(self, interval:float=1.0, monitor:ResourceMonitor=None):
+        self.monitor = monitor or ResourceMonitor(interval)
+        self.n_items = 0
+
+    def on_train_start(self, trainer, pl_module): self.monitor.start()
+
+    def on_train_epoch_start(self, trainer, pl_module, *args):
+        self.monitor.epoch_start()
+        self.n_items = 0
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, *args): self.n_items += len(batch[0])
+
+    def on_train_epoch_end(self, trainer, pl_module, *args): self.monitor.epoch_end(self.n_items)
+
+    def on_train_end(self, trainer, pl_module): self.monitor.stop()
+
+# Cell
+def subcoco_tfms(stats:CocoDatasetStats, img_sz:int=128)->Tuple[A.Compose, A.Compose]:
+    # bbox aware transforms for train and validation images
     bbox_aware_train_tfms=A.Compose([
         A.ShiftScaleRotate(shift_limit=.01, scale_limit=0.05, rotate_limit=9),
         A.Resize(width=img_sz, height=img_sz),
@@ -371,30 +764,58 @@ def train_model(model, model_name:str, stats:CocoDatasetStats, img_dir:str,
         A.Normalize(mean=stats.chn_means/255, std=stats.chn_stds/255)
     ], bbox_params=A.BboxParams(format='pascal_voc', label_fields=['class_labels']))
 
-    head_dm = SubCocoDataModule(img_dir, stats, shuffle=True, split_ratio=split_ratio,
-                                train_transforms=bbox_aware_train_tfms, val_transforms=bbox_aware_val_tfms,
-                                bs=bs*2, workers=workers)
+    return bbox_aware_train_tfms, bbox_aware_val_tfms
 
-    full_dm = SubCocoDataModule(img_dir, stats, shuffle=True, split_ratio=split_ratio,
-                                train_transforms=bbox_aware_train_tfms, val_transforms=bbox_aware_val_tfms,
-                                bs=bs, workers=workers)
+def subcoco_full_res_tfms(stats:CocoDatasetStats)->A.Compose:
+    # validation transforms w/o resizing, for tiled inference
+    return A.Compose([
+        A.Normalize(mean=stats.chn_means/255, std=stats.chn_stds/255)
+    ], bbox_params=A.BboxParams(format='pascal_voc', label_fields=['class_labels']))
 
-    head_chkpt_cb = ModelCheckpoint(
-        filename = model_name+'-head-'+str(img_sz)+'-{epoch:03d}-{'+monitor+':.3f}',
+# Cell
+def train_model(model, model_name:str, stats:CocoDatasetStats, img_dir:str,
+        modeldir:str='models', lr=0.01, auto_lr_find=False, split_ratio=0.95,
+        img_sz=128, bs=1, acc=1, workers=1, head_runs=1, full_runs=1,
+        monitor='val_loss', mode='min', save_top=3, patience=5, precision:str='32', lr_scaling:str=None,
+        tune_workers:bool=False, prefetch_factor:int=2, profiler:StageProfiler=None, cache_features:bool=False, sampling:str='uniform',
+        seed:int=42):
+
+    print(f"Training with image size {img_sz}, learning rate {lr}, precision {precision}, for {head_runs}+{full_runs} epochs.")
+
+    # Trainer does autocast and loss scaling for fp16 on GPU, bf16 autocast is done by model itself w/o scaling
+    gpus = 1 if torch.cuda.is_available() else 0
+    world_size = max(1, gpus)
+    trainer_precision = 16 if precision == '16' and gpus > 0 else 32
+
+    bbox_aware_train_tfms, bbox_aware_val_tfms = subcoco_tfms(stats, img_sz)
+
+    # 1 data module for both phases so the loaders and their persistent workers are reused, only batch size changes
+    dm = SubCocoDataModule(img_dir, stats, shuffle=True, split_ratio=split_ratio,
+                           train_transforms=bbox_aware_train_tfms, val_transforms=bbox_aware_val_tfms,
+                           bs=bs, workers=workers, prefetch_factor=prefetch_factor, sampling=sampling, seed=seed)
+    if tune_workers:
+        probe_batch = collate_tuples([dm.train[i] for i in range(min(bs, len(dm.train)))])
+        step_time = time_train_step(model.to('cuda' if gpus > 0 else 'cpu'), probe_batch)
+        best_workers, _ = probe_workers(dm.train, bs, step_time=step_time, prefetch_factor=prefetch_factor, pin_memory=dm.pin_memory)
+        dm.set_workers(best_workers)
+
+    head_chkpt_cb = AsyncModelCheckpoint(
+        filename=model_name+'-head-'+str(img_sz)+'-{epoch:03d}-{'+monitor+':.3f}',
         dirpath=modeldir,
-        save_last=True,
         monitor=monitor,
         mode=mode,
         save_top_k=save_top,
+        keep_last=1,
         verbose=True,
     )
-    full_chkpt_cb = ModelCheckpoint(
-        filename= model_name+'-full-'+str(img_sz)+'-{epoch:03d}-{'+monitor+':.3f}',
+    full_chkpt_cb = AsyncModelCheckpoint(
+        filename=model_name+'-full-'+str(img_sz)+'-{epoch:03d}-{'+monitor+':.3f}',
         dirpath=modeldir,
-        save_last=True,
         monitor=monitor,
         mode=mode,
         save_top_k=save_top,
+        keep_last=1,
+        last_alias=f'{model_name}-{img_sz}-last.ckpt',
         verbose=True,
     )
     early_stop_cb = EarlyStopping(
@@ -404,42 +825,68 @@ def train_model(model, model_name:str, stats:CocoDatasetStats, img_dir:str,
        verbose=True,
        mode=mode
     )
-    gpumon_cb = PyTorchGpuMonitorCallback(delay=1)
-    callbacks = [early_stop_cb, gpumon_cb]
+    resmon_cb = ResourceMonitorCallback(interval=1)
+    callbacks = [early_stop_cb, resmon_cb]
+    if profiler is not None: callbacks.append(StageProfilerCallback(profiler, out_dir=modeldir))
+    if sampling == 'hard': callbacks.append(HardExampleCallback(dm.train_weights))
 
     # train head only, since using less params, double the bs and half the grad accumulation cycle to use more GPU VRAM
     if head_runs > 0:
-        trainer = Trainer(gpus=1, max_epochs=head_runs, default_root_dir = modeldir, accumulate_grad_batches=max(1,acc//2),
-                          auto_lr_find=auto_lr_find, callbacks=callbacks, checkpoint_callback=head_chkpt_cb)
+        dm.set_bs(bs*2)
+        head_acc = max(1,acc//2)
+        head_steps = num_optimizer_steps(len(dm.train), bs=dm.bs, acc=head_acc, world_size=world_size)
+        head_lr = scale_lr(lr, dm.bs*head_acc*world_size, base_bs=bs, lr_scaling=lr_scaling)
+        print(f"Head phase: {head_steps} optimizer steps per epoch, effective batch {dm.bs*head_acc*world_size}, lr {head_lr}")
+        model.set_schedule(head_steps, epochs=head_runs, lr=head_lr)
+        trainer = Trainer(gpus=gpus, precision=trainer_precision, max_epochs=head_runs, default_root_dir = modeldir, accumulate_grad_batches=head_acc,
+                          auto_lr_find=auto_lr_find, callbacks=callbacks+[head_chkpt_cb], checkpoint_callback=False)
         model.unfreeze_head()
         model.freeze_backbone()
         model.unfreeze_batchnorm()
+        head_dm = dm
+        if cache_features:
+            # backbone stays frozen for the whole phase, run it once w/o augmentation instead of every epoch
+            cache_ds = SubCocoDataset(img_dir, stats, img_ids=dm.train.img_ids, bbox_aware_tfms=bbox_aware_val_tfms)
+            model.to('cuda' if gpus > 0 else 'cpu')
+            head_dm = CachedFeatureDataModule(model.build_feature_cache(cache_ds, f'{modeldir}/features', bs=dm.bs, workers=dm.workers), dm)
+            model.cached_features = True
         trainer.fit(model, head_dm)
+        model.cached_features = False
 
     if full_runs > 0:
         # finetune head and backbone
-        trainer = Trainer(gpus=1, max_epochs=full_runs, default_root_dir = modeldir, accumulate_grad_batches=max(1,acc),
-                          auto_lr_find=auto_lr_find, callbacks=callbacks, checkpoint_callback=full_chkpt_cb)
+        dm.set_bs(bs)
+        full_acc = max(1,acc)
+        full_steps = num_optimizer_steps(len(dm.train), bs=dm.bs, acc=full_acc, world_size=world_size)
+        full_lr = scale_lr(lr, dm.bs*full_acc*world_size, base_bs=bs, lr_scaling=lr_scaling)
+        print(f"Full phase: {full_steps} optimizer steps per epoch, effective batch {dm.bs*full_acc*world_size}, lr {full_lr}")
+        model.set_schedule(full_steps, epochs=full_runs, lr=full_lr)
+        trainer = Trainer(gpus=gpus, precision=trainer_precision, max_epochs=full_runs, default_root_dir = modeldir, accumulate_grad_batches=full_acc,
+                          auto_lr_find=auto_lr_find, callbacks=callbacks+[full_chkpt_cb], checkpoint_callback=False)
         model.unfreeze_head()
         model.unfreeze_backbone()
         model.unfreeze_batchnorm()
-        trainer.fit(model, full_dm)
+        trainer.fit(model, dm)
 
+    head_chkpt_cb.close()
+    full_chkpt_cb.close()
+    # last model alias is a hardlink made by the writer, no rename or copy needed
     saved_last_model_fpath = None
-    if full_runs > 0:
-        last_model_fpath=Path(full_chkpt_cb.last_model_path)
-        saved_last_model_fpath=str(last_model_fpath.parent/f'{model_name}-{img_sz}-last')+last_model_fpath.suffix
-        os.rename(str(last_model_fpath), saved_last_model_fpath)
+    if full_runs > 0 and full_chkpt_cb.last_model_path is not None:
+        saved_last_model_fpath = str(full_chkpt_cb.writer.dirpath/full_chkpt_cb.writer.last_alias)
 
     return model, saved_last_model_fpath
 
 def run_training(moduleClass:AbstractDetectorLightningModule, backbone_name:str, stats:CocoDatasetStats, img_dir:str,
                  resume_ckpt_fname=None, split_ratio=0.95, modeldir:str='models', lr=0.01, auto_lr_find=False, img_sz=128, bs=1, acc=1, workers=1,
-                 head_runs=1, full_runs=1, monitor='val_loss', mode='min', save_top=-1, test=True, calc_metrics=False, patience=5):
+                 head_runs=1, full_runs=1, monitor='val_loss', mode='min', save_top=3, test=True, calc_metrics=False, patience=5,
+                 precision:str='32', channels_last:bool=False, lr_scaling:str=None, tune_workers:bool=False, prefetch_factor:int=2,
+                 profiler:StageProfiler=None, cache_features:bool=False, anchors:dict=None, sampling:str='uniform', seed:int=42):
 
     print(f"Training with image size {img_sz}, learning rate {lr}, patience = {patience}, for {head_runs}+{full_runs} epochs.")
 
-    steps_per_epoch = int(stats.num_imgs*split_ratio)
+    # train_model() resizes the LR schedule for each phase, this is just the initial estimate
+    steps_per_epoch = num_optimizer_steps(int(stats.num_imgs*split_ratio), bs=bs, acc=acc)
     is_new_run = True
 
     if resume_ckpt_fname:
@@ -447,9 +894,11 @@ def run_training(moduleClass:AbstractDetectorLightningModule, backbone_name:str,
         if os.path.isfile(resume_ckpt):
             try:
                 print(f'Loading previously saved model: {resume_ckpt}...')
-                model = moduleClass.load_from_checkpoint(
-                    resume_ckpt, backbone_name=backbone_name, bs=bs, steps_per_epoch=steps_per_epoch, lr=lr,
-                    num_classes=len(stats.lbl2name), img_sz=img_sz, noisy = test, calc_metrics=calc_metrics,)
+                # no pretrained weights needed, the checkpoint's overwrite them, its state dict is mapped from the weights store
+                model = moduleClass(backbone_name=backbone_name, bs=bs, steps_per_epoch=steps_per_epoch, lr=lr,
+                    num_classes=len(stats.lbl2name), img_sz=img_sz, noisy = test, calc_metrics=calc_metrics,
+                    precision=precision, channels_last=channels_last, pretrained=False, anchors=anchors)
+                model.load_state_dict(WeightStore().load_checkpoint(resume_ckpt))
                 is_new_run = False
             except Exception as e:
                 print(f'Unexpected error loading previously saved model {resume_ckpt}: {e}')
@@ -457,9 +906,50 @@ def run_training(moduleClass:AbstractDetectorLightningModule, backbone_name:str,
 
     if is_new_run:
         model = moduleClass(backbone_name=backbone_name, bs=bs, lr=lr, calc_metrics=calc_metrics,
-            steps_per_epoch=steps_per_epoch, num_classes=len(stats.lbl2name), img_sz=img_sz, noisy = test)
+            steps_per_epoch=steps_per_epoch, num_classes=len(stats.lbl2name), img_sz=img_sz, noisy = test,
+            precision=precision, channels_last=channels_last, anchors=anchors)
 
     return train_model(model, backbone_name, stats, img_dir,
             lr=lr, auto_lr_find=auto_lr_find, split_ratio=split_ratio, modeldir=modeldir,
             img_sz=img_sz, bs=bs, acc=acc, workers=workers, head_runs=head_runs, full_runs=full_runs,
-            monitor=monitor, mode=mode, save_top=save_top, patience=patience)
\ No newline at end of file
+            monitor=monitor, mode=mode, save_top=save_top, patience=patience, precision=precision, lr_scaling=lr_scaling,
+            tune_workers=tune_workers, prefetch_factor=prefetch_factor, profiler=profiler, cache_features=cache_features,
+            sampling=sampling, seed=seed)
+
+# Cell
+def rand_batch(bs:int=2, img_sz:int=128, num_classes:int=1, n_boxs:int=4, device='cpu'):
+    xs = [torch.rand((3, img_sz, img_sz), device=device) for _ in range(bs)]
+    ys = []
+    for _ in range(bs):
+        xy1 = torch.rand((n_boxs, 2), device=device)*img_sz/2
+        xy2 = xy1 + 8 + torch.rand((n_boxs, 2), device=device)*img_sz/2
+        ys.append({'boxes': torch.cat([xy1, xy2], dim=1), 'labels': torch.randint(1, num_classes+1, (n_boxs,), device=device)})
+    return xs, ys
+
+def bench_precision_modes(moduleClass:AbstractDetectorLightningModule, backbone_name:str, num_classes:int=1, img_sz:int=128, bs:int=2,
+                          steps:int=5, warmup:int=1, modes=(('32', False), ('32', True), ('16', True), ('bf16', False), ('bf16', True))):
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    results = []
+    for precision, channels_last in modes:
+        if precision == '16' and device.type != 'cuda': continue # fp16 autocast is GPU only
+        with PeakMemMeter(device.type) as mem:
+            model = moduleClass(backbone_name=backbone_name, num_classes=num_classes, img_sz=img_sz, bs=bs,
+                                precision=precision, channels_last=channels_last).to(device)
+            optimizer = torch.optim.Adam(model.parameters(), lr=model.lr)
+            scaler = torch.cuda.amp.GradScaler(enabled=(precision == '16'))
+            for step in range(warmup+steps):
+                if step == warmup:
+                    if device.type == 'cuda': torch.cuda.synchronize()
+                    start = time.perf_counter()
+                loss = model.training_step(rand_batch(bs, img_sz, num_classes, device=device), step)
+                optimizer.zero_grad()
+                scaler.scale(loss).backward()
+                scaler.step(optimizer)
+                scaler.update()
+            if device.type == 'cuda': torch.cuda.synchronize()
+            step_ms = 1000*(time.perf_counter()-start)/steps
+        res = { 'precision': precision, 'channels_last': channels_last, 'step_ms': step_ms, 'peak_mem_mb': mem.peak_mb }
+        print(f"precision {precision:>4}, channels_last {str(channels_last):>5}: {step_ms:8.1f} ms/step, peak mem {res['peak_mem_mb']:8.1f} MB")
+        results.append(res)
+        del model, optimizer
+    return results
\ No newline at end of file
@@ -0,0 +1,195 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 13_subcoco_monitor.ipynb (unless otherwise specified).
+
+__all__ = ['read_cpu_times', 'proc_rss_mb', 'proc_read_bytes', 'child_pids', 'gpu_stats', 'ResourceMonitor',
+           'PeakMemMeter']
+
+# Cell
+import numpy as np
+import os
+import resource
+import threading
+import time
+import torch
+
+from typing import List
+
+# Cell
+def read_cpu_times()->np.ndarray:
+    # per core [busy, total] jiffies since boot
+    try:
+        with open('/proc/stat', 'r') as stat_f:
+            lines = [ line.split() for line in stat_f if line.startswith('cpu') and not line.startswith('cpu ') ]
+    except OSError:
+        return np.zeros((0, 2))
+    times = np.array([ [int(t) for t in line[1:]] for line in lines ], dtype=np.int64)
+    idle = times[:,3] + times[:,4] # idle + iowait
+    total = times.sum(axis=1)
+    return np.stack([total-idle, total], axis=1)
+
+def proc_rss_mb(pid='self')->float:
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as statm_f:
+            return int(statm_f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/2**20
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/2**10 if pid == 'self' else 0. # not linux, use peak instead
+
+def proc_read_bytes(pid='self')->int:
+    try:
+        with open(f'/proc/{pid}/io', 'r') as io_f:
+            for line in io_f:
+                if line.startswith('read_bytes:'): return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def child_pids(pid:int=None)->List[int]:
+    pid = pid or os.getpid()
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'): # cheap, but needs CONFIG_PROC_CHILDREN
+            with open(f'/proc/{pid}/task/{tid}/children', 'r') as children_f: children += [ int(p) for p in children_f.read().split() ]
+        return children
+    except (OSError, ValueError):
+        children = []
+    try: pids = [ int(p) for p in os.listdir('/proc') if p.isdigit() ]
+    except OSError: return children
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/stat', 'r') as stat_f: stat = stat_f.read()
+            if int(stat[stat.rfind(')')+2:].split()[1]) == pid: children.append(p) # ppid, after the (comm) field
+        except (OSError, IndexError, ValueError):
+            pass
+    return children
+
+def gpu_stats()->dict:
+    if not torch.cuda.is_available(): return {}
+    stats = { 'gpu_mem_mb': torch.cuda.memory_allocated()/2**20, 'gpu_max_mem_mb': torch.cuda.max_memory_allocated()/2**20 }
+    try: stats['gpu_util'] = float(torch.cuda.utilization()) # needs pynvml
+    except Exception: pass
+    return stats
+
+# Cell
+class ResourceMonitor():
+    def __init__(self, interval:float=1.0, quiet:bool=False):
+        self.interval = interval
+        self.quiet = quiet
+        self.history = []
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.epoch_start()
+
+    def start(self):
+        if self.thread is not None: return self
+        self.stopping.clear()
+        self.last_cpu = read_cpu_times()
+        self.last_reads = {}
+        self.read_bytes(child_pids()) # baseline, only reads after start count
+        self.last_time = time.perf_counter()
+        self.thread = threading.Thread(target=self.run, daemon=True, name='ResourceMonitor')
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is None: return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+    def __enter__(self): return self.start()
+
+    def __exit__(self, *args): self.stop()
+
+    def run(self):
+        while not self.stopping.wait(self.interval): self.sample()
+
+    def read_bytes(self, workers:List[int])->int:
+        # sum of bytes read since last call by this process and its live workers, workers that exited are dropped
+        reads = { pid: proc_read_bytes(pid) for pid in [os.getpid()] + workers }
+        delta = sum([ max(0, n - self.last_reads.get(pid, n)) for pid, n in reads.items() ])
+        self.last_reads = reads
+        return delta
+
+    def sample(self):
+        start = time.perf_counter()
+        cpu = read_cpu_times()
+        busy, total = (cpu - self.last_cpu).T if cpu.shape == self.last_cpu.shape else (np.zeros(0), np.zeros(0))
+        workers = child_pids()
+        values = { 'rss_mb': proc_rss_mb(), 'workers': len(workers), 'workers_rss_mb': sum([ proc_rss_mb(pid) for pid in workers ]),
+                   'disk_read_mbs': self.read_bytes(workers)/2**20/max(1e-6, start-self.last_time), **gpu_stats() }
+        self.last_cpu, self.last_time = cpu, start
+        with self.lock:
+            if len(total) > 0: self.core_busy, self.core_total = self.core_busy + busy, self.core_total + total
+            for k, v in values.items(): self.sums[k] = self.sums.get(k, 0.) + v
+            self.peak_rss_mb = max(self.peak_rss_mb, values['rss_mb'])
+            self.n_samples += 1
+            self.sample_secs += time.perf_counter()-start
+
+    def epoch_start(self):
+        with self.lock:
+            self.epoch_time = time.perf_counter()
+            n_cores = len(read_cpu_times())
+            self.core_busy, self.core_total = np.zeros(n_cores, dtype=np.int64), np.zeros(n_cores, dtype=np.int64)
+            self.sums = {}
+            self.peak_rss_mb = 0.
+            self.n_samples = 0
+            self.sample_secs = 0.
+
+    def epoch_end(self, n_items:int=None)->dict:
+        with self.lock:
+            secs = time.perf_counter()-self.epoch_time
+            core_pct = 100*self.core_busy/np.maximum(1, self.core_total)
+            stats = { 'epoch': len(self.history), 'secs': secs, 'items': n_items,
+                      'items_per_sec': n_items/secs if n_items else None, 'samples': self.n_samples,
+                      'cpu_pct': float(core_pct.mean()) if len(core_pct) > 0 else None, 'core_pct': core_pct.round(1).tolist(),
+                      **{ k: v/max(1, self.n_samples) for k, v in self.sums.items() },
+                      'peak_rss_mb': self.peak_rss_mb, 'overhead_pct': 100*self.sample_secs/max(1e-6, secs) }
+        self.history.append(stats)
+        if not self.quiet: print(self.describe(stats))
+        self.epoch_start()
+        return stats
+
+    def describe(self, stats:dict)->str:
+        desc = f"epoch {stats['epoch']}: {stats['secs']:.1f}s"
+        if stats['items_per_sec'] is not None: desc += f", {stats['items_per_sec']:.1f} items/s"
+        if stats['samples'] <= 0: return desc + ", no resource samples"
+        if stats['cpu_pct'] is not None: desc += f", cpu {stats['cpu_pct']:.0f}% (busiest core {max(stats['core_pct']):.0f}%)"
+        desc += f", rss {stats['rss_mb']:.0f}MB (peak {stats['peak_rss_mb']:.0f}MB)"
+        desc += f", {stats['workers']:.1f} workers {stats['workers_rss_mb']:.0f}MB, disk read {stats['disk_read_mbs']:.1f}MB/s"
+        if 'gpu_mem_mb' in stats: desc += f", gpu mem {stats['gpu_mem_mb']:.0f}MB (peak {stats['gpu_max_mem_mb']:.0f}MB)"
+        if 'gpu_util' in stats: desc += f", gpu {stats['gpu_util']:.0f}%"
+        return desc
+
+# Cell
+class PeakMemMeter():
+    def __init__(self, device_type:str='cpu', interval:float=0.005):
+        self.device_type = device_type
+        self.interval = interval
+        self.peak_mb = 0.
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.interval): self.peak_rss_mb = max(self.peak_rss_mb, proc_rss_mb())
+
+    def __enter__(self):
+        if self.device_type == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            self.base_mb = torch.cuda.memory_allocated()/2**20
+        else:
+            self.base_mb = self.peak_rss_mb = proc_rss_mb()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True, name='PeakMemMeter')
+            self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        if self.device_type == 'cuda':
+            torch.cuda.synchronize()
+            self.peak_mb = torch.cuda.max_memory_allocated()/2**20 - self.base_mb
+        else:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+            self.peak_mb = max(self.peak_rss_mb, proc_rss_mb()) - self.base_mb
\ No newline at end of file
@@ -0,0 +1,172 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 14_subcoco_profile.ipynb (unless otherwise specified).
+
+__all__ = ['RollingHist', 'StageProfiler', 'active_profiler', 'profile_stage', 'brief', 'import_times', 'import_cost']
+
+# Cell
+import bisect
+import csv
+import json
+import numpy as np
+import subprocess
+import sys
+import time
+import torch
+
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import List, Tuple
+
+# Cell
+class RollingHist():
+    edges = np.logspace(-6, 2, 33).tolist() # 1us to 100s, 4 bins per decade
+
+    def __init__(self, window:int=1024):
+        self.recent = np.zeros(window)
+        self.counts = [0]*(len(self.edges)+1)
+        self.n = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, secs:float):
+        self.recent[self.n % len(self.recent)] = secs
+        self.counts[bisect.bisect(self.edges, secs)] += 1
+        self.n += 1
+        self.total += secs
+        if secs > self.max: self.max = secs
+
+    def summary(self)->dict:
+        recent = self.recent[:min(self.n, len(self.recent))]
+        p50, p90, p99 = np.percentile(recent, [50, 90, 99]).tolist() if self.n > 0 else (0., 0., 0.)
+        return { 'count': self.n, 'total_s': self.total, 'mean_ms': 1000*self.total/max(1, self.n),
+                 'p50_ms': 1000*p50, 'p90_ms': 1000*p90, 'p99_ms': 1000*p99, 'max_ms': 1000*self.max }
+
+# Cell
+_active_profilers = []
+
+class StageProfiler():
+    def __init__(self, window:int=1024, cuda_sync:bool=False, trace_start:int=0, trace_steps:int=0, trace_dir:str='profile'):
+        self.window = window
+        self.cuda_sync = cuda_sync and torch.cuda.is_available() # accurate GPU stage times, at the cost of overlap
+        self.trace_start, self.trace_steps, self.trace_dir = trace_start, trace_steps, trace_dir
+        self.trace_fpath = None
+        self.tracer = None
+        self.hists = {}
+        self.stack = [] # nested stages, each entry is [name, time spent in nested stages]
+        self.steps = 0
+
+    def activate(self):
+        _active_profilers.append(self)
+        self.update_trace() # w/ trace_start=0 the window starts now
+
+    def deactivate(self):
+        if self in _active_profilers: _active_profilers.remove(self)
+        self.stop_trace() # window cut short, keep what was traced
+
+    def record(self, name:str, secs:float):
+        hist = self.hists.get(name, None)
+        if hist is None: hist = self.hists[name] = RollingHist(self.window)
+        hist.add(secs)
+
+    @contextmanager
+    def stage(self, name:str):
+        if self.cuda_sync: torch.cuda.synchronize()
+        entry = [name, 0.]
+        self.stack.append(entry)
+        start = time.perf_counter()
+        try:
+            with (torch.profiler.record_function(name) if self.tracer is not None else nullcontext()):
+                yield
+        finally:
+            if self.cuda_sync: torch.cuda.synchronize()
+            secs = time.perf_counter() - start
+            self.stack.pop()
+            if self.stack: self.stack[-1][1] += secs
+            self.record(name, secs - entry[1])
+
+    def step(self):
+        self.steps += 1
+        self.update_trace()
+
+    def update_trace(self):
+        # traces steps trace_start to trace_start+trace_steps-1, counting from 0
+        if self.trace_steps <= 0: return
+        if self.steps == self.trace_start and self.tracer is None: self.start_trace()
+        elif self.steps == self.trace_start + self.trace_steps: self.stop_trace()
+
+    def start_trace(self):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available(): activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.tracer = torch.profiler.profile(activities=activities)
+        self.tracer.__enter__()
+
+    def stop_trace(self):
+        if self.tracer is None: return
+        self.tracer.__exit__(None, None, None)
+        Path(self.trace_dir).mkdir(parents=True, exist_ok=True)
+        self.trace_fpath = str(Path(self.trace_dir)/f'trace_steps_{self.trace_start}-{self.steps}.json')
+        self.tracer.export_chrome_trace(self.trace_fpath) # view in chrome://tracing or perfetto
+        self.tracer = None
+
+    def summary(self)->List[dict]:
+        rows = [ { 'stage': name, **hist.summary() } for name, hist in self.hists.items() ]
+        all_secs = sum([ row['total_s'] for row in rows ])
+        for row in rows: row['share'] = row['total_s']/all_secs if all_secs > 0 else 0.
+        return sorted(rows, key=lambda row: -row['total_s'])
+
+    def to_csv(self, fpath:str):
+        rows = self.summary()
+        with open(fpath, 'w', newline='') as csv_f:
+            writer = csv.DictWriter(csv_f, fieldnames=list(rows[0].keys()) if rows else ['stage'])
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def to_json(self, fpath:str):
+        hists = { name: { 'edges_s': RollingHist.edges, 'counts': hist.counts } for name, hist in self.hists.items() }
+        with open(fpath, 'w') as json_f:
+            json.dump({ 'steps': self.steps, 'stages': self.summary(), 'hists': hists, 'trace': self.trace_fpath }, json_f)
+
+    def report(self):
+        print(f"{'stage':>12} {'share':>6} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'count':>7}")
+        for row in self.summary():
+            print(f"{row['stage']:>12} {100*row['share']:5.1f}% {row['total_s']:9.2f} {row['mean_ms']:9.2f} "
+                  f"{row['p50_ms']:9.2f} {row['p90_ms']:9.2f} {row['p99_ms']:9.2f} {row['count']:7d}")
+
+@contextmanager
+def active_profiler(prof:StageProfiler):
+    prof.activate()
+    try: yield prof
+    finally: prof.deactivate()
+
+def profile_stage(name:str):
+    return _active_profilers[-1].stage(name) if _active_profilers else nullcontext()
+
+def brief(o)->str:
+    # short description of (nested) tensors for logging, instead of printing every value
+    if isinstance(o, torch.Tensor): return f"{o.item():.4g}" if o.numel() == 1 else f"{o.dtype}{list(o.shape)}"
+    if isinstance(o, dict): return '{' + ', '.join([ f"{k}: {brief(v)}" for k, v in o.items() ]) + '}'
+    if isinstance(o, (list, tuple)): return f"{len(o)}x[{brief(o[0])}]" if len(o) > 0 else '[]'
+    return repr(o)
+
+# Cell
+def import_times(module:str, python:str=sys.executable)->List[Tuple[str, int, float, float]]:
+    # (module, nesting level, self ms, cumulative ms) per module imported, children before their parent
+    res = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True)
+    times = []
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line: continue
+        self_us, cum_us, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), (len(name)-len(name.lstrip())-1)//2, int(self_us)/1000, int(cum_us)/1000))
+    return times
+
+def import_cost(module:str, exclude:Tuple[str]=('torch', 'numpy'), python:str=sys.executable)->Tuple[float, set]:
+    total_ms, pkgs, skip_level = 0., set(), None
+    for name, level, self_ms, _ in reversed(import_times(module, python)): # parents before their children
+        if skip_level is not None and level > skip_level: continue # imported by an excluded package
+        skip_level = None
+        pkg = name.split('.')[0]
+        if pkg in exclude:
+            skip_level = level
+            continue
+        pkgs.add(pkg)
+        total_ms += self_ms
+    return total_ms, pkgs
\ No newline at end of file
@@ -0,0 +1,105 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 23_subcoco_render.ipynb (unless otherwise specified).
+
+__all__ = ['label_colors', 'to_uint8', 'pixel_boxes', 'draw_boxes', 'l2bs_arrays', 'PALETTE', 'render_item',
+           'contact_sheet', 'write_sheet', 'write_contact_sheets']
+
+# Cell
+import cv2
+import numpy as np
+import torch
+
+from pathlib import Path
+from typing import List, Tuple
+from .subcoco_utils import *
+
+# Cell
+# tableau colors, as used by overlay_img_bbox()
+PALETTE = np.array([[31, 119, 180], [255, 127, 14], [44, 160, 44], [214, 39, 40], [148, 103, 189],
+                    [140, 86, 75], [227, 119, 194], [127, 127, 127], [188, 189, 34], [23, 190, 207]], dtype=np.uint8)
+
+def label_colors(lbls:np.ndarray)->np.ndarray:
+    return PALETTE[np.asarray(lbls, dtype=np.int64) % len(PALETTE)]
+
+def to_uint8(img)->np.ndarray:
+    "HxWx3 uint8 copy of a PIL image, a CxHxW tensor in [0, 1] or a HxW(x3) array, in [0, 1] unless uint8"
+    if isinstance(img, torch.Tensor): img = img.detach().cpu().permute(1, 2, 0).numpy() if img.dim() == 3 else img.detach().cpu().numpy()
+    img = np.asarray(img)
+    img = np.array(img) if img.dtype == np.uint8 else (np.clip(img, 0.0, 1.0)*255+0.5).astype(np.uint8)
+    if img.ndim == 2: img = img[:, :, None]
+    return np.ascontiguousarray(np.broadcast_to(img, (*img.shape[:2], 3)) if img.shape[2] == 1 else img)
+
+def pixel_boxes(boxes:np.ndarray, img_w:int, img_h:int, box_fmt:str='xyxy')->np.ndarray:
+    "Int x1,y1,x2,y2 of `boxes`, inclusive, inside an `img_w` x `img_h` image"
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if box_fmt == 'xywh': boxes = np.concatenate([boxes[:, :2], boxes[:, :2]+boxes[:, 2:]], axis=1)
+    xy1 = np.floor(boxes[:, :2])
+    xy2 = np.maximum(np.ceil(boxes[:, 2:])-1, xy1)
+    return np.clip(np.concatenate([xy1, xy2], axis=1), 0, [img_w-1, img_h-1, img_w-1, img_h-1]).astype(np.int64)
+
+def draw_boxes(img, boxes:np.ndarray, lbls:np.ndarray, l2name:dict=None, scores:np.ndarray=None, box_fmt:str='xyxy',
+               thickness:int=2, font_scale:float=0.35)->np.ndarray:
+    "Copy of `img` as uint8 w/ `boxes` in label colors, captioned w/ label names if `l2name` and w/ `scores` if given"
+    img = to_uint8(img)
+    xyxys = pixel_boxes(boxes, img.shape[1], img.shape[0], box_fmt).tolist()
+    colors = label_colors(lbls)
+    t = thickness
+    for (x1, y1, x2, y2), color in zip(xyxys, colors):
+        img[y1:y1+t, x1:x2+1] = color
+        img[max(y1, y2-t+1):y2+1, x1:x2+1] = color
+        img[y1:y2+1, x1:x1+t] = color
+        img[y1:y2+1, max(x1, x2-t+1):x2+1] = color
+    if l2name is None and scores is None: return img
+    for i, ((x1, y1, _, _), color, lbl) in enumerate(zip(xyxys, colors.tolist(), np.asarray(lbls).tolist())):
+        caption = ' '.join(([ str(l2name.get(lbl, lbl)) ] if l2name is not None else []) + ([ f'{scores[i]:.2f}' ] if scores is not None else []))
+        (tw, th), base = cv2.getTextSize(caption, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)
+        ty = max(y1-th-base, 0)
+        img[ty:ty+th+base, x1:x1+tw] = color
+        cv2.putText(img, caption, (x1, ty+th), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), 1, cv2.LINE_AA)
+    return img
+
+def l2bs_arrays(l2bs:dict)->Tuple[np.ndarray, np.ndarray]:
+    "Labels and x,y,w,h boxes of a label to boxes dict, e.g. from `digest_pred()` or `img2l2bs`"
+    lbls = np.array([ l for l, bs in l2bs.items() for _ in bs ], dtype=np.int64)
+    return lbls, np.array([ b for bs in l2bs.values() for b in bs ], dtype=np.float64).reshape(-1, 4)
+
+# Cell
+def render_item(item:dict, cell_sz:int=128, l2name:dict=None, box_fmt:str='xyxy', cutoff=0.5)->np.ndarray:
+    "Thumbnail, no bigger than `cell_sz`, of `item['img']` or image file `item['fpath']` w/ the `item['boxes']` scoring above `cutoff`"
+    img = item['img'] if 'img' in item else cv2.cvtColor(cv2.imread(str(item['fpath'])), cv2.COLOR_BGR2RGB)
+    img = to_uint8(img)
+    h, w = img.shape[:2]
+    scale = cell_sz/max(h, w)
+    thumb = cv2.resize(img, (max(1, round(w*scale)), max(1, round(h*scale))), interpolation=cv2.INTER_AREA)
+    lbls, boxes, scores = pred_arrays(item, cutoff)
+    return draw_boxes(thumb, boxes*scale, lbls, l2name, scores if 'scores' in item else None, box_fmt=box_fmt, thickness=1)
+
+def contact_sheet(thumbs:List[np.ndarray], ncols:int=8, cell_sz:int=128, pad:int=2)->np.ndarray:
+    "Grid of `thumbs`, each centered in a `cell_sz` square cell, on white"
+    nrows = max(1, -(-len(thumbs)//ncols))
+    sheet = np.full((nrows*(cell_sz+pad)+pad, ncols*(cell_sz+pad)+pad, 3), 255, dtype=np.uint8)
+    for i, thumb in enumerate(thumbs):
+        row, col = divmod(i, ncols)
+        h, w = thumb.shape[:2]
+        y0, x0 = pad+row*(cell_sz+pad)+(cell_sz-h)//2, pad+col*(cell_sz+pad)+(cell_sz-w)//2
+        sheet[y0:y0+h, x0:x0+w] = thumb
+    return sheet
+
+def write_sheet(job:tuple)->str:
+    fpath, items, ncols, cell_sz, quality, render_kwargs = job
+    sheet = contact_sheet([ render_item(item, cell_sz, **render_kwargs) for item in items ], ncols, cell_sz)
+    cv2.imwrite(str(fpath), cv2.cvtColor(sheet, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return str(fpath)
+
+def write_contact_sheets(items:List[dict], out_dir:str, ncols:int=8, nrows:int=8, cell_sz:int=128, l2name:dict=None,
+                         box_fmt:str='xyxy', cutoff=0.5, workers:int=0, prefix:str='sheet', quality:int=90)->List[str]:
+    "Jpg sheets of `nrows` x `ncols` rendered `items`, i.e. dicts of 'img' or 'fpath' and 'boxes', 'labels' & optionally 'scores'"
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    per_sheet = ncols*nrows
+    render_kwargs = dict(l2name=l2name, box_fmt=box_fmt, cutoff=cutoff)
+    jobs = [ (out_dir/f'{prefix}_{i//per_sheet:04d}.jpg', items[i:i+per_sheet], ncols, cell_sz, quality, render_kwargs)
+             for i in range(0, len(items), per_sheet) ]
+    if workers <= 0: return list(map(write_sheet, jobs))
+    import multiprocessing
+    with multiprocessing.Pool(workers) as pool:
+        return pool.map(write_sheet, jobs, chunksize=1)
\ No newline at end of file
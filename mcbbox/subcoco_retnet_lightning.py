@@ -3,28 +3,9 @@
 __all__ = ['RetinaNetModule', 'save_final']
 
 # Cell
-import json, os, requests, sys, tarfile
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-import numpy as np
-import pickle
-import random
-
-from collections import defaultdict
-from functools import reduce
-from IPython.utils import io
-from pathlib import Path
-from PIL import Image
-from PIL import ImageStat
-
-from pycocotools.coco import COCO
-from pycocotools.cocoeval import COCOeval
-from tqdm import tqdm
-from typing import Hashable, List, Tuple, Union
-
-# Cell
+import sys
 import albumentations as A
-import torch, torchvision
+import math, torch, torchvision
 import pytorch_lightning as pl
 import torch.nn.functional as F
 import torch.multiprocessing
@@ -33,22 +14,32 @@ from torch.nn.modules import module
 from torch import optim
 from torch.utils.data import DataLoader, random_split
 from torchvision.models.detection import RetinaNet, retinanet_resnet50_fpn
+from torchvision.models.detection.rpn import AnchorGenerator
 from .subcoco_utils import *
 from .subcoco_lightning_utils import *
+from .subcoco_weights import *
 
 torch.multiprocessing.set_sharing_strategy('file_system')
-print(f"Python ver {sys.version}, torch {torch.__version__}, torchvision {torchvision.__version__}, pytorch_lightning {pl.__version__}")
-
 if is_notebook():
     from nbdev.showdoc import *
+    print(f"Python ver {sys.version}, torch {torch.__version__}, torchvision {torchvision.__version__}, pytorch_lightning {pl.__version__}")
 
 # Cell
 class RetinaNetModule(AbstractDetectorLightningModule):
     def __init__(self, **kwargs):
         AbstractDetectorLightningModule.__init__(self, **kwargs)
 
-    def create_model(self, backbone_name, num_classes=1, **kwargs):
-        model = retinanet_resnet50_fpn(pretrained=False, num_classes=num_classes+1, pretrained_backbone=True)
+    def create_model(self, backbone_name, num_classes=1, pretrained=True, anchors:dict=None, **kwargs):
+        # imagenet backbone weights are fetched once, then loaded from the local weights store
+        model = build_model('retinanet_resnet50_fpn-backbone', lambda pretrained: retinanet_resnet50_fpn(
+            pretrained=False, pretrained_backbone=pretrained), pretrained=pretrained)
+
+        # resize class logits in place for num_classes, initialized as RetinaNetClassificationHead does
+        cls_head = model.head.classification_head
+        cls_head.cls_logits = nn.Conv2d(cls_head.cls_logits.in_channels, cls_head.num_anchors*(num_classes+1), kernel_size=3, stride=1, padding=1)
+        nn.init.normal_(cls_head.cls_logits.weight, std=0.01)
+        nn.init.constant_(cls_head.cls_logits.bias, -math.log((1-0.01)/0.01))
+        cls_head.num_classes = num_classes+1
 
         # Hacked to avoid model builtin call to GeneralizedRCNNTransform.normalize() as done in augmentation
         def noop_normalize(image): return image
@@ -60,6 +51,15 @@ class RetinaNetModule(AbstractDetectorLightningModule):
         model.transform.normalize = noop_normalize
         model.transform.resize = noop_resize
 
+        # anchors e.g. from tune_anchors(like=RETINANET_ANCHORS), as many per location as the head predicts
+        if anchors:
+            anchor_generator = AnchorGenerator(sizes=anchors['sizes'], aspect_ratios=anchors['aspect_ratios'])
+            assert anchor_generator.num_anchors_per_location() == model.anchor_generator.num_anchors_per_location(), "Anchors per location must not change"
+            model.anchor_generator = anchor_generator
+
+        # anchors are made in dtype of feature maps, keep them fp32 under mixed precision
+        keep_fp32(model.anchor_generator)
+
         return model
 
     def get_main_model(self): return self.model
@@ -68,6 +68,16 @@ class RetinaNetModule(AbstractDetectorLightningModule):
 
     def get_backbone(self): return self.model.backbone
 
+    def extract_features(self, xs):
+        images, _ = self.model.transform(xs)
+        return self.model.backbone(images.tensors)
+
+    def head_loss(self, feats, ys):
+        feats = list(feats.values())
+        head_outputs = self.model.head(feats)
+        anchors = self.model.anchor_generator(self.blank_image_list(len(ys)), feats)
+        return self.model.compute_loss(ys, head_outputs, anchors)
+
 
 # Cell
 def save_final(retnet_model, model_save_path):
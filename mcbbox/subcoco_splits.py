@@ -0,0 +1,73 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 22_subcoco_splits.ipynb (unless otherwise specified).
+
+__all__ = ['hash_uniform', 'rarest_labels', 'split_positions', 'cached_split', 'split_img_ids']
+
+# Cell
+import numpy as np
+import os
+
+from pathlib import Path
+from typing import Tuple
+from .subcoco_utils import *
+
+# Cell
+def hash_uniform(ids:np.ndarray, seed:int=42)->np.ndarray:
+    "Uniform [0, 1) of each (id, seed) w/ splitmix64, the same in every process and on every platform"
+    with np.errstate(over='ignore'):
+        z = np.asarray(ids).astype(np.uint64) + np.uint64(seed % 2**64)*np.uint64(0x9E3779B97F4A7C15)
+        for _ in range(2): # 2 rounds, consecutive ids and seeds are not correlated
+            z = z + np.uint64(0x9E3779B97F4A7C15)
+            z = (z ^ (z >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+            z = (z ^ (z >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+            z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64)/2.0**53
+
+def rarest_labels(label_hists:np.ndarray)->np.ndarray:
+    "Stratum of each image, its least common label over all images, 0 if it has no boxes"
+    has_lbl = label_hists > 0
+    has_lbl[:, 0] = False # background
+    n_imgs = np.where(has_lbl.any(axis=0), has_lbl.sum(axis=0), np.iinfo(np.int64).max)
+    return np.where(has_lbl.any(axis=1), np.argmin(np.where(has_lbl, n_imgs, np.iinfo(np.int64).max), axis=1), 0)
+
+def split_positions(img_ids:np.ndarray, valid_ratio:float=0.05, seed:int=42, strata:np.ndarray=None)->Tuple[np.ndarray, np.ndarray]:
+    "Sorted positions of the train and valid images, `round(valid_ratio*len(img_ids))` valid ones, spread over `strata` in proportion"
+    n = len(img_ids)
+    strata = np.zeros(n, dtype=np.int64) if strata is None else np.asarray(strata, dtype=np.int64)
+    n_valid = int(round(valid_ratio*n))
+    # per stratum share of valid images, rounded down, the rest goes to the strata w/ the largest remainders
+    _, stratum, stratum_n = np.unique(strata, return_inverse=True, return_counts=True)
+    share = valid_ratio*stratum_n
+    stratum_valid = np.floor(share).astype(np.int64)
+    extra = np.argsort(-(share-stratum_valid), kind='stable')[:n_valid-stratum_valid.sum()]
+    stratum_valid[extra] += 1
+    # within a stratum, images w/ the smallest hashes are valid
+    order = np.lexsort((np.asarray(img_ids), hash_uniform(img_ids, seed), stratum))
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n) - (np.cumsum(stratum_n) - stratum_n)[stratum[order]]
+    is_valid = rank < stratum_valid[stratum]
+    return np.flatnonzero(~is_valid).astype(np.int32), np.flatnonzero(is_valid).astype(np.int32)
+
+# Cell
+def cached_split(anno:AnnoArrays, cache_dir:str, valid_ratio:float=0.05, seed:int=42, stratify:bool=True,
+                 force_rebuild:bool=False)->Tuple[np.ndarray, np.ndarray]:
+    "Train and valid positions of all images in `anno`, computed once per annotations, ratio, seed & stratification"
+    fpath = Path(cache_dir)/f'{anno.digest()[:16]}_v{valid_ratio:g}_seed{seed}{"_strat" if stratify else ""}.npz'
+    if fpath.is_file() and not force_rebuild:
+        try:
+            with np.load(fpath) as split: return split['train'], split['valid']
+        except Exception as e:
+            print(f"Failed to read cached split {fpath}: {e}")
+    strata = rarest_labels(label_histograms(anno, np.arange(len(anno)))) if stratify else None
+    train_pos, valid_pos = split_positions(anno.img_ids, valid_ratio, seed, strata)
+    fpath.parent.mkdir(parents=True, exist_ok=True)
+    tmp_fpath = fpath.parent/f'.{fpath.stem}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_fpath, train=train_pos, valid=valid_pos)
+    os.replace(tmp_fpath, fpath)
+    return train_pos, valid_pos
+
+def split_img_ids(stats:CocoDatasetStats, valid_ratio:float=0.05, seed:int=42, stratify:bool=True,
+                  force_rebuild:bool=False)->Tuple[list, list]:
+    "Train and valid image ids of `stats`, the split is kept in a `splits` directory next to the images"
+    anno = stats_arrays(stats)
+    train_pos, valid_pos = cached_split(anno, Path(stats.img_dir).parent/'splits', valid_ratio, seed, stratify, force_rebuild)
+    return anno.img_ids[train_pos].tolist(), anno.img_ids[valid_pos].tolist()
\ No newline at end of file
@@ -0,0 +1,84 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 12_subcoco_synth.ipynb (unless otherwise specified).
+
+__all__ = ['synth_img', 'synth_imgs', 'gen_synth_coco']
+
+# Cell
+import json
+import multiprocessing
+import numpy as np
+import os
+
+from pathlib import Path
+from PIL import Image, ImageDraw
+from typing import List, Tuple
+
+# Cell
+def synth_img(img_id:int, img_dir:Path, img_sizes, size_probs, cat_ids:List[int], cat2color:dict,
+              boxs_per_img:Tuple[int, int], box_ratio:Tuple[float, float], seed:int, quality:int)->Tuple[dict, List[dict]]:
+    rng = np.random.default_rng([seed, img_id]) # same image regardless of which worker makes it
+    w, h = img_sizes[rng.choice(len(img_sizes), p=size_probs)]
+    img = Image.new('RGB', (w, h), tuple(rng.integers(0, 256, 3).tolist()))
+    draw = ImageDraw.Draw(img)
+    annos = []
+    for _ in range(rng.integers(boxs_per_img[0], boxs_per_img[1]+1)):
+        bw, bh = (rng.uniform(*box_ratio, 2)*(w, h)).tolist()
+        x, y = (rng.uniform(0, 1, 2)*(w-bw, h-bh)).tolist()
+        cid = cat_ids[rng.integers(len(cat_ids))]
+        draw.rectangle([x, y, x+bw, y+bh], fill=cat2color[cid])
+        annos.append({ 'image_id': img_id, 'category_id': cid, 'bbox': [x, y, bw, bh], 'area': bw*bh, 'iscrowd': 0 })
+    fname = f'{img_id:012d}.jpg'
+    img.save(img_dir/fname, quality=quality)
+    return { 'id': img_id, 'file_name': fname, 'width': w, 'height': h }, annos
+
+def synth_imgs(args)->List[Tuple[dict, List[dict]]]:
+    img_ids, kwargs = args
+    return [ synth_img(img_id, **kwargs) for img_id in img_ids ]
+
+# Cell
+def gen_synth_coco(datadir:str='workspace', froot:str='synth_coco', img_subdir:str='train', n_imgs:int=1000,
+                   img_sizes:List[Tuple[int, int]]=((640, 480), (480, 640), (640, 427)), size_probs:List[float]=None,
+                   n_cats:int=10, cat_id_step:int=1, boxs_per_img:Tuple[int, int]=(1, 8), box_ratio:Tuple[float, float]=(0.05, 0.5),
+                   seed:int=0, workers:int=None, chunk_size:int=256, quality:int=85, force:bool=False)->Tuple[dict, str]:
+    img_dir = Path(datadir)/froot/img_subdir
+    json_fpath = img_dir.parent/f'{img_subdir}.json'
+    img_sizes = [ tuple(sz) for sz in img_sizes ]
+    params = dict(n_imgs=n_imgs, img_sizes=img_sizes, size_probs=size_probs, n_cats=n_cats, cat_id_step=cat_id_step,
+                  boxs_per_img=list(boxs_per_img), box_ratio=list(box_ratio), seed=seed, quality=quality)
+    params = json.loads(json.dumps(params)) # as read back from json
+    if os.path.isfile(json_fpath) and not force:
+        with open(json_fpath, 'r') as json_f: ann = json.load(json_f)
+        if ann.get('info', {}).get('synth_params', None) == params: return ann, str(img_dir)
+
+    img_dir.mkdir(parents=True, exist_ok=True)
+    # coco category ids need not be contiguous, cat_id_step > 1 exercises the category to label mapping
+    cat_ids = [ 1 + i*cat_id_step for i in range(n_cats) ]
+    rng = np.random.default_rng(seed)
+    cat2color = { cid: tuple(rng.integers(0, 256, 3).tolist()) for cid in cat_ids }
+    size_probs = None if size_probs is None else np.array(size_probs)/np.sum(size_probs)
+    kwargs = dict(img_dir=img_dir, img_sizes=img_sizes, size_probs=size_probs, cat_ids=cat_ids, cat2color=cat2color,
+                  boxs_per_img=boxs_per_img, box_ratio=box_ratio, seed=seed, quality=quality)
+    chunks = [ (range(start, min(start+chunk_size, n_imgs+1)), kwargs) for start in range(1, n_imgs+1, chunk_size) ]
+    workers = min(workers or os.cpu_count(), len(chunks))
+
+    imgs, annos = [], []
+    def collect(results):
+        for img, img_annos in results:
+            imgs.append(img)
+            for anno in img_annos: annos.append({ 'id': len(annos)+1, **anno })
+
+    if workers <= 1:
+        for chunk in chunks: collect(synth_imgs(chunk))
+    else:
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            for results in pool.imap(synth_imgs, chunks): collect(results) # in order, so ids are deterministic
+
+    ann = {
+        'info': { 'description': f'Synthetic COCO format dataset {froot}', 'synth_params': params },
+        'images': imgs,
+        'annotations': annos,
+        'categories': [ { 'id': cid, 'name': f'shape{cid}' } for cid in cat_ids ],
+    }
+    tmp_fpath = f'{json_fpath}.{os.getpid()}.tmp'
+    with open(tmp_fpath, 'w') as json_f: json.dump(ann, json_f)
+    os.replace(tmp_fpath, json_fpath) # written last, a half generated set is never picked up
+    return ann, str(img_dir)
\ No newline at end of file
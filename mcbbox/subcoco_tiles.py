@@ -0,0 +1,100 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 19_subcoco_tiles.ipynb (unless otherwise specified).
+
+__all__ = ['tile_starts', 'tile_grid', 'cut_tile', 'seam_pairs', 'merge_detections', 'as_cpu_tensor', 'predict_tiled',
+           'tiles_per_image']
+
+# Cell
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from torch import Tensor
+from typing import Callable, List
+
+from .subcoco_box_ops import *
+
+# Cell
+def tile_starts(length:int, tile:int, overlap:int)->List[int]:
+    if length <= tile: return [0]
+    stride = max(1, tile-overlap)
+    return list(range(0, length-tile, stride)) + [length-tile] # last tile flush w/ the border
+
+def tile_grid(img_h:int, img_w:int, tile:int, overlap:int=32)->Tensor:
+    "[x0, y0, x1, y1] of each tile, row by row, x1 and y1 clipped to the image"
+    ys, xs = tile_starts(img_h, tile, overlap), tile_starts(img_w, tile, overlap)
+    return torch.tensor([ [x, y, min(x+tile, img_w), min(y+tile, img_h)] for y in ys for x in xs ], dtype=torch.float32)
+
+def cut_tile(img:Tensor, xyxy:Tensor, tile:int)->Tensor:
+    x0, y0, x1, y1 = [ int(v) for v in xyxy.tolist() ]
+    crop = img[:, y0:y1, x0:x1]
+    # zero padded to right and bottom, keeps tile coordinates == image coordinates - (x0, y0)
+    return F.pad(crop, (0, tile-crop.shape[2], 0, tile-crop.shape[1])) if crop.shape[1:] != (tile, tile) else crop
+
+# Cell
+def seam_pairs(boxes:Tensor, tile_boxes:Tensor, img_wh, tol:float=1., seam_thr:float=0.5)->Tensor:
+    "(n, n) bool, pairs of xyxy `boxes` which are pieces of 1 object cut by the border of tile `tile_boxes` of either"
+    x1, y1, x2, y2 = boxes.unbind(1)
+    tx1, ty1, tx2, ty2 = tile_boxes.unbind(1)
+    img_w, img_h = img_wh
+    def extent_ios(lo, hi):
+        inter = (torch.min(hi[:, None], hi[None]) - torch.max(lo[:, None], lo[None])).clamp(min=0)
+        return inter/torch.min((hi-lo)[:, None], (hi-lo)[None]).clamp(min=1e-9)
+    along_x, along_y = extent_ios(x1, x2) > seam_thr, extent_ios(y1, y2) > seam_thr
+    # i cut at a side, j continues past it from at or before it
+    left = ((x1 <= tx1+tol) & (tx1 > 0))[:, None] & (x1[None] < x1[:, None]-tol) & (x2[None] >= x1[:, None]-tol) & along_y
+    right = ((x2 >= tx2-tol) & (tx2 < img_w))[:, None] & (x2[None] > x2[:, None]+tol) & (x1[None] <= x2[:, None]+tol) & along_y
+    top = ((y1 <= ty1+tol) & (ty1 > 0))[:, None] & (y1[None] < y1[:, None]-tol) & (y2[None] >= y1[:, None]-tol) & along_x
+    bottom = ((y2 >= ty2-tol) & (ty2 < img_h))[:, None] & (y2[None] > y2[:, None]+tol) & (y1[None] <= y2[:, None]+tol) & along_x
+    crosses = left | right | top | bottom
+    other_tile = (tile_boxes[:, None] != tile_boxes[None]).any(dim=2)
+    return (crosses | crosses.T) & other_tile
+
+def merge_detections(boxes:Tensor, scores:Tensor, labels:Tensor, tile_boxes:Tensor=None, img_wh=None,
+                     iou_thr:float=0.5, seam_thr:float=0.5)->dict:
+    "Pieces of objects cut by tile borders joined into their union w/ the best score, then class aware NMS, in descending score order"
+    if tile_boxes is not None and len(boxes) > 1:
+        pairs = seam_pairs(boxes, tile_boxes, img_wh, seam_thr=seam_thr) & (labels[:, None] == labels[None])
+        # each box takes the smallest index in its group of pieces, until no more change
+        group = torch.arange(len(boxes))
+        while True:
+            joined = torch.where(pairs, group[None], group[:, None]).min(dim=1).values
+            if torch.equal(joined, group): break
+            group = joined
+        group = group.numpy()
+        merged, best = boxes.cpu().numpy().copy(), scores.cpu().numpy().copy()
+        np.minimum.at(merged[:, :2], group, merged[:, :2])
+        np.maximum.at(merged[:, 2:], group, merged[:, 2:])
+        np.maximum.at(best, group, best)
+        kept = np.flatnonzero(group == np.arange(len(group)))
+        boxes, scores, labels = torch.from_numpy(merged[kept]).to(boxes), torch.from_numpy(best[kept]).to(scores), labels[torch.from_numpy(kept)]
+    keep = class_aware_nms(boxes, scores, labels, iou_thr)
+    return { 'boxes': boxes[keep], 'scores': scores[keep], 'labels': labels[keep] }
+
+# Cell
+def as_cpu_tensor(v)->Tensor:
+    # effdet predictions are numpy arrays
+    return v.detach().cpu() if isinstance(v, Tensor) else torch.as_tensor(np.asarray(v))
+
+def predict_tiled(predict:Callable[[List[Tensor]], List[dict]], imgs:List[Tensor], tile:int, overlap:int=32, bs:int=8,
+                  iou_thr:float=0.5, score_thr:float=0., seam_thr:float=0.5)->List[dict]:
+    "Predictions for full resolution CHW `imgs`, `predict` takes a list of `tile` x `tile` images, returns their predictions"
+    grids = [ tile_grid(img.shape[1], img.shape[2], tile, overlap) for img in imgs ]
+    tiles = [ (i, xyxy) for i, grid in enumerate(grids) for xyxy in grid ]
+    found = [ [] for _ in imgs ]
+    for start in range(0, len(tiles), bs):
+        batch = tiles[start:start+bs]
+        preds = predict([ cut_tile(imgs[i], xyxy, tile) for i, xyxy in batch ])
+        for (i, xyxy), pred in zip(batch, preds):
+            boxes = as_cpu_tensor(pred['boxes']).float().reshape(-1, 4)
+            scores = as_cpu_tensor(pred['scores']).float().reshape(-1)
+            labels = as_cpu_tensor(pred['labels']).long().reshape(-1)
+            keep = scores > score_thr
+            boxes = boxes[keep] + xyxy[[0, 1, 0, 1]]
+            # nothing in the zero padding beyond the image
+            boxes = torch.min(boxes, xyxy[[2, 3, 2, 3]])
+            found[i].append((boxes, scores[keep], labels[keep], xyxy.expand(len(boxes), 4)))
+    return [ merge_detections(*[ torch.cat(parts) for parts in zip(*img_found) ], img_wh=(img.shape[2], img.shape[1]), iou_thr=iou_thr, seam_thr=seam_thr)
+             for img, img_found in zip(imgs, found) ]
+
+def tiles_per_image(img_h:int, img_w:int, tile:int, overlap:int=32)->int:
+    return len(tile_starts(img_h, tile, overlap))*len(tile_starts(img_w, tile, overlap))
\ No newline at end of file
@@ -1,44 +1,38 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 10_subcoco_utils.ipynb (unless otherwise specified).
 
-__all__ = ['fetch_data', 'fetch_subcoco', 'CocoDatasetStats', 'empty_list', 'load_stats', 'box_within_bounds',
+__all__ = ['fetch_data', 'fetch_subcoco', 'CocoDatasetStats', 'image_stats', 'hist_mean_std', 'map_images', 'merge_ann',
+           'empty_list', 'load_stats', 'save_stats', 'update_stats', 'AnnoArrays', 'stats_arrays', 'ANNO_ARRAYS',
+           'boxes_within_bounds', 'box_within_bounds', 'files_found', 'bulk_lbs', 'label_histograms', 'cached_pickle',
            'is_notebook', 'overlay_img_bbox', 'bbox_to_rect', 'label_for_bbox', 'listify', 'tensorify',
-           'SubCocoWrapper', 'iou_calc', 'match_true_false_neg', 'calc_wavg_F1', 'clamp_fn', 'digest_pred']
+           'SubCocoWrapper', 'iou_calc', 'match_true_false_neg', 'calc_wavg_F1', 'numpify', 'cat_numpy', 'box_pairs',
+           'pair_iou', 'best_pairs', 'greedy_matches', 'match_boxes', 'f1_scores', 'weighted_f1', 'F1Accumulator', 'TP',
+           'FP', 'FN', 'greedy_by_score', 'pick_by_score', 'match_by_score', 'score_cutoffs', 'ThresholdSweep',
+           'clamp_fn', 'pred_arrays', 'digest_pred']
 
 # Cell
-import albumentations as A
-import cv2
 import glob
+import hashlib
 import json
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
 import numpy as np
 import os
 import pickle
-import PIL
-import re
-import requests
-import sys
-import tarfile
+import shutil
 import torch
-import torchvision
+import weakref
 
-from albumentations.pytorch import ToTensorV2
 from collections import defaultdict
+from contextlib import redirect_stdout
 from functools import reduce
-from IPython.utils import io
+from io import StringIO
 from pathlib import Path
-from PIL import Image, ImageStat
-from pycocotools.coco import COCO
-from pycocotools.cocoeval import COCOeval
-from shutil import copyfile, rmtree
-from torch.utils.data import DataLoader, random_split
-from torchvision import transforms
-from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
-from tqdm import tqdm
-from typing import Hashable, List, Tuple, Union
+from typing import Dict, List, Tuple
+
+from .subcoco_box_ops import *
 
 # Cell
 def fetch_data(url:str, datadir: Path, tgt_fname:str, chunk_size:int=8*1024, quiet=False):
+    import requests, tarfile
+    from tqdm import tqdm
     dest = datadir/tgt_fname
     if not quiet: print(f"Downloading from {url} to {dest}...")
     with requests.get(url, stream=True, timeout=10) as response:
@@ -100,12 +94,13 @@ class CocoDatasetStats():
     # chn_stds
     # avg_width
     # avg_height
-    def __init__(self, ann:dict, img_dir:str):
+    # chn_hists: [channel, pixel value] counts over all pixels of all images
+    # img2nanns: num of annotations per image id, incl. those of images w/o file
+    # version: bumped by every update()
+    def __init__(self, ann:dict, img_dir:str, workers:int=0):
 
         self.img_dir = Path(img_dir)
         self.num_cats = len(ann['categories'])
-        self.num_imgs = len(ann['images'])
-        self.num_bboxs = len(ann['annotations'])
 
         # build cat id to name, assign FRCNN
         self.cat2name = { c['id']: c['name'] for c in ann['categories'] }
@@ -118,46 +113,35 @@ class CocoDatasetStats():
         self.lbl2cat[0] = 0 # background
         self.cat2lbl[0] = 0 # background
 
-        # img_id to file map
-        self.img2fname = { img['id']:img['file_name'] for img in ann['images'] }
-
-        # compute Images per channel means and std deviation using PIL.ImageStat.Stat()
-
+        self.img2fname = {}
         self.img2sz = {}
-        n = 0
-        mean = np.zeros((3,))
-        stddev = np.zeros((3,))
-        avgw = 0
-        avgh = 0
-        for img_id, img_fname in tqdm(self.img2fname.items()):
-            img_fpath = self.img_dir/img_fname
-            if not os.path.isfile(img_fpath): continue
-            n = n + 1
-            img = Image.open(img_fpath)
-            istat = ImageStat.Stat(img)
-            width, height = img.size
-            avgw = (width + (n-1)*avgw)/n
-            avgh = (height + (n-1)*avgh)/n
-            mean = (istat.mean + (n-1)*mean)/n
-            stddev = (istat.stddev + (n-1)*stddev)/n
-            self.img2sz[img_id] = (width, height)
-
-        # cleanup stats due to missing images
-        self.num_imgs = len(self.img2sz)
-        self.img2fname = { img_id: fname for img_id, fname in self.img2fname.items() if img_id in self.img2sz }
-
-        self.chn_means = mean
-        self.chn_stds = stddev
-        self.avg_width = avgw
-        self.avg_height = avgh
-
-        # build up some maps for later analysis
+        self.chn_hists = np.zeros((3, 256), dtype=np.int64)
+        self.img2nanns = defaultdict(int)
         self.img2l2bs = {}
         self.img2lbs = defaultdict(empty_list)
         self.l2ibs = defaultdict(empty_list)
-        anno_id = 0
-        for a in ann['annotations']:
+        self.num_bboxs = 0
+        self.version = 0
+        self.add_images(ann['images'], workers=workers)
+        self.add_annotations(ann['annotations'])
+        self.summarize()
+
+    def add_images(self, imgs:List[dict], workers:int=0):
+        # pixel value histograms per channel, summed over images, only images w/ a file are kept
+        from tqdm import tqdm
+        for img in imgs: assert img['id'] not in self.img2sz, f"Image {img['id']} already in stats"
+        for img, img_stats in zip(imgs, tqdm(map_images(image_stats, [ self.img_dir/img['file_name'] for img in imgs ], workers), total=len(imgs))):
+            if img_stats is None: continue
+            self.img2fname[img['id']] = img['file_name']
+            self.img2sz[img['id']] = img_stats[0]
+            self.chn_hists += img_stats[1]
+
+    def add_annotations(self, anns:List[dict]):
+        # build up some maps for later analysis
+        for a in anns:
             img_id = a['image_id']
+            self.num_bboxs += 1
+            self.img2nanns[img_id] += 1
             if self.img2sz.get(img_id, None) == None: continue
             cat_id = a['category_id']
             lbl_id = self.cat2lbl[cat_id]
@@ -171,26 +155,82 @@ class CocoDatasetStats():
             self.img2lbs[img_id].append(lb)
             self.img2l2bs[img_id] = l2bs_for_img
 
-        acc_ncats_per_img = 0.0
-        acc_nboxs_per_img = 0.0
-        for img_id, l2bs in self.img2l2bs.items():
-            acc_ncats_per_img += len(l2bs)
-            for lbl_id, bs in l2bs.items():
-                acc_nboxs_per_img += len(bs)
-
-        self.avg_ncats_per_img = acc_ncats_per_img/self.num_imgs
-        self.avg_nboxs_per_img = acc_nboxs_per_img/self.num_imgs
-
-        acc_nboxs_per_cat = 0.0
-        for lbl_id, ibs in self.l2ibs.items():
-            acc_nboxs_per_cat += len(ibs)
-
-        self.avg_nboxs_per_cat = acc_nboxs_per_cat/self.num_cats
+    def remove_images(self, img_ids:list, workers:int=0):
+        # drop images w/ their annotations from the maps, in place, their files are read again to take them out of the histograms
+        img_ids = set(img_ids)
+        fpaths = [ self.img_dir/self.img2fname[img_id] for img_id in img_ids if img_id in self.img2fname ]
+        for fpath, img_stats in zip(fpaths, map_images(image_stats, fpaths, workers)):
+            assert img_stats is not None, f"Removed image {fpath} is gone, stats need a full recompute"
+            self.chn_hists -= img_stats[1]
+        for img_id in img_ids:
+            self.num_bboxs -= self.img2nanns.pop(img_id, 0)
+            for d in (self.img2fname, self.img2sz, self.img2l2bs, self.img2lbs): d.pop(img_id, None)
+        for lbl_id in list(self.l2ibs.keys()):
+            self.l2ibs[lbl_id] = [ ib for ib in self.l2ibs[lbl_id] if ib[0] not in img_ids ]
+            if len(self.l2ibs[lbl_id]) == 0: del self.l2ibs[lbl_id]
+
+    def summarize(self):
+        # from integer sums, so they don't depend on the order images were added in
+        self.num_imgs = len(self.img2sz)
+        szs = np.array(list(self.img2sz.values()), dtype=np.int64).reshape(-1, 2)
+        self.avg_width, self.avg_height = szs.sum(0)/max(self.num_imgs, 1)
+        self.chn_means, self.chn_stds = hist_mean_std(self.chn_hists)
+
+        acc_nboxs = float(sum([ len(ibs) for ibs in self.l2ibs.values() ]))
+        # categories present, img2l2bs has a slot for every category
+        self.avg_ncats_per_img = float(sum([ sum([ len(bs) > 0 for bs in l2bs.values() ]) for l2bs in self.img2l2bs.values() ]))/self.num_imgs
+        self.avg_nboxs_per_img = acc_nboxs/self.num_imgs
+        self.avg_nboxs_per_cat = acc_nboxs/self.num_cats
+
+    def update(self, new_ann:dict=None, removed_img_ids:list=(), workers:int=0):
+        "Take out `removed_img_ids` w/ their annotations, add images & annotations of `new_ann`, only new image files are read"
+        new_ann = new_ann or {}
+        for c in new_ann.get('categories', []):
+            assert c['id'] in self.cat2name, f"New category {c} needs a full recompute, labels would change"
+        self.remove_images(removed_img_ids, workers=workers)
+        self.add_images(new_ann.get('images', []), workers=workers)
+        self.add_annotations(new_ann.get('annotations', []))
+        self.summarize()
+        self.version += 1
+        return self
+
+def image_stats(img_fpath:Path)->Tuple[Tuple[int, int], np.ndarray]:
+    "(width, height) and [channel, pixel value] counts of an image as RGB, None if no such file"
+    from PIL import Image
+    if not os.path.isfile(img_fpath): return None
+    with Image.open(img_fpath) as img:
+        return img.size, np.array(img.convert('RGB').histogram(), dtype=np.int64).reshape(3, 256)
+
+def hist_mean_std(hists:np.ndarray)->Tuple[np.ndarray, np.ndarray]:
+    "Exact mean and std dev of each channel of [channel, pixel value] counts"
+    vals = np.arange(hists.shape[1], dtype=np.int64)
+    n = np.maximum(hists.sum(1), 1)
+    sums, sqs = (hists*vals).sum(1), (hists*vals*vals).sum(1)
+    var = [ (ni*sq - s*s)/(ni*ni) for ni, s, sq in zip(n.tolist(), sums.tolist(), sqs.tolist()) ] # python ints, n*sq overflows int64
+    return sums/n, np.sqrt(np.array(var, dtype=np.float64))
+
+def map_images(fn:callable, fpaths:list, workers:int=0):
+    "`fn` of each image file in order, in `workers` processes if any"
+    if workers <= 0:
+        yield from map(fn, fpaths)
+        return
+    import multiprocessing
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(fn, fpaths, chunksize=16)
+
+def merge_ann(ann:dict, new_ann:dict=None, removed_img_ids:list=())->dict:
+    "Annotations w/o `removed_img_ids` and their annotations, plus images & annotations of `new_ann`"
+    new_ann = new_ann or {}
+    removed = set(removed_img_ids)
+    return { **ann,
+        'images': [ img for img in ann['images'] if img['id'] not in removed ] + new_ann.get('images', []),
+        'annotations': [ a for a in ann['annotations'] if a['image_id'] not in removed ] + new_ann.get('annotations', []),
+    }
 
 def empty_list()->list: return [] # cannot use lambda as pickling will fail when saving models
 
 # Cell
-def load_stats(ann:dict, img_dir:str, force_reload:bool=False)->CocoDatasetStats:
+def load_stats(ann:dict, img_dir:str, force_reload:bool=False, workers:int=0)->CocoDatasetStats:
     stats_fpath = Path(img_dir).parent/'stats.pkl'
     stats = None
     if os.path.isfile(stats_fpath) and not force_reload:
@@ -198,28 +238,225 @@ def load_stats(ann:dict, img_dir:str, force_reload:bool=False)->CocoDatasetStats
             stats = pickle.load( open(stats_fpath, "rb" ) )
         except Exception as e:
             print(f"Failed to read precomputed stats: {e}")
+    if stats is not None and not hasattr(stats, 'chn_hists'):
+        print("Precomputed stats predate exact channel std devs, recomputing")
+        stats = None
 
     if stats == None:
-        stats = CocoDatasetStats(ann, img_dir)
-        pickle.dump(stats, open(stats_fpath, "wb" ) )
+        stats = CocoDatasetStats(ann, img_dir, workers=workers)
+        save_stats(stats)
+
+    return stats
 
+def save_stats(stats:CocoDatasetStats):
+    stats_fpath = stats.img_dir.parent/'stats.pkl'
+    tmp_fpath = stats_fpath.parent/f'.stats.{os.getpid()}.tmp'
+    with open(tmp_fpath, 'wb') as stats_f: pickle.dump(stats, stats_f)
+    os.replace(tmp_fpath, stats_fpath) # atomic, readers get the old or the new version
+    stats_arrays(stats, prune=True) # write memory mapped annotations of the new content upfront, drop the old ones
+
+def update_stats(ann:dict, img_dir:str, new_ann:dict=None, removed_img_ids:list=(), workers:int=0)->CocoDatasetStats:
+    "Stats of `ann` after taking out `removed_img_ids` and adding `new_ann`'s images & annotations, saved as a new version"
+    stats = load_stats(ann, img_dir, workers=workers)
+    removed_fpaths = [ stats.img_dir/stats.img2fname[img_id] for img_id in removed_img_ids if img_id in stats.img2fname ]
+    if all([ os.path.isfile(fpath) for fpath in removed_fpaths ]):
+        stats.update(new_ann, removed_img_ids, workers=workers)
+    else: # removed images can't be taken out of the histograms w/o their files
+        version = stats.version
+        stats = CocoDatasetStats(merge_ann(ann, new_ann, removed_img_ids), img_dir, workers=workers)
+        stats.version = version+1
+    save_stats(stats)
     return stats
 
 # Cell
+class AnnoArrays():
+    names = ('img_ids', 'img_sizes', 'img_fnames', 'box_offsets', 'box_labels', 'boxes')
+
+    def __init__(self, dirpath):
+        self.dirpath = Path(dirpath)
+        self.arrays = None
+        self._digest = None
+
+    # only send the path to DataLoader workers, each memory maps the arrays on first use
+    def __getstate__(self): return {'dirpath': self.dirpath}
+    def __setstate__(self, state): self.__init__(state['dirpath'])
+
+    def load(self)->dict:
+        if self.arrays is None:
+            self.arrays = { n: np.load(self.dirpath/f'{n}.npy', mmap_mode='r') for n in self.names }
+        return self.arrays
+
+    @property
+    def img_ids(self): return self.load()['img_ids']
+    @property
+    def img_sizes(self): return self.load()['img_sizes']
+    @property
+    def img_fnames(self): return self.load()['img_fnames']
+    @property
+    def box_offsets(self): return self.load()['box_offsets']
+    @property
+    def box_labels(self): return self.load()['box_labels']
+    @property
+    def boxes(self): return self.load()['boxes']
+
+    def __len__(self): return len(self.img_ids)
+
+    @classmethod
+    def arrays_digest(cls, arrays:dict)->str:
+        h = hashlib.sha1()
+        for n in cls.names: h.update(np.ascontiguousarray(arrays[n]))
+        return h.hexdigest()
+
+    def digest(self)->str:
+        # hash of the array contents, to key caches derived from the annotations
+        if self._digest is None: self._digest = self.arrays_digest(self.load())
+        return self._digest
+
+    def img_pos(self, img_ids)->np.ndarray:
+        img_ids = np.asarray(img_ids)
+        pos = np.searchsorted(self.img_ids, img_ids).clip(0, max(0, len(self)-1))
+        assert len(self) > 0 and (self.img_ids[pos] == img_ids).all(), f"Unknown image ids {img_ids[self.img_ids[pos] != img_ids][:5]}..."
+        return pos
+
+    def fname(self, pos:int)->str: return self.img_fnames[pos].decode()
+
+    def lbs(self, pos:int, box_mask:np.ndarray=None)->Tuple[np.ndarray, np.ndarray]:
+        start, end = self.box_offsets[pos], self.box_offsets[pos+1]
+        lbls, boxes = self.box_labels[start:end], self.boxes[start:end] # boxes as x,y,w,h
+        if box_mask is None: return lbls, boxes
+        keep = box_mask[start:end]
+        return lbls[keep], boxes[keep]
+
+    def box_img_pos(self)->np.ndarray: return np.repeat(np.arange(len(self)), np.diff(self.box_offsets))
+
+    def safe_mask(self, min_margin_ratio:float=0., min_width_height_ratio:float=0.)->np.ndarray:
+        # mask over all boxes, computed once per setting then memory mapped like the other arrays
+        name = f'safe_{min_margin_ratio:g}_{min_width_height_ratio:g}'
+        arrays = self.load()
+        if name not in arrays:
+            fpath = self.dirpath/f'{name}.npy'
+            if not os.path.isfile(fpath):
+                img_sizes = self.img_sizes[self.box_img_pos()]
+                mask = boxes_within_bounds(self.boxes, img_sizes, min_margin_ratio, min_width_height_ratio)
+                tmp_fpath = self.dirpath/f'{name}.{os.getpid()}.tmp.npy'
+                np.save(tmp_fpath, mask)
+                os.replace(tmp_fpath, fpath) # atomic, concurrent workers never see a partial mask
+            arrays[name] = np.load(fpath, mmap_mode='r')
+        return arrays[name]
+
+    def safe_counts(self, min_margin_ratio:float=0., min_width_height_ratio:float=0.)->np.ndarray:
+        # num of safe boxes per image, images w/o any should be skipped
+        box_mask = self.safe_mask(min_margin_ratio, min_width_height_ratio)
+        return np.bincount(self.box_img_pos()[box_mask], minlength=len(self))
+
+    def __getitem__(self, pos:int):
+        return (self.fname(pos), tuple(self.img_sizes[pos].tolist()), *self.lbs(pos))
+
+    @classmethod
+    def save(cls, dirpath, **arrays):
+        dirpath = Path(dirpath)
+        dirpath.mkdir(parents=True, exist_ok=True)
+        for f in dirpath.glob('safe_*.npy'): f.unlink() # stale masks of previous arrays
+        for n in cls.names: np.save(dirpath/f'{n}.npy', np.ascontiguousarray(arrays[n]))
+        return cls(dirpath)
+
+ANNO_ARRAYS = weakref.WeakKeyDictionary() # stats -> (version, cache root, AnnoArrays)
+
+def stats_arrays(stats:CocoDatasetStats, dirpath:str=None, force:bool=False, prune:bool=False)->AnnoArrays:
+    root = Path(dirpath or os.environ.get('MCBBOX_ANNO_CACHE') or stats.img_dir.parent/'stats_arrays')
+    version = getattr(stats, 'version', 0)
+    memo = ANNO_ARRAYS.get(stats)
+    if not force and memo is not None and memo[:2] == (version, root): return memo[2]
+
+    img_ids = np.array(sorted(stats.img2sz.keys()), dtype=np.int64)
+    lbs_per_img = [ stats.img2lbs.get(img_id, []) for img_id in img_ids.tolist() ]
+    box_offsets = np.zeros(len(img_ids)+1, dtype=np.int64)
+    box_offsets[1:] = np.cumsum([ len(lbs) for lbs in lbs_per_img ])
+    lbs = np.array([ lb for lbs in lbs_per_img for lb in lbs ], dtype=np.float64).reshape(-1, 5)
+    arrays = dict(
+        img_ids=img_ids,
+        img_sizes=np.array([ stats.img2sz[img_id] for img_id in img_ids.tolist() ], dtype=np.int32).reshape(-1, 2),
+        img_fnames=np.array([ stats.img2fname[img_id] for img_id in img_ids.tolist() ], dtype=np.bytes_),
+        box_offsets=box_offsets,
+        box_labels=lbs[:, 0].astype(np.int32),
+        boxes=lbs[:, 1:].astype(np.float32),
+    )
+    # keyed by content, edited stats get their own arrays
+    digest = AnnoArrays.arrays_digest(arrays)
+    arrays_dir = root/digest[:16]
+    if force or not os.path.isfile(arrays_dir/'meta.json'):
+        tmp_dir = root/f'.{digest[:16]}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        AnnoArrays.save(tmp_dir, **arrays)
+        with open(tmp_dir/'meta.json', 'w') as meta_f:
+            json.dump({ 'digest': digest, 'img_dir': str(stats.img_dir), 'num_imgs': len(img_ids), 'num_bboxs': int(box_offsets[-1]) }, meta_f)
+        shutil.rmtree(arrays_dir, ignore_errors=True) # forced, or left half written
+        try: os.replace(tmp_dir, arrays_dir) # whole directory at once, readers never see half written arrays
+        except OSError: shutil.rmtree(tmp_dir, ignore_errors=True) # another process wrote the same arrays first
+    if prune: # arrays of the dataset's older versions, the cache root may be shared w/ other datasets
+        for meta_fpath in root.glob('*/meta.json'):
+            if meta_fpath.parent == arrays_dir: continue
+            with open(meta_fpath, 'r') as meta_f:
+                if json.load(meta_f).get('img_dir') == str(stats.img_dir): shutil.rmtree(meta_fpath.parent, ignore_errors=True)
+    anno = AnnoArrays(arrays_dir)
+    anno._digest = digest
+    ANNO_ARRAYS[stats] = (version, root, anno)
+    return anno
+
+# Cell
+def boxes_within_bounds(boxes, img_sizes, min_margin_ratio, min_width_height_ratio)->np.ndarray:
+    # boxes as N x (x,y,w,h), img_sizes as N x (width,height) or a single (width,height) for all
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    img_sizes = np.asarray(img_sizes, dtype=np.float64).reshape(-1, 2)
+    xys, whs = boxes[:, :2], boxes[:, 2:]
+    margins = min_margin_ratio*img_sizes
+    big_enough = (whs >= min_width_height_ratio*img_sizes).all(axis=1)
+    within_margins = ((xys >= margins) & (xys <= img_sizes - margins)).all(axis=1)
+    return big_enough & within_margins
+
 def box_within_bounds(bx, by, bw, bh, img_width, img_height, min_margin_ratio, min_width_height_ratio):
-    min_width = min_width_height_ratio*img_width
-    min_height = min_width_height_ratio*img_height
-    if bw < min_width or bh < min_height:
-        return False
-    top_margin = min_margin_ratio*img_height
-    bottom_margin = img_height - top_margin
-    left_margin = min_margin_ratio*img_width
-    right_margin = img_width - left_margin
-    if bx < left_margin or bx > right_margin:
-        return False
-    if by < top_margin or by > bottom_margin:
-        return False
-    return True
+    return bool(boxes_within_bounds([bx, by, bw, bh], [img_width, img_height], min_margin_ratio, min_width_height_ratio)[0])
+
+# Cell
+def files_found(img_dir, fnames)->np.ndarray:
+    # one directory listing instead of a stat call per file, file names are relative to img_dir
+    listed = np.array(os.listdir(os.fsencode(img_dir)), dtype=np.bytes_)
+    return np.isin(np.asarray(fnames, dtype=np.bytes_), listed)
+
+def bulk_lbs(anno:AnnoArrays, poss:np.ndarray, box_mask:np.ndarray=None)->Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # labels, boxes (x,y,w,h) and per image offsets of the (masked) boxes of images at `poss`, in that order
+    poss = np.asarray(poss, dtype=np.int64)
+    starts, counts = anno.box_offsets[poss], np.diff(anno.box_offsets)[poss]
+    img_idx = np.repeat(np.arange(len(poss)), counts)
+    box_idx = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    if box_mask is not None:
+        keep = np.asarray(box_mask)[box_idx]
+        img_idx, box_idx = img_idx[keep], box_idx[keep]
+    offsets = np.zeros(len(poss)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(img_idx, minlength=len(poss)))
+    return anno.box_labels[box_idx], anno.boxes[box_idx], offsets
+
+def label_histograms(anno:AnnoArrays, poss:np.ndarray, box_mask:np.ndarray=None, n_labels:int=None)->np.ndarray:
+    # [image, label] num of (masked) boxes of each image at `poss`, column 0 is background so 0
+    lbls, _, offsets = bulk_lbs(anno, poss, box_mask)
+    lbls = lbls.astype(np.int64)
+    n_labels = n_labels or int(lbls.max(initial=0))+1
+    img_idx = np.repeat(np.arange(len(poss)), np.diff(offsets))
+    return np.bincount(img_idx*n_labels + lbls, minlength=len(poss)*n_labels).reshape(len(poss), n_labels)
+
+def cached_pickle(fpath, build:callable, force_rebuild:bool=False):
+    if os.path.isfile(fpath) and not force_rebuild:
+        try:
+            with open(fpath, 'rb') as f: return pickle.load(f)
+        except Exception as e:
+            print(f"Failed to read cached {fpath}: {e}")
+
+    o = build()
+    Path(fpath).parent.mkdir(parents=True, exist_ok=True)
+    tmp_fpath = f'{fpath}.{os.getpid()}.tmp'
+    with open(tmp_fpath, 'wb') as f: pickle.dump(o, f)
+    os.replace(tmp_fpath, fpath) # concurrent launches never read a half written cache
+    return o
 
 # Cell
 def is_notebook():
@@ -235,7 +472,9 @@ def is_notebook():
         return False      # Probably standard Python interpreter
 
 # Cell
-def overlay_img_bbox(img:Image, l2bs: dict, l2name: dict):
+def overlay_img_bbox(img, l2bs: dict, l2name: dict):
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as mcolors
     l2color = { l: colname for (l, colname) in zip(l2bs.keys(), mcolors.TABLEAU_COLORS.keys()) }
     fig = plt.figure(figsize=(16,10))
     fig = plt.imshow(img)
@@ -245,11 +484,13 @@ def overlay_img_bbox(img:Image, l2bs: dict, l2name: dict):
             fig.axes.add_patch(bbox_to_rect(b, l2color[l]))
 
 def bbox_to_rect(bbox:Tuple[int, int, int, int], color:str):
+    import matplotlib.pyplot as plt
     return plt.Rectangle(
         xy=(bbox[0], bbox[1]), width=bbox[2], height=bbox[3],
         fill=False, edgecolor=color, linewidth=2)
 
 def label_for_bbox(bbox:Tuple[int, int, int, int], label:str):
+    import matplotlib.pyplot as plt
     return plt.text(bbox[0], bbox[1], f"{label}", color='#ffffff', fontsize=12)
 
 # Cell
@@ -266,6 +507,7 @@ class SubCocoWrapper():
         # { images: [{'id':int, 'file_name':str, 'width':int, 'height':int}], categories: [int,...],
         #   annotations: [{'id':int, 'image_id': int, 'category_id': int, 'bbox': (x,y,width,height)}, 'area':float, 'iscrowd':0] }
         # see https://github.com/cocodataset/cocoapi/blob/master/PythonAPI/pycocotools/coco.py
+        from pycocotools.coco import COCO
 
         def toCOCO(rec:dict)->COCO:
             coco = COCO()
@@ -286,12 +528,13 @@ class SubCocoWrapper():
             coco.createIndex()
             return coco
 
-        with io.capture_output() as captured:
+        with redirect_stdout(StringIO()): # COCO api is chatty
             self.target = toCOCO(target)
             self.prediction = toCOCO(prediction)
 
     def metrics(self)->float:
-        with io.capture_output() as captured:
+        from pycocotools.cocoeval import COCOeval
+        with redirect_stdout(StringIO()):
             cocoeval = COCOeval(self.target, self.prediction, "bbox")
             cocoeval.evaluate()
             cocoeval.accumulate()
@@ -300,24 +543,8 @@ class SubCocoWrapper():
 
 # Cell
 def iou_calc(x1,y1,w1,h1, x2,y2,w2,h2):
-    r1 = x1+w1 # right of box1
-    b1 = y1+h1 # bottom of box1
-    r2 = x2+w2 # right of box2
-    b2 = y2+h2 # bottom of box2
-    a1 = 1.0*w1*h1
-    a2 = 1.0*w2*h2
-    ia = 0.0 # intercept
-
-    if x1 <= x2 <= r1:
-        if y1 <= y2 <= b1 or y1 <= b2 <= b1:
-            ia = (min(r1,r2)-max(x1,x2))*(min(b1,b2)-max(y1,y2))
-    elif x1 <= r2 <= r1:
-        if y1 <= y2 <= b1 or y1 <= b2 <= b1:
-            ia = (min(r1,r2)-max(x1,x2))*(min(b1,b2)-max(y1,y2))
-
-    #print(a1, a2, ia)
-    iou = ia/(a1+a2-ia)
-    return iou
+    xyxys = xywh_to_xyxy(torch.tensor([[x1,y1,w1,h1], [x2,y2,w2,h2]], dtype=torch.float64))
+    return float(aligned_overlap(xyxys[0], xyxys[1]))
 
 # Cell
 def match_true_false_neg(pred, tgt, scut=0.5, ithr=0.5):
@@ -405,22 +632,241 @@ def calc_wavg_F1(pred, tgt, scut=0.5, ithr=0.5):
 
     return acc
 
+# Cell
+TP = 0 # outcome of a target, index in counts
+FP = 1
+FN = 2
+
+def numpify(v, dtype=None)->np.ndarray:
+    return np.asarray(v.detach().cpu() if type(v) == torch.Tensor else v, dtype=dtype)
+
+def cat_numpy(vs:list, dtype, width:int=0)->np.ndarray:
+    # 1 conversion for a batch of tensors, lists or arrays, as rows of `width` if given
+    shape = (-1, width) if width else (-1,)
+    if all([ type(v) == torch.Tensor for v in vs ]): return torch.cat([ v.detach().reshape(shape) for v in vs ]).cpu().numpy().astype(dtype, copy=False)
+    return np.concatenate([ numpify(v, dtype).reshape(shape) for v in vs ])
+
+def box_pairs(n_a:np.ndarray, n_b:np.ndarray)->Tuple[np.ndarray, np.ndarray]:
+    # indices of every (a, b) pair of boxes of the same image, e.g. targets & predictions, in a batch of concatenated boxes
+    n_pairs = n_a*n_b
+    pair_img = np.repeat(np.arange(len(n_pairs)), n_pairs)
+    k = np.arange(n_pairs.sum()) - np.repeat(np.cumsum(n_pairs)-n_pairs, n_pairs)
+    a_start, b_start = np.cumsum(n_a)-n_a, np.cumsum(n_b)-n_b
+    return a_start[pair_img] + k//n_b[pair_img], b_start[pair_img] + k%n_b[pair_img]
+
+def pair_iou(a:np.ndarray, b:np.ndarray)->np.ndarray:
+    # IoU of x1,y1,x2,y2 boxes a[i] and b[i]
+    return aligned_overlap(a, b)
+
+def best_pairs(aidx:np.ndarray, bidx:np.ndarray, iou:np.ndarray, n_a:int)->np.ndarray:
+    # b w/ the highest IoU of each a among pairs given, lowest index on ties, -1 if none
+    best = np.full(n_a, -1)
+    order = np.lexsort((-bidx, iou, aidx))
+    last = np.r_[aidx[order][1:] != aidx[order][:-1], True] if len(order) > 0 else np.zeros(0, dtype=bool)
+    best[aidx[order][last]] = bidx[order][last]
+    return best
+
+def greedy_matches(tidx, pidx, iou, same, rows, outcomes, picks):
+    # targets in order, a matched prediction is out of rotation for later targets
+    taken = set()
+    for ti in rows:
+        outcomes[ti], picks[ti] = FN, -1
+        at = tidx == ti
+        for outcome, cands in ((TP, at & same), (FP, at)):
+            cands = [ (-iou[k], pidx[k]) for k in np.flatnonzero(cands) if pidx[k] not in taken ]
+            if cands:
+                outcomes[ti], picks[ti] = outcome, min(cands)[1]
+                taken.add(picks[ti])
+                break
+
+def match_boxes(preds:List[dict], tgts:List[dict], scut=0.5, ithr=0.5)->Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    "Image index, label and outcome, TP, FP or FN, of every target in a batch, and # of predictions of each image left unmatched"
+    keep = cat_numpy([ p['scores'] for p in preds ], np.float64) > scut
+    pimgs = np.repeat(np.arange(len(preds)), [ len(p['scores']) for p in preds ])[keep]
+    pboxs, pls = cat_numpy([ p['boxes'] for p in preds ], np.float64, 4)[keep], cat_numpy([ p['labels'] for p in preds ], np.int64)[keep]
+    tboxs, tls = cat_numpy([ t['boxes'] for t in tgts ], np.float64, 4), cat_numpy([ t['labels'] for t in tgts ], np.int64)
+    n_preds, n_tgts = np.bincount(pimgs, minlength=len(preds)), np.array([ len(t['labels']) for t in tgts ], dtype=np.int64)
+    timgs = np.repeat(np.arange(len(tgts)), n_tgts)
+    # only pairs of the same image above the IoU threshold can match
+    tidx, pidx = box_pairs(n_tgts, n_preds)
+    iou = pair_iou(tboxs[tidx], pboxs[pidx])
+    above = iou >= ithr
+    tidx, pidx, iou = tidx[above], pidx[above], iou[above]
+    same = tls[tidx] == pls[pidx]
+    best_true, best_any = best_pairs(tidx[same], pidx[same], iou[same], len(tls)), best_pairs(tidx, pidx, iou, len(tls))
+    outcomes = np.where(best_true >= 0, TP, np.where(best_any >= 0, FP, FN))
+    picks = np.where(best_true >= 0, best_true, best_any)
+    # same as matching target by target unless 2 targets take the same prediction, only images where they do are matched so
+    taken, n_taken = np.unique(picks[picks >= 0], return_counts=True)
+    if (n_taken > 1).any():
+        clash_imgs = np.unique(pimgs[taken[n_taken > 1]])
+        greedy_matches(tidx, pidx, iou, same, np.flatnonzero(np.isin(timgs, clash_imgs)), outcomes, picks)
+    n_unmatched = n_preds - np.bincount(pimgs[picks[picks >= 0]], minlength=len(preds))
+    return timgs, tls, outcomes, n_unmatched
+
+def f1_scores(counts:np.ndarray)->np.ndarray:
+    # F1 from [..., (TP, FP, FN)] counts, 0 w/o true positives
+    tp, fp, fn = counts[..., TP], counts[..., FP], counts[..., FN]
+    return np.where(tp > 0, 2*tp/np.maximum(2*tp+fp+fn, 1), 0.)
+
+def weighted_f1(counts:np.ndarray)->np.ndarray:
+    # F1 of labels in [..., label, (TP, FP, FN)] counts, averaged weighted by # of boxes per label
+    support = counts.sum(-1)
+    return (f1_scores(counts)*support).sum(-1)/np.maximum(support.sum(-1), 1)
+
+class F1Accumulator():
+    def __init__(self, num_labels:int=1):
+        self.reset(num_labels)
+
+    def reset(self, num_labels:int=None):
+        self.counts = np.zeros((num_labels or len(self.counts), 3), dtype=np.int64) # [label, (TP, FP, FN)]
+        self.img_f1s = []
+
+    def update_matches(self, img_idxs:np.ndarray, labels:np.ndarray, outcomes:np.ndarray, n_unmatched:np.ndarray)->np.ndarray:
+        "Image index, label and outcome of every target in a batch, and # of unmatched predictions of each image, returns F1 of each image"
+        n_labels = max(len(self.counts), int(labels.max(initial=0))+1)
+        if n_labels > len(self.counts): self.counts = np.pad(self.counts, ((0, n_labels-len(self.counts)), (0, 0)))
+        img_counts = np.zeros((len(n_unmatched), n_labels, 3), dtype=np.int64)
+        np.add.at(img_counts, (img_idxs, labels, outcomes), 1)
+        img_counts[:, 0, FP] += n_unmatched
+        self.counts += img_counts.sum(0)
+        img_f1s = weighted_f1(img_counts)
+        self.img_f1s.append(img_f1s)
+        return img_f1s
+
+    def update(self, preds:List[dict], tgts:List[dict], scut=0.5, ithr=0.5)->np.ndarray:
+        n = min(len(preds), len(tgts))
+        if n == 0: return np.zeros(0)
+        return self.update_matches(*match_boxes(preds[:n], tgts[:n], scut=scut, ithr=ithr))
+
+    def compute(self)->dict:
+        support = self.counts.sum(1)
+        f1s = f1_scores(self.counts)
+        return {
+            'f1_micro': float(f1_scores(self.counts.sum(0))),
+            'f1_macro': float(f1s[support > 0].mean()) if (support > 0).any() else 0.,
+            'f1_weighted': float(weighted_f1(self.counts)),
+            'f1_img_mean': float(np.concatenate(self.img_f1s).mean()) if len(self.img_f1s) > 0 else 0.,
+        }
+
+# Cell
+def greedy_by_score(pidx:np.ndarray, tidx:np.ndarray, iou:np.ndarray, rows:np.ndarray, picks:np.ndarray):
+    # predictions in descending score order, a matched target is out of rotation for later predictions
+    taken = set()
+    for pi in rows:
+        cands = [ (-iou[k], tidx[k]) for k in np.flatnonzero(pidx == pi) if tidx[k] not in taken ]
+        picks[pi] = min(cands)[1] if cands else -1
+        if cands: taken.add(picks[pi])
+
+def pick_by_score(pidx:np.ndarray, tidx:np.ndarray, iou:np.ndarray, n_preds:int, pimgs:np.ndarray, timgs:np.ndarray, by_score:np.ndarray)->np.ndarray:
+    "Target each prediction takes among (prediction, target) pairs given, predictions in descending score order `by_score`, -1 if none"
+    picks = best_pairs(pidx, tidx, iou, n_preds)
+    # same as matching in score order unless 2 predictions take the same target, only images where they do are matched so
+    taken, n_taken = np.unique(picks[picks >= 0], return_counts=True)
+    if (n_taken > 1).any():
+        clash_imgs = np.unique(timgs[taken[n_taken > 1]])
+        greedy_by_score(pidx, tidx, iou, by_score[np.isin(pimgs[by_score], clash_imgs)], picks)
+    return picks
+
+def match_by_score(preds:List[dict], tgts:List[dict], iou_thrs:Tuple[float]=(0.5,))->Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    "Label and score of every prediction in a batch, whether it's a true positive at each of `iou_thrs`, and # of targets per label"
+    pscores = cat_numpy([ p['scores'] for p in preds ], np.float64)
+    pboxs, pls = cat_numpy([ p['boxes'] for p in preds ], np.float64, 4), cat_numpy([ p['labels'] for p in preds ], np.int64)
+    tboxs, tls = cat_numpy([ t['boxes'] for t in tgts ], np.float64, 4), cat_numpy([ t['labels'] for t in tgts ], np.int64)
+    n_preds, n_tgts = np.array([ len(p['scores']) for p in preds ], dtype=np.int64), np.array([ len(t['labels']) for t in tgts ], dtype=np.int64)
+    pimgs, timgs = np.repeat(np.arange(len(preds)), n_preds), np.repeat(np.arange(len(tgts)), n_tgts)
+    pidx, tidx = box_pairs(n_preds, n_tgts)
+    same = pls[pidx] == tls[tidx]
+    pidx, tidx = pidx[same], tidx[same]
+    iou = pair_iou(pboxs[pidx], tboxs[tidx])
+    by_score = np.argsort(-pscores, kind='stable')
+    tps = np.zeros((len(pscores), len(iou_thrs)), dtype=bool)
+    for k, ithr in enumerate(iou_thrs):
+        above = iou >= ithr
+        tps[:, k] = pick_by_score(pidx[above], tidx[above], iou[above], len(pscores), pimgs, timgs, by_score) >= 0
+    return pls, pscores, tps, np.bincount(tls, minlength=1)
+
+def score_cutoffs(labels:np.ndarray, cutoff, default:float=0.5)->np.ndarray:
+    "Score cutoff of each prediction, `cutoff` is 1 for all labels or a dict of label to cutoff, `default` for labels not in it"
+    if not isinstance(cutoff, dict): return np.full(len(labels), cutoff, dtype=np.float64)
+    lut = np.full(max([ int(labels.max(initial=0)), *cutoff.keys() ])+1, default, dtype=np.float64)
+    lut[list(cutoff.keys())] = list(cutoff.values())
+    return lut[labels]
+
+class ThresholdSweep():
+    def __init__(self, iou_thrs:Tuple[float]=(0.5, 0.75)):
+        self.iou_thrs = tuple(iou_thrs)
+        self.reset()
+
+    def reset(self):
+        self.batches = [] # [(labels, scores, tps)]
+        self.n_tgts = np.zeros(1, dtype=np.int64) # per label
+
+    def update(self, preds:List[dict], tgts:List[dict]):
+        n = min(len(preds), len(tgts))
+        if n == 0: return
+        labels, scores, tps, n_tgts = match_by_score(preds[:n], tgts[:n], self.iou_thrs)
+        self.batches.append((labels, scores, tps))
+        n_labels = max(len(self.n_tgts), len(n_tgts))
+        self.n_tgts = np.pad(self.n_tgts, (0, n_labels-len(self.n_tgts))) + np.pad(n_tgts, (0, n_labels-len(n_tgts)))
+
+    def compute(self)->dict:
+        "Label, threshold and precision, recall & F1 [threshold, iou_thr] of every threshold, by label and descending threshold"
+        if len(self.batches) == 0: self.batches.append((np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros((0, len(self.iou_thrs)), dtype=bool)))
+        labels, scores, tps = [ np.concatenate(parts) for parts in zip(*self.batches) ]
+        order = np.lexsort((-scores, labels))
+        labels, scores, tps = labels[order], scores[order], tps[order]
+        seg_start = np.searchsorted(labels, labels)
+        cum_tps = np.cumsum(tps, axis=0)
+        cum_tps = cum_tps - np.where(seg_start[:, None] > 0, cum_tps[seg_start-1], 0) # restart at each label
+        n_dets = np.arange(len(labels)) - seg_start + 1
+        n_tgts = np.pad(self.n_tgts, (0, max(0, int(labels.max(initial=0))+1-len(self.n_tgts))))[labels]
+        precision = cum_tps/n_dets[:, None]
+        recall = cum_tps/np.maximum(n_tgts, 1)[:, None]
+        f1 = np.where(cum_tps > 0, 2*precision*recall/np.maximum(precision+recall, 1e-9), 0.)
+        # tied scores are kept or dropped together, only the last of them is a threshold
+        last = np.r_[(labels[1:] != labels[:-1]) | (scores[1:] != scores[:-1]), True]
+        next_lower = np.r_[np.where(labels[1:] == labels[:-1], scores[1:], 0.), 0.]
+        return { 'labels': labels[last], 'thresholds': ((scores+next_lower)/2)[last],
+                 'precision': precision[last], 'recall': recall[last], 'f1': f1[last], 'iou_thrs': self.iou_thrs }
+
+    def curves(self)->Dict[int, dict]:
+        "PR curve of each label, thresholds and precision, recall & F1 [threshold, iou_thr] by descending threshold"
+        res = self.compute()
+        labels, starts = np.unique(res['labels'], return_index=True)
+        ends = np.r_[starts[1:], len(res['labels'])]
+        return { int(l): { k: res[k][s:e] for k in ('thresholds', 'precision', 'recall', 'f1') } for l, s, e in zip(labels, starts, ends) }
+
+    def best_thresholds(self, iou_thr:float=None)->Dict[int, dict]:
+        "Threshold of highest F1 of each label at `iou_thr`, by default the 1st of `iou_thrs`, the highest of equally good ones"
+        res = self.compute()
+        k = self.iou_thrs.index(iou_thr) if iou_thr is not None else 0
+        labels, f1 = res['labels'], res['f1'][:, k]
+        order = np.lexsort((res['thresholds'], f1, labels))
+        best = order[np.r_[labels[order][1:] != labels[order][:-1], True]] if len(order) > 0 else order
+        return { int(labels[i]): { 'threshold': float(res['thresholds'][i]) if f1[i] > 0 else float('inf'), 'f1': float(f1[i]),
+                                   'precision': float(res['precision'][i, k]), 'recall': float(res['recall'][i, k]) } for i in best }
+
+    def cutoffs(self, iou_thr:float=None)->Dict[int, float]:
+        return { l: best['threshold'] for l, best in self.best_thresholds(iou_thr).items() }
+
 # Cell
 def clamp_fn(lo, hi):
     return lambda v: min(hi,max(lo,v))
 
+def pred_arrays(pred:dict, cutoff=0.5, img_sz:int=None)->Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    "Labels, boxes & scores of `pred` scoring above `cutoff`, 1 for all labels or per label, box coords clipped to [0, img_sz] if given"
+    lbls = numpify(pred['labels'], np.int64).reshape(-1)
+    boxes = numpify(pred['boxes'], np.float64).reshape(-1, 4)
+    scores = numpify(pred['scores'], np.float64).reshape(-1) if 'scores' in pred else np.ones(len(lbls))
+    keep = scores > score_cutoffs(lbls, cutoff)
+    lbls, boxes, scores = lbls[keep], boxes[keep], scores[keep]
+    if img_sz is not None: boxes = np.clip(boxes, 0, img_sz)
+    return lbls, boxes, scores
+
 def digest_pred(l2name, pred, cutoff=0.5, img_sz=128):
-    scores = pred['scores']
-    pass_idxs = [i for i in range(len(scores)) if scores[i] > cutoff]
-    lbls = pred['labels'][pass_idxs]
-    bboxs = pred['boxes'][pass_idxs]
-    if len(pass_idxs) > 1:
-        lbls = lbls.squeeze()
-        bboxs = bboxs.squeeze()
+    # cutoff is 1 score cutoff for all labels or per label ones, e.g. from ThresholdSweep.cutoffs()
+    lbls, boxes, _ = pred_arrays(pred, cutoff, img_sz)
     l2bs = defaultdict(lambda: [])
-    for l, b in zip(lbls.tolist(), bboxs.tolist()):
-        l = int(l)
-        x,y,w,h = map(clamp_fn(0,img_sz), b)
-        bs = l2bs[l]
-        bs.append((x,y,w,h))
+    for l in np.unique(lbls).tolist(): l2bs[l] = list(map(tuple, boxes[lbls == l].tolist()))
     return l2bs
\ No newline at end of file
@@ -0,0 +1,105 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 17_subcoco_weights.ipynb (unless otherwise specified).
+
+__all__ = ['WeightStore', 'ALIGN', 'build_model', 'build_times']
+
+# Cell
+import copy
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+import time
+import torch
+
+from collections import OrderedDict
+from pathlib import Path
+from torch.nn import Module
+from typing import Callable, Dict
+
+# Cell
+ALIGN = 64 # bytes, so every tensor can be viewed in place from the mapped file
+
+class WeightStore():
+    def __init__(self, root:str=None, keep_checkpoints:int=4):
+        self.root = Path(root or os.environ.get('MCBBOX_WEIGHTS', Path.home()/'.cache'/'mcbbox'/'weights'))
+        self.keep_checkpoints = keep_checkpoints
+
+    def has(self, key:str)->bool:
+        return (self.root/key/'index.json').is_file()
+
+    def save(self, key:str, state:Dict[str, torch.Tensor]):
+        assert '/' not in key, f"Bad weights key {key}"
+        tmp_dir = self.root/f'.{key}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        index, offset = OrderedDict(), 0
+        with open(tmp_dir/'tensors.bin', 'wb') as bin_f:
+            for name, t in state.items():
+                t = t.detach().cpu().contiguous()
+                arr = (t.view(torch.int16) if t.dtype == torch.bfloat16 else t).numpy() # numpy has no bf16
+                offset = -(-offset//ALIGN)*ALIGN
+                bin_f.seek(offset)
+                bin_f.write(arr.tobytes())
+                index[name] = { 'dtype': str(t.dtype)[len('torch.'):], 'shape': list(t.shape), 'offset': offset, 'nbytes': arr.nbytes }
+                offset += arr.nbytes
+        with open(tmp_dir/'index.json', 'w') as index_f: json.dump(index, index_f)
+        shutil.rmtree(self.root/key, ignore_errors=True)
+        os.replace(tmp_dir, self.root/key)
+
+    def load(self, key:str)->Dict[str, torch.Tensor]:
+        with open(self.root/key/'index.json', 'r') as index_f: index = json.load(index_f, object_pairs_hook=OrderedDict)
+        bin_fpath = self.root/key/'tensors.bin'
+        buf = np.memmap(bin_fpath, dtype=np.uint8, mode='c') if os.path.getsize(bin_fpath) > 0 else np.zeros(0, dtype=np.uint8)
+        state = OrderedDict()
+        for name, t in index.items():
+            arr = buf[t['offset']:t['offset']+t['nbytes']].view('int16' if t['dtype'] == 'bfloat16' else t['dtype']).reshape(t['shape'])
+            state[name] = torch.from_numpy(arr).view(torch.bfloat16) if t['dtype'] == 'bfloat16' else torch.from_numpy(arr)
+        return state
+
+    def remove(self, key:str):
+        shutil.rmtree(self.root/key, ignore_errors=True)
+
+    def load_checkpoint(self, fpath:str)->Dict[str, torch.Tensor]:
+        # keyed by path, size and mtime, so an overwritten checkpoint is unpickled again
+        st = os.stat(fpath)
+        key = 'ckpt-'+hashlib.sha1(f'{os.path.abspath(fpath)}:{st.st_size}:{st.st_mtime_ns}'.encode()).hexdigest()[:16]
+        if not self.has(key):
+            ckpt = torch.load(fpath, map_location='cpu')
+            self.save(key, ckpt.get('state_dict', ckpt))
+            self.prune_checkpoints(keep=key)
+        return self.load(key)
+
+    def prune_checkpoints(self, keep:str):
+        ckpt_dirs = sorted(self.root.glob('ckpt-*'), key=lambda d: d.stat().st_mtime, reverse=True)
+        for ckpt_dir in ckpt_dirs[self.keep_checkpoints:]:
+            if ckpt_dir.name != keep: self.remove(ckpt_dir.name)
+
+# Cell
+_templates = {}
+build_times = []
+
+def build_model(arch:str, build:Callable[[bool], Module], pretrained:bool=True, store:WeightStore=None)->Module:
+    "Model of `arch`, `build(pretrained)` is only called the first time, w/ pretrained=True only if its weights aren't stored yet"
+    start = time.perf_counter()
+    if (arch, pretrained) in _templates:
+        source = 'template'
+    elif not pretrained:
+        source = 'scratch'
+        _templates[(arch, pretrained)] = build(False)
+    else:
+        store = store or WeightStore()
+        if store.has(arch):
+            source = 'store'
+            model = build(False)
+            model.load_state_dict(store.load(arch))
+        else:
+            source = 'download'
+            model = build(True)
+            store.save(arch, model.state_dict())
+        _templates[(arch, pretrained)] = model
+    model = copy.deepcopy(_templates[(arch, pretrained)])
+    secs = time.perf_counter()-start
+    build_times.append({ 'arch': arch, 'pretrained': pretrained, 'source': source, 'secs': secs })
+    print(f"Built {arch} from {source} in {secs:.2f}s")
+    return model
\ No newline at end of file
@@ -0,0 +1,10 @@
+#!/usr/bin/python
+import sys
+from mcbbox.subcoco_benchmark import *
+
+# e.g. python run_subcoco_benchmark.py frcnn effdet_ivf, default runs all pipelines
+if __name__ == '__main__': # pipelines run in spawned processes
+    pipelines = sys.argv[1:] if len(sys.argv) > 1 else PIPELINES
+    results = run_benchmarks(pipelines, datadir='workspace', n_imgs=32, img_sz=128, bs=2, steps=10, warmup=2,
+                             out_fpath='workspace/train_throughput.jsonl')
+    sys.exit(f'Benchmark ended, {len(results)} results appended to workspace/train_throughput.jsonl')
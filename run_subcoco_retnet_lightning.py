@@ -13,7 +13,7 @@ stats = load_stats(train_json, img_dir=img_dir, force_reload=False)
 img_sz=512
 retnet_model, last_save_fname = run_training(
         stats, 'models', img_dir, resume_ckpt_fname=f'retnet-subcoco-512-epoch=009-val_acc=0.000.ckpt', img_sz=img_sz, 
-        bs=4, acc=8, workers=4, head_runs=0, full_runs=100, monitor='val_acc', mode='max', save_top=-1, calc_metrics=True, patience=10)
+        bs=4, acc=8, workers=4, head_runs=0, full_runs=100, monitor='val_acc', mode='max', save_top=3, calc_metrics=True, patience=10)
 model_save_path = f"models/retnet-{froot}-{img_sz}-last.saved"
 save_final(retnet_model, model_save_path)
 sys.exit(f'Run ended, model saved to {model_save_path}')